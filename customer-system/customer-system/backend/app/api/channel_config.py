@@ -1,17 +1,17 @@
 # -*- coding: utf-8 -*-
 """Message Channel Configuration API"""
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Dict, Any
-import sqlite3
-import os
 import json
 
-router = APIRouter(prefix="/api/channel-config", tags=["Channel Configuration"])
+from app.database import get_db
+from app.services.channel_registry import channel_registry
 
-# Database path
-DB_PATH = r'G:\aiqywx\customer-system\customer-system\backend\customer_system.db'
+router = APIRouter(prefix="/api/channel-config", tags=["Channel Configuration"])
 
 # Models
 class ChannelConfigResponse(BaseModel):
@@ -30,103 +30,87 @@ class ChannelConfigUpdate(BaseModel):
     is_enabled: Optional[bool] = None
     config_data: Optional[Dict[str, Any]] = None
 
+def _load_config_data(value) -> Dict[str, Any]:
+    """Parse config_data (TEXT in SQLite, already decoded on PostgreSQL)"""
+    if isinstance(value, dict):
+        return value
+    return json.loads(value) if value else {}
+        
+def _row_to_channel(row) -> Dict[str, Any]:
+    return {
+        'id': row['id'],
+        'channel_type': row['channel_type'],
+        'channel_name': row['channel_name'],
+        'is_enabled': bool(row['is_enabled']),
+        'config_data': _load_config_data(row['config_data'])
+    }
+        
 # API Endpoints
 @router.get("/list", response_model=ChannelConfigListResponse)
-async def list_channels():
+async def list_channels(db: AsyncSession = Depends(get_db)):
     """List all channel configurations"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) as count FROM channel_configs")
-        total = cursor.fetchone()['count']
-        
-        cursor.execute("SELECT * FROM channel_configs ORDER BY id ASC")
-        
-        channels = []
-        for row in cursor.fetchall():
-            config_data = json.loads(row['config_data']) if row['config_data'] else {}
-            channels.append({
-                'id': row['id'],
-                'channel_type': row['channel_type'],
-                'channel_name': row['channel_name'],
-                'is_enabled': bool(row['is_enabled']),
-                'config_data': config_data
-            })
-        
-        conn.close()
-        return {"channels": channels, "total": total}
+        result = await db.execute(text("SELECT * FROM channel_configs ORDER BY id ASC"))
+        channels = [_row_to_channel(row) for row in result.mappings().all()]
+        return {"channels": channels, "total": len(channels)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{channel_id}")
-async def get_channel(channel_id: int):
+async def get_channel(channel_id: int, db: AsyncSession = Depends(get_db)):
     """Get channel config by ID"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM channel_configs WHERE id = ?", (channel_id,))
-        row = cursor.fetchone()
+        result = await db.execute(
+            text("SELECT * FROM channel_configs WHERE id = :id"), {"id": channel_id}
+        )
+        row = result.mappings().first()
         
         if not row:
             raise HTTPException(status_code=404, detail="Channel not found")
         
-        config_data = json.loads(row['config_data']) if row['config_data'] else {}
-        channel = {
-            'id': row['id'],
-            'channel_type': row['channel_type'],
-            'channel_name': row['channel_name'],
-            'is_enabled': bool(row['is_enabled']),
-            'config_data': config_data
-        }
-        
-        conn.close()
-        return channel
+        return _row_to_channel(row)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.put("/{channel_id}")
-async def update_channel(channel_id: int, update: ChannelConfigUpdate):
+async def update_channel(channel_id: int, update: ChannelConfigUpdate, db: AsyncSession = Depends(get_db)):
     """Update channel configuration"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cursor = conn.cursor()
-        
         # Check if exists
-        cursor.execute("SELECT id FROM channel_configs WHERE id = ?", (channel_id,))
-        if not cursor.fetchone():
+        result = await db.execute(
+            text("SELECT id FROM channel_configs WHERE id = :id"), {"id": channel_id}
+        )
+        if result.first() is None:
             raise HTTPException(status_code=404, detail="Channel not found")
         
         # Build update query
         updates = []
-        params = []
+        params: Dict[str, Any] = {"id": channel_id}
         
         if update.channel_name is not None:
-            updates.append("channel_name = ?")
-            params.append(update.channel_name)
+            updates.append("channel_name = :channel_name")
+            params["channel_name"] = update.channel_name
         
         if update.is_enabled is not None:
-            updates.append("is_enabled = ?")
-            params.append(1 if update.is_enabled else 0)
+            updates.append("is_enabled = :is_enabled")
+            params["is_enabled"] = update.is_enabled
         
         if update.config_data is not None:
-            updates.append("config_data = ?")
-            params.append(json.dumps(update.config_data))
+            updates.append("config_data = :config_data")
+            params["config_data"] = json.dumps(update.config_data)
         
         if not updates:
             raise HTTPException(status_code=400, detail="No fields to update")
         
-        params.append(channel_id)
-        query = f"UPDATE channel_configs SET {', '.join(updates)} WHERE id = ?"
-        
-        cursor.execute(query, params)
-        conn.commit()
-        conn.close()
+        # updated_at 是渠道配置注册表的版本号
+        updates.append("updated_at = CURRENT_TIMESTAMP")
+        await db.execute(
+            text(f"UPDATE channel_configs SET {', '.join(updates)} WHERE id = :id"), params
+        )
+        await db.commit()
+        channel_registry.invalidate()
         
         return {"success": True, "message": "Channel updated successfully"}
     except HTTPException:
@@ -135,25 +119,21 @@ async def update_channel(channel_id: int, update: ChannelConfigUpdate):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/stats/summary")
-async def get_channel_stats():
+async def get_channel_stats(db: AsyncSession = Depends(get_db)):
     """Get channel statistics summary"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
         # Get channel counts
-        cursor.execute("""
+        result = await db.execute(text("""
             SELECT 
                 COUNT(*) as total,
-                SUM(CASE WHEN is_enabled = 1 THEN 1 ELSE 0 END) as enabled,
-                SUM(CASE WHEN is_enabled = 0 THEN 1 ELSE 0 END) as disabled
+                SUM(CASE WHEN is_enabled THEN 1 ELSE 0 END) as enabled,
+                SUM(CASE WHEN is_enabled THEN 0 ELSE 1 END) as disabled
             FROM channel_configs
-        """)
-        stats = cursor.fetchone()
+        """))
+        stats = result.mappings().first()
         
         # Get template usage by channel
-        cursor.execute("""
+        result = await db.execute(text("""
             SELECT 
                 cc.channel_name,
                 COUNT(mt.id) as template_count
@@ -161,11 +141,10 @@ async def get_channel_stats():
             LEFT JOIN message_templates mt ON mt.channel_config_id = cc.id
             GROUP BY cc.id, cc.channel_name
             ORDER BY template_count DESC
-        """)
+        """))
         usage = [{'channel': row['channel_name'], 'templates': row['template_count']} 
-                 for row in cursor.fetchall()]
+                 for row in result.mappings().all()]
         
-        conn.close()
         return {
             "total_channels": stats['total'],
             "enabled_channels": stats['enabled'],
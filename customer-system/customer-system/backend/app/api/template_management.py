@@ -1,17 +1,16 @@
 # -*- coding: utf-8 -*-
 """Message Template Management API"""
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional, Dict, Any
-import sqlite3
-import os
 import json
 
-router = APIRouter(prefix="/api/template", tags=["Message Templates"])
+from app.database import get_db
 
-# Database path - using absolute path
-DB_PATH = r'G:\aiqywx\customer-system\customer-system\backend\customer_system.db'
+router = APIRouter(prefix="/api/template", tags=["Message Templates"])
 
 # Models matching actual database schema
 class TemplateResponse(BaseModel):
@@ -34,119 +33,89 @@ class TemplateListResponse(BaseModel):
     templates: List[TemplateResponse]
     total: int
 
+def _load_json_list(value) -> list:
+    """Parse a JSON list column (TEXT in SQLite, already decoded on PostgreSQL)"""
+    if isinstance(value, list):
+        return value
+    if not value or value == 'None':
+        return []
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return []
+        
+def _row_to_template(row) -> Dict[str, Any]:
+    return {
+        'id': row['id'],
+        'name': row['name'],
+        'module_type': row['module_type'],
+        'category': row['category'],
+        'content': row['content'],
+        'content_type': row['content_type'],
+        'channel_config_id': row['channel_config_id'],
+        'target_config': row['target_config'],
+        'push_mode': row['push_mode'],
+        'keywords': _load_json_list(row['keywords']),
+        'schedule_time': row['schedule_time'],
+        'repeat_type': row['repeat_type'],
+        'targets': _load_json_list(row['targets']),
+        'is_enabled': bool(row['is_enabled'])
+    }
+        
 # API Endpoints
 @router.get("/list", response_model=TemplateListResponse)
-async def list_templates(page: int = 1, page_size: int = 20):
+async def list_templates(page: int = 1, page_size: int = 20, db: AsyncSession = Depends(get_db)):
     """List all templates"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) as count FROM message_templates")
-        total = cursor.fetchone()['count']
+        total = (await db.execute(text("SELECT COUNT(*) FROM message_templates"))).scalar()
         
         offset = (page - 1) * page_size
-        cursor.execute("""
+        result = await db.execute(text("""
             SELECT * FROM message_templates
             ORDER BY created_at DESC
-            LIMIT ? OFFSET ?
-        """, (page_size, offset))
-        
-        templates = []
-        for row in cursor.fetchall():
-            # 安全解析JSON字段
-            try:
-                keywords = json.loads(row['keywords']) if row['keywords'] and row['keywords'] != 'None' else []
-            except:
-                keywords = []
-            
-            try:
-                targets = json.loads(row['targets']) if row['targets'] and row['targets'] != 'None' else []
-            except:
-                targets = []
-            
-            templates.append({
-                'id': row['id'],
-                'name': row['name'],
-                'module_type': row['module_type'],
-                'category': row['category'],
-                'content': row['content'],
-                'content_type': row['content_type'],
-                'channel_config_id': row['channel_config_id'],
-                'target_config': row['target_config'],
-                'push_mode': row['push_mode'],
-                'keywords': keywords,
-                'schedule_time': row['schedule_time'],
-                'repeat_type': row['repeat_type'],
-                'targets': targets,
-                'is_enabled': bool(row['is_enabled'])
-            })
+            LIMIT :limit OFFSET :offset
+        """), {"limit": page_size, "offset": offset})
         
-        conn.close()
+        templates = [_row_to_template(row) for row in result.mappings().all()]
         return {"templates": templates, "total": total}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/{template_id}")
-async def get_template(template_id: int):
+async def get_template(template_id: int, db: AsyncSession = Depends(get_db)):
     """Get template by ID"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT * FROM message_templates WHERE id = ?", (template_id,))
-        row = cursor.fetchone()
+        result = await db.execute(
+            text("SELECT * FROM message_templates WHERE id = :id"), {"id": template_id}
+        )
+        row = result.mappings().first()
         
         if not row:
             raise HTTPException(status_code=404, detail="Template not found")
         
-        template = {
-            'id': row['id'],
-            'name': row['name'],
-            'module_type': row['module_type'],
-            'category': row['category'],
-            'content': row['content'],
-            'content_type': row['content_type'],
-            'channel_config_id': row['channel_config_id'],
-            'target_config': row['target_config'],
-            'push_mode': row['push_mode'],
-            'keywords': json.loads(row['keywords']) if row['keywords'] else [],
-            'schedule_time': row['schedule_time'],
-            'repeat_type': row['repeat_type'],
-            'targets': json.loads(row['targets']) if row['targets'] else [],
-            'is_enabled': bool(row['is_enabled'])
-        }
-        
-        conn.close()
-        return template
+        return _row_to_template(row)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/preview/{template_id}")
-async def preview_template(template_id: int):
+async def preview_template(template_id: int, db: AsyncSession = Depends(get_db)):
     """Preview template with sample data"""
     try:
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT content FROM message_templates WHERE id = ?", (template_id,))
-        row = cursor.fetchone()
+        result = await db.execute(
+            text("SELECT content FROM message_templates WHERE id = :id"), {"id": template_id}
+        )
+        content = result.scalar()
         
-        if not row:
+        if content is None:
             raise HTTPException(status_code=404, detail="Template not found")
         
         from datetime import datetime
-        content = row['content']
         content = content.replace('{current_date}', datetime.now().strftime('%Y-%m-%d'))
         content = content.replace('{pending_count}', '5')
         content = content.replace('{project_name}', 'Sample Project')
         
-        conn.close()
         return {"preview_content": content}
     except HTTPException:
         raise
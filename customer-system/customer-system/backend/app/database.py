@@ -1,26 +1,319 @@
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+"""
+数据库与Redis连接配置
+
+所有参数通过环境变量配置（见 .env.example）：
+- 连接池：DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE / DB_POOL_PRE_PING
+- SQL日志：DB_ECHO（false / true / debug）
+- asyncpg 预编译语句缓存：DB_STATEMENT_CACHE_SIZE（使用 PgBouncer 事务模式时设为 0）
+- 只读副本：DATABASE_READ_URL，只读查询通过 get_read_db / async_read_session_maker 访问
+- Redis 在首次调用 get_redis() 时才连接，导入本模块不会访问 Redis；
+  连接失败后每隔 REDIS_RETRY_INTERVAL 秒重试一次，期间返回 None（调用方降级）
+- 异步Redis客户端（get_async_redis）同样延迟创建，连接失败在执行命令时由调用方降级
+
+ORM 会话（async_session_maker / get_db）和原生SQL（db_pool）共用同一个引擎和连接池
+"""
+from sqlalchemy import text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncEngine, AsyncSession, async_sessionmaker
 from sqlalchemy.orm import declarative_base
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
 import os
+import re
+import time
+import logging
+import threading
 import redis
+import redis.asyncio as aioredis
+
+from app.services.metrics import MetricFamily, instrument_pool, metrics
+from app.services.tracing import instrument_engine, wrap_db_connection
+
+logger = logging.getLogger(__name__)
 
 # 默认使用 SQLite，生产环境使用 PostgreSQL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./customer_system.db")
+# 只读副本（为空时只读查询也走主库）
+DATABASE_READ_URL = os.getenv("DATABASE_READ_URL", "")
+
+# 连接池配置（SQLite 不使用）
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+
+# SQL日志：false 关闭，true 记录语句，debug 同时记录结果行
+DB_ECHO = os.getenv("DB_ECHO", "false").lower()
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_CONNECT_TIMEOUT = float(os.getenv("REDIS_CONNECT_TIMEOUT", "2"))
+REDIS_RETRY_INTERVAL = float(os.getenv("REDIS_RETRY_INTERVAL", "30"))
+
+
+def _echo_setting():
+    if DB_ECHO == "debug":
+        return "debug"
+    return DB_ECHO == "true"
+
+
+def build_engine(url: str) -> AsyncEngine:
+    """
+    按环境变量创建异步引擎
+    
+    Args:
+        url: 数据库URL
+    
+    Returns:
+        AsyncEngine
+    """
+    database_url = make_url(url)
+    options: Dict[str, Any] = {"echo": _echo_setting()}
+    
+    if database_url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=DB_POOL_SIZE,
+            max_overflow=DB_MAX_OVERFLOW,
+            pool_timeout=DB_POOL_TIMEOUT,
+            pool_recycle=DB_POOL_RECYCLE,
+            pool_pre_ping=DB_POOL_PRE_PING
+        )
+    
+    if database_url.get_driver_name() == "asyncpg":
+        # SQLAlchemy 层的预编译语句缓存；为 0 时同时关闭 asyncpg 自身的语句缓存（PgBouncer 事务模式）
+        if "prepared_statement_cache_size" not in database_url.query:
+            database_url = database_url.update_query_dict(
+                {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+            )
+        if DB_STATEMENT_CACHE_SIZE == 0:
+            options["connect_args"] = {"statement_cache_size": 0}
+    
+    return create_async_engine(database_url, **options)
+
 
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = build_engine(DATABASE_URL)
 async_session_maker = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
+# 只读副本
+read_engine = build_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
+async_read_session_maker = (
+    async_sessionmaker(read_engine, class_=AsyncSession, expire_on_commit=False)
+    if DATABASE_READ_URL else async_session_maker
+)
+
+# 启用链路追踪时每条SQL一个 span；连接借出次数计入 /metrics
+instrument_engine(engine)
+instrument_pool(engine, "primary")
+if read_engine is not engine:
+    instrument_engine(read_engine)
+    instrument_pool(read_engine, "replica")
+
 Base = declarative_base()
 
-# Initialize Redis client (optional, for caching and message tracking)
-try:
-    redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
-    redis_client = redis.from_url(redis_url, decode_responses=True)
-    redis_client.ping()
-    print("Redis connection successful")
-except Exception as e:
-    print(f"Redis connection failed, caching unavailable: {e}")
-    redis_client = None
+
+# ==================== 原生SQL（asyncpg 风格接口） ====================
+
+# $1 / $2::int[] 形式的位置参数
+_POSITIONAL_PARAM = re.compile(r"\$(\d+)(::)?")
+
+
+class TextConnection:
+    """
+    非 asyncpg 驱动时的原生SQL连接（fetch / fetchrow / fetchval / execute）
+    
+    $n 参数转为 SQLAlchemy 绑定参数执行；只支持各数据库通用的SQL写法
+    """
+    
+    def __init__(self, conn: AsyncConnection):
+        self._conn = conn
+    
+    @staticmethod
+    def _compile(query: str, args: tuple):
+        sql = _POSITIONAL_PARAM.sub(
+            lambda m: f":p{m.group(1)}" + (" ::" if m.group(2) else ""), query
+        )
+        return text(sql), {f"p{i}": value for i, value in enumerate(args, start=1)}
+    
+    async def fetch(self, query: str, *args) -> List[Any]:
+        statement, params = self._compile(query, args)
+        result = await self._conn.execute(statement, params)
+        return list(result.mappings().all())
+    
+    async def fetchrow(self, query: str, *args) -> Optional[Any]:
+        statement, params = self._compile(query, args)
+        result = await self._conn.execute(statement, params)
+        return result.mappings().first()
+    
+    async def fetchval(self, query: str, *args) -> Any:
+        statement, params = self._compile(query, args)
+        result = await self._conn.execute(statement, params)
+        return result.scalar()
+    
+    async def execute(self, query: str, *args) -> str:
+        statement, params = self._compile(query, args)
+        result = await self._conn.execute(statement, params)
+        return f"ROWS {result.rowcount}"
+
+
+class DatabasePool:
+    """
+    原生SQL连接池（替代单独创建的 asyncpg.Pool）
+    
+    从 SQLAlchemy 引擎的连接池借连接：
+    - asyncpg 驱动：直接返回底层 asyncpg 连接（原生SQL快速路径，支持 transaction() 等全部接口）
+    - 其他驱动：返回 TextConnection，每次 acquire 在一个事务内执行，退出时提交
+    """
+    
+    def __init__(self, db_engine: AsyncEngine):
+        self.engine = db_engine
+        self.native = db_engine.url.get_driver_name() == "asyncpg"
+    
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[Any]:
+        """借出一个连接（async with db_pool.acquire() as conn）"""
+        if self.native:
+            async with self.engine.connect() as conn:
+                raw = await conn.get_raw_connection()
+                yield wrap_db_connection(raw.driver_connection)
+        else:
+            async with self.engine.begin() as conn:
+                yield TextConnection(conn)
+    
+    async def fetch(self, query: str, *args) -> List[Any]:
+        async with self.acquire() as conn:
+            return await conn.fetch(query, *args)
+    
+    async def fetchrow(self, query: str, *args) -> Optional[Any]:
+        async with self.acquire() as conn:
+            return await conn.fetchrow(query, *args)
+    
+    async def fetchval(self, query: str, *args) -> Any:
+        async with self.acquire() as conn:
+            return await conn.fetchval(query, *args)
+    
+    async def execute(self, query: str, *args) -> str:
+        async with self.acquire() as conn:
+            return await conn.execute(query, *args)
+
+
+# 全局原生SQL连接池（与 ORM 会话共用主库引擎）
+db_pool = DatabasePool(engine)
+
+
+# ==================== Redis（延迟连接） ====================
+
+_redis_lock = threading.Lock()
+_redis_client: Optional[redis.Redis] = None
+# 上次连接失败后，下一次允许重试的时间（time.monotonic）
+_redis_retry_at = 0.0
+
+
+def get_redis() -> Optional[redis.Redis]:
+    """
+    获取Redis客户端（可选，用于缓存和消息追踪）
+    
+    首次调用时连接并 ping 一次，成功后在进程内复用；失败返回 None（调用方降级），
+    REDIS_RETRY_INTERVAL 秒内不再重连，之后的调用会重新尝试
+    """
+    global _redis_client, _redis_retry_at
+    
+    if _redis_client is not None or time.monotonic() < _redis_retry_at:
+        return _redis_client
+    
+    with _redis_lock:
+        if _redis_client is None and time.monotonic() >= _redis_retry_at:
+            try:
+                client = redis.from_url(
+                    REDIS_URL,
+                    decode_responses=True,
+                    socket_connect_timeout=REDIS_CONNECT_TIMEOUT
+                )
+                client.ping()
+                _redis_client = client
+                logger.info("Redis connection successful")
+            except Exception as e:
+                _redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
+                logger.warning(
+                    f"Redis connection failed, caching unavailable "
+                    f"(retry in {REDIS_RETRY_INTERVAL:.0f}s): {e}"
+                )
+    
+    return _redis_client
+
+
+_async_redis_client: Optional[aioredis.Redis] = None
+
+
+def get_async_redis() -> Optional[aioredis.Redis]:
+    """
+    获取异步Redis客户端（用于异步请求路径，如限流）
+    
+    只创建客户端不连接；未配置 REDIS_URL 时返回 None
+    """
+    global _async_redis_client
+    
+    if _async_redis_client is None and REDIS_URL:
+        _async_redis_client = aioredis.from_url(
+            REDIS_URL,
+            decode_responses=True,
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT
+        )
+    return _async_redis_client
+
+
+def __getattr__(name: str):
+    # 兼容旧的 app.database.redis_client 访问；新代码应在使用时调用 get_redis()，
+    # 在导入时 from ... import redis_client 会立即连接，并把结果固定在导入方
+    if name == "redis_client":
+        return get_redis()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# ==================== 会话依赖 ====================
 
 async def get_db():
     async with async_session_maker() as session:
         yield session
+
+
+async def get_read_db():
+    """只读查询会话（配置了 DATABASE_READ_URL 时连接只读副本）"""
+    async with async_read_session_maker() as session:
+        yield session
+
+
+def _pool_stats(db_engine: AsyncEngine) -> Dict[str, Any]:
+    pool = db_engine.pool
+    stats: Dict[str, Any] = {
+        "url": db_engine.url.render_as_string(hide_password=True),
+        "pool_class": type(pool).__name__,
+        "status": pool.status()
+    }
+    # NullPool / StaticPool 没有这些计数
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """获取连接池使用情况（主库与只读副本）"""
+    stats = {"primary": _pool_stats(engine)}
+    if read_engine is not engine:
+        stats["replica"] = _pool_stats(read_engine)
+    return stats
+
+
+def _collect_pool_metrics():
+    connections = MetricFamily(
+        "db_pool_connections", "gauge", "数据库连接池连接数", ("engine", "state")
+    )
+    for name, stats in get_pool_stats().items():
+        for state in ("size", "checkedin", "checkedout", "overflow"):
+            connections.add(stats.get(state), name, state)
+    return [connections]
+
+
+metrics.register_collector("db_pool", _collect_pool_metrics)
@@ -1,4 +1,4 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from app.routers import (
     ai_router, wechat, admin, view, sidebar, auto_notify, 
@@ -7,6 +7,15 @@ from app.routers import (
     datasource
 )
 from app.api import template_management, channel_config
+from app.services.http_client_service import http_client_registry
+from app.services.cache_invalidation import invalidation_bus
+from app.services.wework_token_manager import wework_token_manager
+from app.services.wework_event_queue import wework_event_queue
+from app.services.intent_engine import intent_engine
+from app.services.ai_gateway import ai_gateway
+from app.services.log_sink import log_sinks
+from app.services.tracing import setup_tracing, shutdown_tracing, trace_http_request
+from app.services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, metrics
 import os
 
 app = FastAPI(
@@ -24,6 +33,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 链路追踪（TRACING_EXPORTER=none 时为空操作）
+app.middleware("http")(trace_http_request)
+
 # 注册路由
 app.include_router(ai_router.router, tags=["AI智能路由"])
 app.include_router(ai_model_router.router, tags=["AI模型配置"])
@@ -43,6 +55,76 @@ app.include_router(after_sales_router.router, tags=["售后服务"])
 app.include_router(prospect_router.router, tags=["商机管理"])
 app.include_router(service_request_router.router, tags=["客户服务请求"])
 
+@app.on_event("startup")
+async def start_tracing():
+    """初始化链路追踪"""
+    setup_tracing()
+
+@app.on_event("startup")
+async def start_cache_invalidation():
+    """订阅项目缓存失效事件"""
+    invalidation_bus.start()
+
+@app.on_event("startup")
+async def start_wework_token_refresh():
+    """启动企业微信令牌后台刷新"""
+    wework_token_manager.start()
+
+@app.on_event("startup")
+async def start_wework_event_queue():
+    """启动企业微信回调事件工作池"""
+    await wework_event_queue.start()
+
+@app.on_event("startup")
+async def start_intent_engine():
+    """加载意图关键词并定期热加载"""
+    await intent_engine.start()
+
+@app.on_event("startup")
+async def start_log_sinks():
+    """启动审计日志缓冲写入"""
+    log_sinks.start_all()
+
+@app.on_event("shutdown")
+async def shutdown_http_clients():
+    """关闭共享HTTP连接池"""
+    await http_client_registry.close_all()
+
+@app.on_event("shutdown")
+async def stop_cache_invalidation():
+    """停止缓存失效订阅"""
+    invalidation_bus.stop()
+
+@app.on_event("shutdown")
+async def stop_wework_token_refresh():
+    """停止企业微信令牌后台刷新"""
+    await wework_token_manager.stop()
+
+@app.on_event("shutdown")
+async def stop_wework_event_queue():
+    """停止企业微信回调事件工作池"""
+    await wework_event_queue.stop()
+
+@app.on_event("shutdown")
+async def stop_intent_engine():
+    """停止意图关键词热加载"""
+    await intent_engine.stop()
+
+@app.on_event("shutdown")
+async def stop_ai_gateway():
+    """关闭AI模型连接池"""
+    await ai_gateway.stop()
+
+@app.on_event("shutdown")
+async def stop_log_sinks():
+    """写完缓冲中的审计日志"""
+    await log_sinks.stop_all()
+
+@app.on_event("shutdown")
+async def stop_tracing():
+    """导出剩余的 span"""
+    shutdown_tracing()
+
 @app.get("/")
 async def root():
     return {
@@ -55,6 +137,11 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/metrics", include_in_schema=False)
+async def prometheus_metrics():
+    """Prometheus 抓取（进程内计数，不查询数据库）"""
+    return Response(metrics.render(), media_type=METRICS_CONTENT_TYPE)
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
@@ -1,8 +1,11 @@
 from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from app.database import get_db
+from app.database import get_db, get_read_db, get_pool_stats
 from app.models import SystemConfig, Project
+from app.services.cache_service import cache_service
+from app.services.log_sink import log_sinks
+from app.services.outbound_limiter import outbound_limiter
 from pydantic import BaseModel
 from typing import List
 
@@ -64,6 +67,38 @@ async def update_system_config(request: ConfigUpdateRequest, db: AsyncSession =
     }
 
 
+@router.get("/api/admin/log-sinks/stats")
+async def get_log_sink_stats():
+    """
+    获取审计日志缓冲写入统计（缓冲深度、写入延迟、丢弃/落盘条数）
+    """
+    return log_sinks.get_stats()
+
+
+@router.get("/api/admin/cache/stats")
+async def get_cache_stats():
+    """
+    获取项目缓存命中统计（本地/Redis命中、未命中、合并加载、Redis错误、命中率）
+    """
+    return cache_service.get_stats()
+
+
+@router.get("/api/admin/outbound-limits")
+async def get_outbound_limits():
+    """
+    获取外发消息限流状态（每个渠道/目的地当前生效的并发上限、配额、排队数、延迟）
+    """
+    return outbound_limiter.get_stats()
+
+
+@router.get("/api/admin/db/pool-stats")
+async def get_db_pool_stats():
+    """
+    获取数据库连接池使用情况（主库与只读副本），用于按实际负载调整连接池大小
+    """
+    return get_pool_stats()
+
+
 @router.get("/api/admin/reports/sales")
 async def get_sales_report(db: AsyncSession = Depends(get_db)):
     """
@@ -98,7 +133,7 @@ async def get_projects(
     phone: str = None,
     employee_id: int = None,
     status: str = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     根据条件查询项目
@@ -136,7 +171,7 @@ async def get_projects(
 
 
 @router.get("/api/daily-report")
-async def get_daily_report(db: AsyncSession = Depends(get_db)):
+async def get_daily_report(db: AsyncSession = Depends(get_read_db)):
     """
     获取每日售后简报
     """
@@ -161,7 +196,7 @@ async def send_daily_report(db: AsyncSession = Depends(get_db)):
 async def get_tickets_for_sync(
     start_date: str = None,
     end_date: str = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     外部CRM系统拉取工单数据（Pull模式）
@@ -5,8 +5,9 @@ from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, delete
 from sqlalchemy.sql import func
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.models_ai import AIModelConfig, AIModelUsageLog
+from app.services.ai_gateway import AIGatewayError, ai_gateway
 from pydantic import BaseModel, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime
@@ -86,6 +87,14 @@ class AIModelUsageStats(BaseModel):
     last_used_at: Optional[datetime]
 
 
+class AIGatewayCompleteRequest(BaseModel):
+    """通过网关调用模型"""
+    prompt: str = Field(..., description="用户消息")
+    model_code: Optional[str] = Field(None, description="模型代码，为空时使用默认模型")
+    system_prompt: Optional[str] = Field(None, description="系统提示词")
+    use_cache: bool = Field(True, description="是否使用响应缓存")
+
+
 # ============================================================================
 # API 路由
 # ============================================================================
@@ -238,6 +247,7 @@ async def create_ai_model(
     
     db.add(new_model)
     await db.commit()
+    ai_gateway.invalidate_models()
     await db.refresh(new_model)
     
     model_dict = {
@@ -297,6 +307,7 @@ async def update_ai_model(
     
     await db.commit()
     await db.refresh(model)
+    ai_gateway.invalidate_models()
     
     model_dict = {
         "id": model.id,
@@ -343,6 +354,7 @@ async def delete_ai_model(model_id: int, db: AsyncSession = Depends(get_db)):
         delete(AIModelConfig).where(AIModelConfig.id == model_id)
     )
     await db.commit()
+    ai_gateway.invalidate_models()
     
     return {"message": f"AI模型配置 {model.model_name} 已删除", "success": True}
 
@@ -371,12 +383,13 @@ async def set_default_model(model_id: int, db: AsyncSession = Depends(get_db)):
     # 设置当前模型为默认
     model.is_default = True
     await db.commit()
+    ai_gateway.invalidate_models()
     
     return {"message": f"{model.model_name} 已设置为默认AI模型", "success": True}
 
 
 @router.get("/stats/usage", response_model=List[AIModelUsageStats])
-async def get_usage_stats(db: AsyncSession = Depends(get_db)):
+async def get_usage_stats(db: AsyncSession = Depends(get_read_db)):
     """
     获取AI模型使用统计
     """
@@ -413,6 +426,30 @@ async def get_usage_stats(db: AsyncSession = Depends(get_db)):
     return usage_stats
 
 
+@router.post("/gateway/complete")
+async def gateway_complete(request: AIGatewayCompleteRequest):
+    """
+    通过AI网关调用模型（用于联调和验证模型配置）
+    """
+    try:
+        return await ai_gateway.complete(
+            request.prompt,
+            model_code=request.model_code,
+            system_prompt=request.system_prompt,
+            use_cache=request.use_cache
+        )
+    except AIGatewayError as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+
+@router.get("/gateway/stats")
+async def gateway_stats():
+    """
+    获取AI网关统计（调用次数、缓存命中、并发、使用日志写入情况）
+    """
+    return ai_gateway.get_stats()
+
+
 # ============================================================================
 # 辅助函数
 # ============================================================================
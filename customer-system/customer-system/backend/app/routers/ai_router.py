@@ -2,6 +2,7 @@ from fastapi import APIRouter, HTTPException, Depends
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.services.ai_service import AIService
+from app.services.intent_engine import intent_engine
 from pydantic import BaseModel
 
 router = APIRouter()
@@ -67,3 +68,18 @@ async def intelligent_router(request_data: RouterRequest, db: AsyncSession = Dep
             "response": "抱歉，我没有理解您的意图。您可以咨询售前、售后或查询项目进度。",
             "next_action": "clarify_intent"
         }
+
+@router.post("/api/ai/intents/reload")
+async def reload_intent_keywords():
+    """
+    从数据字典热加载意图关键词（dict_type=intent_keyword）
+    仅作用于当前进程，其他进程按 INTENT_RELOAD_INTERVAL 定期加载
+    """
+    loaded = await intent_engine.reload_from_db()
+    if not loaded:
+        raise HTTPException(status_code=500, detail="读取意图关键词失败，继续使用当前规则")
+    
+    return {
+        "success": True,
+        "domains": {domain: [intent for intent, _, _ in rules] for domain, rules in intent_engine.rules.items()}
+    }
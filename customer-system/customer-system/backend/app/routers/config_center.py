@@ -5,7 +5,7 @@ from fastapi import APIRouter, HTTPException, Depends, Request
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, update, delete
 from sqlalchemy.orm import selectinload
-from app.database import get_db
+from app.database import get_db, get_read_db
 from app.models_config import (
     EnhancedSystemConfig, ConfigGroup, WorkflowTemplate, 
     RobotWebhook, AdminUser, Role, Permission, OperationLog
@@ -617,7 +617,7 @@ async def get_operation_logs(
     page: int = 1,
     page_size: int = 50,
     module: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    db: AsyncSession = Depends(get_read_db)
 ):
     """
     获取操作日志（分页）
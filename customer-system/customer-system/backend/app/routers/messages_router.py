@@ -10,7 +10,7 @@ from datetime import datetime, timedelta
 import redis
 import uuid
 
-from app.database import get_db, redis_client
+from app.database import get_db, get_redis
 from app.models_messaging import (
     MessageTemplate, MessageTask, MessageRecord, MessageTrace,
     MessageStatistics, MessageChannel, MessageStatus
@@ -20,6 +20,8 @@ from app.services.message_trace_service import MessageTracer
 from app.services.rabbitmq_service import RabbitMQService, MessageQueue
 from app.services.redis_lock_service import distributed_lock
 from app.services.sentinel_service import rate_limit
+from app.services.template_engine import render_template
+from app.services.batch_record_writer import write_batch_records
 
 router = APIRouter(prefix="/api/messages", tags=["消息处理"])
 
@@ -138,10 +140,11 @@ async def send_message(
     
     # 创建链路追踪（如果 Redis 可用）
     trace_id = str(uuid.uuid4())
-    if redis_client:
+    redis_conn = get_redis()
+    tracer = MessageTracer(redis_conn) if redis_conn else None
+    if tracer:
         try:
-            tracer = MessageTracer(redis_client)
-            trace_id = tracer.start_trace({
+            tracer.start_trace(trace_id, {
                 "template_id": template_id,
                 "recipient": recipient,
                 "channel": template.channel
@@ -156,7 +159,7 @@ async def send_message(
         recipient=recipient,
         channel=template.channel,
         subject=template.subject,
-        content=_render_template(template.content, variables or {}),
+        content=_render_template(template, variables or {}),
         variables=variables,
         priority=priority
     )
@@ -166,9 +169,10 @@ async def send_message(
     await db.refresh(record)
     
     # 添加追踪节点（如果 Redis 可用）
-    if redis_client:
+    queue_node = None
+    if tracer:
         try:
-            tracer.add_node(trace_id, "queue", {"record_id": record.id})
+            queue_node = tracer.add_node(trace_id, "queue", "queue", {"record_id": record.id})
         except Exception:
             pass
     
@@ -187,7 +191,11 @@ async def send_message(
         priority=priority
     )
     
-    tracer.finish_node(trace_id, "queue", {"status": "success"})
+    if tracer and queue_node:
+        try:
+            tracer.finish_node(trace_id, queue_node, "success")
+        except Exception:
+            pass
     
     return {
         "code": 0,
@@ -204,11 +212,20 @@ async def send_message(
 async def send_batch_messages(
     template_id: int,
     recipients: List[str],
+    background_tasks: BackgroundTasks,
     variables_list: Optional[List[dict]] = None,
     priority: int = 5,
     db: AsyncSession = Depends(get_db)
 ):
-    """批量发送消息"""
+    """
+    批量发送消息
+    
+    请求路径上只创建任务并立即返回任务ID；
+    消息记录在后台以单事务分块批量写入，写完后再投递到发送队列。
+    """
+    if not recipients:
+        raise HTTPException(status_code=400, detail="接收人列表不能为空")
+    
     # 查询模板
     result = await db.execute(
         select(MessageTemplate).where(MessageTemplate.id == template_id)
@@ -220,69 +237,55 @@ async def send_batch_messages(
     
     # 创建批量任务
     task = MessageTask(
+        task_id=f"BATCH{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8]}",
         template_id=template_id,
+        template_code=template.template_code,
+        target_type="batch",
+        target_count=len(recipients),
         total_count=len(recipients),
-        channel=template.channel
+        status=MessageStatus.PENDING.value
     )
     
     db.add(task)
     await db.commit()
-    await db.refresh(task)
-    
-    # 批量创建消息记录
-    for i, recipient in enumerate(recipients):
-        variables = variables_list[i] if variables_list and i < len(variables_list) else {}
-        
-        # 创建链路追踪（如果 Redis 可用）
-        trace_id = str(uuid.uuid4())
-        if redis_client:
-            try:
-                tracer = MessageTracer(redis_client)
-                trace_id = tracer.start_trace({
-                    "task_id": task.id,
-                    "template_id": template_id,
-                    "recipient": recipient
-                })
-            except Exception:
-                pass
-        
-        # 创建记录
-        record = MessageRecord(
-            trace_id=trace_id,
-            task_id=task.id,
-            template_id=template_id,
-            recipient=recipient,
-            channel=template.channel,
-            subject=template.subject,
-            content=_render_template(template.content, variables),
-            variables=variables,
+    
+    # 模板快照（后台任务不再依赖请求会话）
+    template_snapshot = {
+        "id": template.id,
+        "version": template.updated_at,
+        "channel": template.channel,
+        "title": template.title,
+        "content": template.content_template
+    }
+    
+    def publish_batch(task_id: str):
+        """记录写入完成后投递批量任务"""
+        if not (rabbitmq_service and message_queue):
+            return
+        rabbitmq_service.publish_message(
+            queue=message_queue.QUEUE_MESSAGE_SEND,
+            message={
+                "type": "batch",
+                "task_id": task_id,
+                "template_id": template_id,
+                "priority": priority
+            },
             priority=priority
         )
-        
-        db.add(record)
-        
-        # 每100条提交一次
-        if (i + 1) % 100 == 0:
-            await db.commit()
-        
-        await db.commit()
-    
-    # 发送到队列
-    rabbitmq_service.publish_message(
-        queue=message_queue.QUEUE_MESSAGE_SEND,
-        message={
-            "type": "batch",
-            "task_id": task.id,
-            "template_id": template_id,
-            "priority": priority
-        },
-        priority=priority
+    
+    background_tasks.add_task(
+        write_batch_records,
+        task.task_id,
+        template_snapshot,
+        recipients,
+        variables_list,
+        publish_batch
     )
     
     return {
         "code": 0,
         "message": f"批量任务已创建，共{len(recipients)}条消息",
-        "data": {"task_id": task.id}
+        "data": {"task_id": task.task_id}
     }
 
 
@@ -291,11 +294,12 @@ async def send_batch_messages(
 @router.get("/traces/{trace_id}", summary="获取消息链路追踪")
 async def get_message_trace(trace_id: str):
     """获取消息链路追踪详情"""
-    if not redis_client:
+    redis_conn = get_redis()
+    if not redis_conn:
         raise HTTPException(status_code=503, detail="Redis服务不可用，链路追踪功能暂时不可用")
     
     try:
-        tracer = MessageTracer(redis_client)
+        tracer = MessageTracer(redis_conn)
         trace_data = tracer.get_trace(trace_id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取追踪信息失败: {str(e)}")
@@ -303,8 +307,8 @@ async def get_message_trace(trace_id: str):
     if not trace_data:
         raise HTTPException(status_code=404, detail="追踪记录不存在")
     
-    # 获取统计信息
-    stats = tracer.get_statistics(trace_id)
+    # 获取统计信息（最近24小时）
+    stats = tracer.get_statistics()
     
     return {
         "code": 0,
@@ -479,10 +483,6 @@ async def get_realtime_statistics(db: AsyncSession = Depends(get_db)):
 
 # ==================== 工具函数 ====================
 
-def _render_template(template: str, variables: dict) -> str:
-    """渲染消息模板"""
-    content = template
-    for key, value in variables.items():
-        placeholder = f"{{{{{key}}}}}"
-        content = content.replace(placeholder, str(value))
-    return content
+def _render_template(template: MessageTemplate, variables: dict) -> str:
+    """渲染消息模板（编译结果按模板ID和更新时间缓存）"""
+    return render_template(template.content_template, variables, template.id, template.updated_at)
@@ -17,6 +17,9 @@ from app.models import (
     ProjectCache, ProjectSyncHistory, ProjectSyncConfig, 
     ProjectAccessTokens, ProjectStatusNotifications
 )
+from app.services.cache_service import cache_service, SOURCE_LOADER
+from app.services.cache_invalidation import invalidation_bus
+from app.services.remote_project_client import RemoteProjectClient
 from pydantic import BaseModel
 import logging
 
@@ -235,6 +238,7 @@ async def update_cache(project_id: str, project_data: Dict[str, Any],
         cache.expires_at = expires_at
     
     await db.commit()
+    invalidation_bus.publish_project_changed(project_id, "update_cache")
     return cache
 
 def _format_relative_time(dt: datetime) -> str:
@@ -291,59 +295,40 @@ async def get_project_status(
                 logger.warning(f"Token verification failed for project {project_id}: {str(e)}")
                 # 继续执行，可能是匿名访问
         
-        # 第一步：尝试从Redis缓存获取（如果可用）
-        cache_key = f"project_status:{project_id}"
-        try:
-            import redis
-            from app.services.cache_service import redis_client
-            if redis_client:
-                cached_status = redis_client.get(cache_key)
-                if cached_status:
-                    import json
-                    status_data = json.loads(cached_status)
-                    status_data['from_cache'] = True
-                    status_data['cache_ttl'] = redis_client.ttl(cache_key)
-                    return ProjectStatusResponse(**status_data)
-        except Exception as e:
-            logger.debug(f"Redis cache check failed: {str(e)}")
-            # 继续使用数据库
-        
-        # 第二步：从数据库缓存获取
-        stmt = select(ProjectCache).where(ProjectCache.project_id == project_id)
-        result = await db.execute(stmt)
-        cache_record = result.scalars().first()
-        
-        if cache_record and cache_record.cached_data:
-            import json
+        # 两级缓存（进程内 + Redis），并发未命中只查一次数据库，不存在的项目负缓存
+        async def load_status() -> Optional[Dict[str, Any]]:
+            stmt = select(ProjectCache).where(ProjectCache.project_id == project_id)
+            result = await db.execute(stmt)
+            cache_record = result.scalars().first()
+            
+            if not (cache_record and cache_record.cached_data):
+                return None
+            
             project_data = json.loads(cache_record.cached_data)
             
             # 提取必要字段
-            status_response = ProjectStatusResponse(
-                project_id=project_id,
-                title=project_data.get('title', f'项目{project_id}'),
-                type=project_data.get('type', 'presale'),
-                status=project_data.get('status', 'unknown'),
-                progress=project_data.get('progress', 0),
-                updated_at=project_data.get('updated_at', cache_record.cached_at.isoformat()),
-                customer_name=project_data.get('customer_name'),
-                engineer_name=project_data.get('engineer_name'),
-                salesman_name=project_data.get('salesman_name'),
-                from_cache=True,
+            return {
+                "project_id": project_id,
+                "title": project_data.get('title', f'项目{project_id}'),
+                "type": project_data.get('type', 'presale'),
+                "status": project_data.get('status', 'unknown'),
+                "progress": project_data.get('progress', 0),
+                "updated_at": project_data.get('updated_at', cache_record.cached_at.isoformat()),
+                "customer_name": project_data.get('customer_name'),
+                "engineer_name": project_data.get('engineer_name'),
+                "salesman_name": project_data.get('salesman_name')
+            }
+        
+        status_data, source = await cache_service.get_or_load(
+            "project_status", project_id, load_status, expire_seconds=300
+        )
+        
+        if status_data:
+            return ProjectStatusResponse(
+                **status_data,
+                from_cache=source != SOURCE_LOADER,
                 cache_ttl=300  # 5分钟缓存
             )
-            
-            # 异步更新Redis缓存（不阻塞响应）
-            try:
-                import json
-                redis_client.setex(
-                    cache_key,
-                    300,
-                    json.dumps(status_response.dict(exclude={'from_cache', 'cache_ttl', 'message'}))
-                )
-            except:
-                pass
-            
-            return status_response
         
         # 第三步：项目不存在
         raise HTTPException(
@@ -684,23 +669,9 @@ async def save_config_value(key: str, value: Any, db: AsyncSession):
     await db.commit()
 
 async def fetch_all_remote_projects(project_types: List[str]) -> List[Dict[str, Any]]:
-    """从远程API批量获取所有项目"""
+    """从远程API批量获取所有项目（分页拉取）"""
     try:
-        REMOTE_API_BASE = "https://remote-api.example.com"
-        REMOTE_API_KEY = "your-api-key"
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.get(
-                f"{REMOTE_API_BASE}/projects",
-                params={"types": ",".join(project_types)},
-                headers={"Authorization": f"Bearer {REMOTE_API_KEY}"}
-            )
-            
-            if response.status_code == 200:
-                return response.json().get('projects', [])
-            else:
-                logger.error(f"Remote API error: {response.status_code}")
-                return []
+        return await RemoteProjectClient().fetch_all(project_types)
     
     except Exception as e:
         logger.error(f"Failed to fetch projects from remote API: {e}")
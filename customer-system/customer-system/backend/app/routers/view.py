@@ -187,5 +187,5 @@ async def invalidate_project_cache(
     
     return JSONResponse(content={
         "success": success,
-        "message": "缓存已清除" if success else "缓存清除失败（Redis不可用）"
+        "message": "缓存已清除" if success else "仅清除了本进程缓存（Redis不可用）"
     })
@@ -3,9 +3,9 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.services.wechat_service import WeChatService
 from app.services.project_service import ProjectService
+from app.services.intent_engine import intent_engine
 from pydantic import BaseModel
 from typing import Optional
-import os
 
 router = APIRouter()
 
@@ -114,7 +114,7 @@ async def handle_wechat_message(event_data: WeChatMessageEvent, db: AsyncSession
     """
     from app.services.ticket_service import TicketService
     from app.services.ticket_interaction_service import TicketInteractionService
-    from app.utils.wechat_work_api import WeChatWorkAPI
+    from app.utils.wechat_work_api import get_wechat_work_api
     
     # 如果是文本消息
     if event_data.MsgType == "text" and event_data.Content:
@@ -128,11 +128,7 @@ async def handle_wechat_message(event_data: WeChatMessageEvent, db: AsyncSession
             from_user_name = event_data.FromUserName  # 实际应该是用户昵称
             chat_id = "internal_group_id"  # 实际应该从事件中获取
             
-            wechat_api = WeChatWorkAPI(
-                corp_id=os.getenv("CORP_ID"),
-                corp_secret=os.getenv("CORP_SECRET"),
-                agent_id=os.getenv("AGENT_ID")
-            )
+            wechat_api = get_wechat_work_api()
             
             result = await TicketInteractionService.handle_group_message(
                 db=db,
@@ -151,15 +147,11 @@ async def handle_wechat_message(event_data: WeChatMessageEvent, db: AsyncSession
                 }
         
         # 工单回复监听（包含#工单号）
-        if '#' in message and any(kw in message for kw in ['已解决', '已处理', '已修复', '升级']):
+        if '#' in message and intent_engine.classify(message, "ticket_reply").matched:
             from_user_name = event_data.FromUserName
             chat_id = "internal_group_id"
             
-            wechat_api = WeChatWorkAPI(
-                corp_id=os.getenv("CORP_ID"),
-                corp_secret=os.getenv("CORP_SECRET"),
-                agent_id=os.getenv("AGENT_ID")
-            )
+            wechat_api = get_wechat_work_api()
             
             result = await TicketInteractionService._handle_ticket_reply(
                 db=db,
@@ -6,15 +6,26 @@ from fastapi import APIRouter, Request, Depends, HTTPException
 from sqlalchemy.ext.asyncio import AsyncSession
 from app.database import get_db
 from app.services.auto_binding_service import AutoBindingService
+from app.services.wework_event_queue import wework_event_queue
+from app.utils.wework_event_decoder import (
+    WEWORK_CALLBACK_MAX_BODY,
+    CallbackParseError,
+    CallbackTooLarge,
+    decode_event
+)
 from pydantic import BaseModel
 from typing import Dict, Optional
+import os
+import hmac
 import hashlib
-import xml.etree.ElementTree as ET
 import logging
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 回调配置中的 Token（用于签名校验）
+WEWORK_CALLBACK_TOKEN = os.getenv("WEWORK_CALLBACK_TOKEN", "")
+
 
 class WeChatCallbackResponse(BaseModel):
     """企业微信回调响应"""
@@ -54,18 +65,67 @@ async def wework_callback_verify(
     return echostr  # 临时直接返回，生产环境需要解密
 
 
+# 入队的事件字段
+CALLBACK_FIELDS = (
+    'ToUserName', 'FromUserName', 'CreateTime', 'MsgType', 'Event',
+    'ChangeType', 'UserID', 'ExternalUserID', 'State', 'WelcomeCode', 'MsgId'
+)
+
+
+def verify_callback_signature(
+    encrypt: Optional[str],
+    msg_signature: Optional[str],
+    timestamp: Optional[str],
+    nonce: Optional[str]
+) -> bool:
+    """
+    校验企业微信回调签名 sha1(sort(token, timestamp, nonce, Encrypt))
+    
+    未配置 WEWORK_CALLBACK_TOKEN 时跳过校验（开发环境）
+    """
+    if not WEWORK_CALLBACK_TOKEN:
+        return True
+    if not (msg_signature and timestamp and nonce):
+        return False
+    
+    params = ''.join(sorted([WEWORK_CALLBACK_TOKEN, timestamp, nonce, encrypt or '']))
+    expected = hashlib.sha1(params.encode('utf-8')).hexdigest()
+    return hmac.compare_digest(expected, msg_signature)
+
+
+async def read_limited_body(request: Request, max_size: int = WEWORK_CALLBACK_MAX_BODY) -> bytes:
+    """
+    读取请求体，超过上限时立即中止（不把超大报文读进内存）
+    
+    Raises:
+        CallbackTooLarge: 超过大小上限
+    """
+    content_length = request.headers.get('content-length')
+    if content_length and content_length.isdigit() and int(content_length) > max_size:
+        raise CallbackTooLarge(f"回调报文过大: {content_length} > {max_size}")
+    
+    chunks = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            raise CallbackTooLarge(f"回调报文过大: > {max_size}")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
 @router.post("/api/wework/callback")
 async def wework_callback_handler(
     request: Request,
     msg_signature: Optional[str] = None,
     timestamp: Optional[str] = None,
-    nonce: Optional[str] = None,
-    db: AsyncSession = Depends(get_db)
+    nonce: Optional[str] = None
 ):
     """
     企业微信事件回调处理
     
-    处理各类企业微信事件：
+    只做验签、解析和入队，立即应答（避免处理慢导致企业微信重推）；
+    事件由 wework_event_queue 的工作池异步处理：
     - add_external_contact: 添加客户
     - del_external_contact: 删除客户
     - edit_external_contact: 编辑客户
@@ -75,70 +135,45 @@ async def wework_callback_handler(
         msg_signature: 企业微信加密签名
         timestamp: 时间戳
         nonce: 随机数
-        db: 数据库会话
     
     Returns:
         处理结果
     """
     try:
-        # 获取POST数据
-        body = await request.body()
+        # 获取POST数据（超过上限直接拒绝）
+        body = await read_limited_body(request)
         
         # TODO: 解密企业微信消息
         # from wechatpy.enterprise.crypto import WeChatCrypto
         # crypto = WeChatCrypto(token, encoding_aes_key, corp_id)
         # decrypted_xml = crypto.decrypt_message(body, msg_signature, timestamp, nonce)
         
-        # 临时处理：直接解析XML（生产环境需要先解密）
-        decrypted_xml = body.decode('utf-8')
-        
-        # 解析XML
-        root = ET.fromstring(decrypted_xml)
-        
-        # 提取事件信息
-        event_data = {
-            'ToUserName': root.find('ToUserName').text if root.find('ToUserName') is not None else None,
-            'FromUserName': root.find('FromUserName').text if root.find('FromUserName') is not None else None,
-            'CreateTime': root.find('CreateTime').text if root.find('CreateTime') is not None else None,
-            'MsgType': root.find('MsgType').text if root.find('MsgType') is not None else None,
-            'Event': root.find('Event').text if root.find('Event') is not None else None,
-            'ChangeType': root.find('ChangeType').text if root.find('ChangeType') is not None else None,
-            'UserID': root.find('UserID').text if root.find('UserID') is not None else None,
-            'ExternalUserID': root.find('ExternalUserID').text if root.find('ExternalUserID') is not None else None,
-            'State': root.find('State').text if root.find('State') is not None else '',
-            'WelcomeCode': root.find('WelcomeCode').text if root.find('WelcomeCode') is not None else None,
-        }
-        
-        logger.info(f"收到企业微信回调: Event={event_data.get('Event')}, ChangeType={event_data.get('ChangeType')}")
+        # 解析XML（单次扫描提取已知字段）
+        event = decode_event(body)
+    except CallbackTooLarge as e:
+        logger.warning(f"企业微信回调被拒绝: {e}")
+        raise HTTPException(status_code=413, detail="回调报文过大")
+    except CallbackParseError as e:
+        logger.error(f"企业微信回调XML解析失败: {e}")
+        return "success"
         
-        # 处理不同类型的事件
-        msg_type = event_data.get('MsgType')
-        event_type = event_data.get('Event')
-        change_type = event_data.get('ChangeType')
+    if not verify_callback_signature(event.Encrypt, msg_signature, timestamp, nonce):
+        logger.warning(f"企业微信回调签名校验失败: timestamp={timestamp}, nonce={nonce}")
+        raise HTTPException(status_code=403, detail="签名校验失败")
         
-        if msg_type == 'event' and event_type == 'change_external_contact':
-            if change_type == 'add_external_contact':
-                # 处理添加客户事件
-                result = await AutoBindingService.handle_wework_add_customer_event(db, event_data)
-                logger.info(f"添加客户事件处理结果: {result}")
-            
-            elif change_type == 'del_external_contact':
-                # 处理删除客户事件
-                logger.info(f"客户删除事件: UserID={event_data.get('UserID')}, ExternalUserID={event_data.get('ExternalUserID')}")
-                # TODO: 实现客户删除处理逻辑
-            
-            elif change_type == 'edit_external_contact':
-                # 处理编辑客户事件
-                logger.info(f"客户编辑事件: ExternalUserID={event_data.get('ExternalUserID')}")
-                # TODO: 实现客户编辑处理逻辑
+    # 临时处理：直接使用明文XML（生产环境需要先解密）
+    event_data = event.to_dict(CALLBACK_FIELDS)
+    event_data['State'] = event_data['State'] or ''
         
-        # 返回成功响应给企业微信
-        return "success"
+    logger.info(f"收到企业微信回调: Event={event.Event}, ChangeType={event.ChangeType}")
         
+    try:
+        await wework_event_queue.enqueue(event_data)
     except Exception as e:
-        logger.error(f"处理企业微信回调失败: {str(e)}", exc_info=True)
-        # 即使失败也返回success，避免企业微信重复推送
-        return "success"
+        logger.error(f"企业微信回调入队失败: {str(e)}", exc_info=True)
+        
+    # 即使失败也返回success，避免企业微信重复推送
+    return "success"
 
 
 @router.post("/api/wework/manual-bind")
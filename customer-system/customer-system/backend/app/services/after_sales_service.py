@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_, or_, desc
 from app.models import AfterSalesTicket, Customer, Project, OrderModification
 from app.services.wechat_service import WeChatService
+from app.services.cache_invalidation import invalidation_bus
 from typing import Dict, List, Optional
 from datetime import datetime
 import logging
@@ -357,6 +358,9 @@ class AfterSalesService:
             
             await db.commit()
             
+            # 工单状态影响项目进度展示
+            invalidation_bus.publish_project_changed(ticket.project_id, "ticket_status")
+            
             logger.info(f"工单状态更新: {ticket_no} -> {status}")
             
             # 推送状态更新通知给客户
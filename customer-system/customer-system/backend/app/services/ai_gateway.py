@@ -0,0 +1,393 @@
+"""
+AI模型调用网关
+统一调用 ai_model_configs 中配置的模型（OpenAI 兼容的 /chat/completions 接口）
+
+功能：
+- 模型选择：指定 model_code，或默认模型，否则取启用模型中优先级最高的；配置短时缓存
+- 连接池：按 API 端点（scheme://host）复用 httpx 客户端
+- 响应缓存：按「模型 + 规范化提示词」精确匹配，两级缓存（进程内 + Redis），
+  相同提示词的并发请求只调用一次模型（复用 cache_service 的 single-flight）
+- 每个模型独立的并发上限和超时（extra_config 中 max_concurrency / timeout 覆盖全局配置）
+- 使用日志（ai_model_usage_logs）经 log_sink 缓冲批量写入，落库时累加 usage_count
+
+本地联调可使用 stub_ai_model_server.py
+"""
+import os
+import time
+import asyncio
+import hashlib
+import logging
+import unicodedata
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import select, update
+
+from app.database import async_session_maker
+from app.models_ai import AIModelConfig, AIModelUsageLog
+from app.services.cache_service import SOURCE_LOADER, cache_service
+from app.services.log_sink import BufferedLogSink, log_sinks
+
+logger = logging.getLogger(__name__)
+
+# 网关配置（可通过环境变量调整）
+AI_GATEWAY_TIMEOUT = float(os.getenv("AI_GATEWAY_TIMEOUT", "30"))
+AI_GATEWAY_MAX_CONCURRENCY = int(os.getenv("AI_GATEWAY_MAX_CONCURRENCY", "8"))
+AI_GATEWAY_CACHE_TTL = int(os.getenv("AI_GATEWAY_CACHE_TTL", "600"))
+AI_GATEWAY_MODEL_TTL = int(os.getenv("AI_GATEWAY_MODEL_TTL", "60"))
+
+# 响应缓存命名空间
+CACHE_NAMESPACE = "ai_response"
+
+
+class AIGatewayError(Exception):
+    """模型调用失败（无可用模型、超时、接口错误等）"""
+
+
+class ModelProfile:
+    """模型调用参数（AIModelConfig 的只读快照，脱离数据库会话使用）"""
+    
+    __slots__ = (
+        "model_code", "provider", "model_version", "api_endpoint", "api_key",
+        "is_default", "priority", "timeout", "max_concurrency", "cache_ttl",
+        "temperature", "max_tokens"
+    )
+    
+    def __init__(self, config: AIModelConfig):
+        extra = config.extra_config or {}
+        self.model_code = config.model_code
+        self.provider = config.provider
+        self.model_version = config.model_version
+        self.api_endpoint = config.api_endpoint
+        self.api_key = config.api_key
+        self.is_default = bool(config.is_default)
+        self.priority = config.priority or 0
+        self.timeout = float(extra.get("timeout", AI_GATEWAY_TIMEOUT))
+        self.max_concurrency = int(extra.get("max_concurrency", AI_GATEWAY_MAX_CONCURRENCY))
+        self.cache_ttl = int(extra.get("cache_ttl", AI_GATEWAY_CACHE_TTL))
+        self.temperature = extra.get("temperature")
+        self.max_tokens = extra.get("max_tokens")
+    
+    @property
+    def origin(self) -> str:
+        """连接池键（scheme://host:port）"""
+        parts = urlsplit(self.api_endpoint)
+        return f"{parts.scheme}://{parts.netloc}"
+
+
+def normalize_prompt(text: str) -> str:
+    """
+    规范化提示词（缓存键用）
+    
+    全角转半角（NFKC）、折叠空白、去首尾空白、英文转小写
+    """
+    text = unicodedata.normalize("NFKC", text or "")
+    return " ".join(text.split()).lower()
+
+
+def prompt_cache_key(model_code: str, prompt: str, system_prompt: Optional[str] = None) -> str:
+    """生成响应缓存键：模型代码 + 规范化提示词的哈希"""
+    digest = hashlib.sha256()
+    digest.update(normalize_prompt(system_prompt or "").encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(normalize_prompt(prompt).encode("utf-8"))
+    return f"{model_code}:{digest.hexdigest()}"
+
+
+async def _bump_usage_count(db, rows: List[Dict[str, Any]]):
+    """使用日志落库时累加各模型的 usage_count / last_used_at"""
+    usage: Dict[str, int] = {}
+    for row in rows:
+        usage[row["model_code"]] = usage.get(row["model_code"], 0) + 1
+    
+    now = datetime.now()
+    for model_code, count in usage.items():
+        await db.execute(
+            update(AIModelConfig)
+            .where(AIModelConfig.model_code == model_code)
+            .values(usage_count=AIModelConfig.usage_count + count, last_used_at=now)
+        )
+
+
+# 使用日志（ai_model_usage_logs）缓冲写入
+ai_usage_log_sink = log_sinks.register(
+    BufferedLogSink("ai_model_usage_logs", AIModelUsageLog, on_flush=_bump_usage_count)
+)
+
+
+class AIGateway:
+    """AI模型调用网关"""
+    
+    def __init__(
+        self,
+        session_maker=async_session_maker,
+        cache=cache_service,
+        usage_sink: BufferedLogSink = ai_usage_log_sink,
+        model_ttl: int = AI_GATEWAY_MODEL_TTL
+    ):
+        """
+        初始化
+        
+        Args:
+            session_maker: 数据库会话工厂
+            cache: 响应缓存（CacheService）
+            usage_sink: 使用日志缓冲写入器
+            model_ttl: 模型配置缓存时间（秒）
+        """
+        self.session_maker = session_maker
+        self.cache = cache
+        self.usage_sink = usage_sink
+        self.model_ttl = model_ttl
+        
+        self._models: List[ModelProfile] = []
+        self._models_loaded_at = 0.0
+        self._models_lock = asyncio.Lock()
+        
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._semaphores: Dict[Tuple[str, int], asyncio.Semaphore] = {}
+        self._in_flight: Dict[str, int] = {}
+        
+        self.stats = {"requests": 0, "model_calls": 0, "cache_hits": 0, "timeouts": 0, "errors": 0}
+    
+    # ==================== 模型选择 ====================
+    
+    async def _load_models(self) -> List[ModelProfile]:
+        async with self.session_maker() as db:
+            result = await db.execute(
+                select(AIModelConfig).where(AIModelConfig.is_active == True)
+            )
+            models = [ModelProfile(config) for config in result.scalars().all()]
+        
+        # 默认模型在前，其余按优先级降序
+        models.sort(key=lambda m: (not m.is_default, -m.priority))
+        return models
+    
+    async def get_models(self) -> List[ModelProfile]:
+        """获取启用的模型（带缓存）"""
+        if time.monotonic() - self._models_loaded_at < self.model_ttl:
+            return self._models
+        
+        async with self._models_lock:
+            if time.monotonic() - self._models_loaded_at >= self.model_ttl:
+                try:
+                    self._models = await self._load_models()
+                except Exception as e:
+                    # 加载失败时继续使用旧配置
+                    if not self._models:
+                        raise AIGatewayError(f"加载AI模型配置失败: {e}") from e
+                    logger.error(f"[AI网关] 加载模型配置失败，继续使用旧配置: {e}")
+                self._models_loaded_at = time.monotonic()
+        return self._models
+    
+    def invalidate_models(self):
+        """模型配置变更后调用，下次调用时重新加载"""
+        self._models_loaded_at = 0.0
+    
+    async def select_model(self, model_code: Optional[str] = None) -> ModelProfile:
+        """
+        选择模型
+        
+        Args:
+            model_code: 指定模型代码；为空时取默认模型或优先级最高的启用模型
+        
+        Raises:
+            AIGatewayError: 没有可调用的模型
+        """
+        models = [m for m in await self.get_models() if m.api_endpoint]
+        if model_code:
+            for model in models:
+                if model.model_code == model_code:
+                    return model
+            raise AIGatewayError(f"模型 {model_code} 不存在、未启用或未配置API端点")
+        if not models:
+            raise AIGatewayError("没有可调用的AI模型")
+        return models[0]
+    
+    # ==================== 连接池与并发控制 ====================
+    
+    def _get_client(self, model: ModelProfile) -> httpx.AsyncClient:
+        """按端点获取共享客户端（同一端点的多个模型共用连接池）"""
+        origin = model.origin
+        client = self._clients.get(origin)
+        if client is None or client.is_closed:
+            max_connections = max(model.max_concurrency, AI_GATEWAY_MAX_CONCURRENCY)
+            client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections
+                ),
+                timeout=httpx.Timeout(model.timeout)
+            )
+            self._clients[origin] = client
+            logger.info(f"[AI网关] 创建连接池: {origin} (max_connections={max_connections})")
+        return client
+    
+    def _get_semaphore(self, model: ModelProfile) -> asyncio.Semaphore:
+        """按模型获取并发信号量（并发上限修改后使用新的信号量）"""
+        key = (model.model_code, model.max_concurrency)
+        semaphore = self._semaphores.get(key)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(model.max_concurrency)
+            self._semaphores[key] = semaphore
+        return semaphore
+    
+    # ==================== 调用 ====================
+    
+    @staticmethod
+    def _build_payload(model: ModelProfile, prompt: str, system_prompt: Optional[str]) -> Dict[str, Any]:
+        messages = []
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        messages.append({"role": "user", "content": prompt})
+        
+        payload = {"model": model.model_version or model.model_code, "messages": messages}
+        if model.temperature is not None:
+            payload["temperature"] = model.temperature
+        if model.max_tokens is not None:
+            payload["max_tokens"] = model.max_tokens
+        return payload
+    
+    async def _post(self, model: ModelProfile, payload: Dict[str, Any]) -> str:
+        headers = {"Authorization": f"Bearer {model.api_key}"} if model.api_key else {}
+        response = await self._get_client(model).post(
+            model.api_endpoint, json=payload, headers=headers
+        )
+        response.raise_for_status()
+        try:
+            return response.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError, TypeError):
+            raise AIGatewayError(f"模型 {model.model_code} 返回格式无法识别")
+    
+    async def _post_limited(self, model: ModelProfile, payload: Dict[str, Any]) -> str:
+        async with self._get_semaphore(model):
+            self._in_flight[model.model_code] = self._in_flight.get(model.model_code, 0) + 1
+            try:
+                return await self._post(model, payload)
+            finally:
+                self._in_flight[model.model_code] -= 1
+    
+    async def _call_model(
+        self,
+        model: ModelProfile,
+        prompt: str,
+        system_prompt: Optional[str],
+        intent: Optional[str]
+    ) -> Dict[str, Any]:
+        """调用模型（受并发上限和超时约束），并记录使用日志"""
+        self.stats["model_calls"] += 1
+        start_time = time.monotonic()
+        content = None
+        error_message = None
+        
+        try:
+            # 排队等待并发名额的时间也计入超时
+            content = await asyncio.wait_for(
+                self._post_limited(model, self._build_payload(model, prompt, system_prompt)),
+                model.timeout
+            )
+            return {"content": content, "model_code": model.model_code}
+        
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            error_message = f"调用超时（{model.timeout}s）"
+            raise AIGatewayError(f"模型 {model.model_code} {error_message}")
+        
+        except httpx.HTTPError as e:
+            self.stats["errors"] += 1
+            error_message = f"{type(e).__name__}: {e}"
+            raise AIGatewayError(f"模型 {model.model_code} 调用失败: {error_message}") from e
+        
+        except AIGatewayError as e:
+            self.stats["errors"] += 1
+            error_message = str(e)
+            raise
+        
+        finally:
+            self.usage_sink.emit(
+                model_code=model.model_code,
+                user_message=prompt,
+                ai_response=content,
+                intent=intent,
+                response_time_ms=int((time.monotonic() - start_time) * 1000),
+                success=content is not None,
+                error_message=error_message
+            )
+    
+    async def complete(
+        self,
+        prompt: str,
+        model_code: Optional[str] = None,
+        system_prompt: Optional[str] = None,
+        use_cache: bool = True,
+        intent: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        调用模型生成回复
+        
+        Args:
+            prompt: 用户消息
+            model_code: 指定模型代码，为空时自动选择
+            system_prompt: 系统提示词
+            use_cache: 是否使用响应缓存（关闭后也不合并并发请求）
+            intent: 关联的意图（写入使用日志）
+        
+        Returns:
+            {content, model_code, cached, response_time_ms}
+        
+        Raises:
+            AIGatewayError: 无可用模型、超时或接口错误
+        """
+        self.stats["requests"] += 1
+        start_time = time.monotonic()
+        model = await self.select_model(model_code)
+        
+        if not use_cache:
+            result = await self._call_model(model, prompt, system_prompt, intent)
+            cached = False
+        else:
+            result, source = await self.cache.get_or_load(
+                CACHE_NAMESPACE,
+                prompt_cache_key(model.model_code, prompt, system_prompt),
+                lambda: self._call_model(model, prompt, system_prompt, intent),
+                expire_seconds=model.cache_ttl
+            )
+            cached = source != SOURCE_LOADER
+            if cached:
+                self.stats["cache_hits"] += 1
+        
+        return {
+            **result,
+            "cached": cached,
+            "response_time_ms": int((time.monotonic() - start_time) * 1000)
+        }
+    
+    # ==================== 生命周期 ====================
+    
+    async def stop(self):
+        """关闭连接池"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取网关统计"""
+        return {
+            **self.stats,
+            "models": [
+                {
+                    "model_code": m.model_code,
+                    "max_concurrency": m.max_concurrency,
+                    "timeout": m.timeout,
+                    "in_flight": self._in_flight.get(m.model_code, 0)
+                }
+                for m in self._models
+            ],
+            "endpoints": sorted(self._clients),
+            "usage_log": self.usage_sink.get_stats()
+        }
+
+
+# 全局AI网关实例
+ai_gateway = AIGateway()
@@ -4,7 +4,8 @@
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, and_, or_
-from app.models import Customer, TempBinding, WeWorkCustomerEvent, OperationLog
+from app.models import Customer, TempBinding, WeWorkCustomerEvent
+from app.services.log_sink import operation_log_sink
 from typing import Optional, Dict, List
 from datetime import datetime, timedelta
 import logging
@@ -379,7 +380,7 @@ class AutoBindingService:
             
             # 5. 记录操作日志
             await AutoBindingService._log_binding(
-                db, customer.id, employee_userid, 
+                customer.id, employee_userid, 
                 {'action': '自动绑定成功', 'source': 'wework_add_event'}
             )
             
@@ -603,21 +604,17 @@ class AutoBindingService:
     
     @staticmethod
     async def _log_binding(
-        db: AsyncSession,
         customer_id: int,
         operator_userid: str,
         detail: Dict
     ):
-        """记录绑定操作日志"""
-        log = OperationLog(
+        """记录绑定操作日志（缓冲写入，不额外提交事务）"""
+        await operation_log_sink.put(
             operation_type='customer_binding',
             entity_type='customer',
             entity_id=customer_id,
             operator_userid=operator_userid,
             operator_name='System',
             operation_source='system',
-            operation_detail=detail,
-            created_at=datetime.now()
+            operation_detail=detail
         )
-        db.add(log)
-        await db.commit()
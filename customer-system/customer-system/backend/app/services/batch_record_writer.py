@@ -0,0 +1,171 @@
+"""
+批量消息记录写入服务
+为 /api/messages/send-batch 展开并持久化大批量接收人
+
+功能：
+- 单个事务内分块批量插入 message_records（PostgreSQL + asyncpg 时使用 COPY）
+- 模板只编译一次，逐条渲染
+- Redis 链路追踪通过 pipeline 批量创建
+- 写入完成后再投递批量任务消息，消费者不会读到半截任务
+"""
+import os
+import time
+import uuid
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert, update
+
+from app.database import async_session_maker, get_redis
+from app.models_messaging import MessageRecord, MessageTask, MessageStatus
+from app.services.message_trace_service import MessageTracer
+from app.services.template_engine import template_cache
+
+logger = logging.getLogger(__name__)
+
+# 每次 INSERT 的行数（可通过环境变量调整）
+BATCH_INSERT_CHUNK_SIZE = int(os.getenv("BATCH_INSERT_CHUNK_SIZE", "1000"))
+
+# COPY 写入的列（与 _build_rows 生成的字段一致）
+COPY_COLUMNS = (
+    "record_id", "task_id", "receiver_phone", "receiver_userid",
+    "channel", "title", "content", "status", "trace_id"
+)
+
+
+def split_recipient(recipient: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    区分接收人是手机号还是UserID
+    
+    Returns:
+        (receiver_phone, receiver_userid)
+    """
+    if recipient.isdigit() and len(recipient) == 11:
+        return recipient, None
+    return None, recipient
+
+
+def _build_rows(
+    task_id: str,
+    template: Dict[str, Any],
+    recipients: List[str],
+    variables_list: Optional[List[dict]]
+) -> List[Dict[str, Any]]:
+    """生成消息记录行"""
+    compiled = template_cache.get(
+        template["content"],
+        (template["id"], template.get("version"))
+    )
+    
+    rows = []
+    for i, recipient in enumerate(recipients):
+        variables = variables_list[i] if variables_list and i < len(variables_list) else {}
+        receiver_phone, receiver_userid = split_recipient(recipient)
+        
+        rows.append({
+            "record_id": f"{task_id}_{i:06d}",
+            "task_id": task_id,
+            "receiver_phone": receiver_phone,
+            "receiver_userid": receiver_userid,
+            "channel": template["channel"],
+            "title": template.get("title"),
+            "content": compiled.render(variables),
+            "status": MessageStatus.PENDING.value,
+            "trace_id": f"trace_{uuid.uuid4().hex}"
+        })
+    
+    return rows
+
+
+async def _copy_rows(db, rows: List[Dict[str, Any]]) -> bool:
+    """
+    PostgreSQL + asyncpg 时使用 COPY 写入，返回是否已写入
+    
+    asyncpg 适配层在第一条 execute 时才发出 BEGIN；调用前会话必须已经执行过语句，
+    否则 COPY 在驱动连接上以自动提交方式执行，不在同一个事务里。
+    """
+    connection = await db.connection()
+    if connection.dialect.driver != "asyncpg":
+        return False
+    
+    raw = await connection.get_raw_connection()
+    await raw.driver_connection.copy_records_to_table(
+        MessageRecord.__tablename__,
+        records=[tuple(row[column] for column in COPY_COLUMNS) for row in rows],
+        columns=list(COPY_COLUMNS)
+    )
+    return True
+
+
+async def write_batch_records(
+    task_id: str,
+    template: Dict[str, Any],
+    recipients: List[str],
+    variables_list: Optional[List[dict]] = None,
+    on_ready: Optional[Callable[[str], None]] = None,
+    session_maker=async_session_maker,
+    chunk_size: int = BATCH_INSERT_CHUNK_SIZE
+) -> int:
+    """
+    展开并写入批量任务的消息记录
+    
+    Args:
+        task_id: 任务ID（MessageTask.task_id）
+        template: 模板快照 {id, version, channel, title, content}
+        recipients: 接收人列表
+        variables_list: 与接收人一一对应的变量列表
+        on_ready: 写入成功后的回调（投递批量任务消息）
+        session_maker: 数据库会话工厂
+        chunk_size: 每次 INSERT 的行数
+    
+    Returns:
+        写入的记录数
+    """
+    start_time = time.time()
+    rows = _build_rows(task_id, template, recipients, variables_list)
+    
+    try:
+        async with session_maker() as db:
+            async with db.begin():
+                # 先更新任务：这条语句让驱动连接真正开启事务，随后的 COPY 与它一起提交或回滚
+                await db.execute(
+                    update(MessageTask)
+                    .where(MessageTask.task_id == task_id)
+                    .values(status=MessageStatus.PENDING.value, total_count=len(rows))
+                )
+                
+                if not await _copy_rows(db, rows):
+                    for offset in range(0, len(rows), chunk_size):
+                        await db.execute(insert(MessageRecord), rows[offset:offset + chunk_size])
+    except Exception as e:
+        logger.error(f"[批量写入] 任务 {task_id} 写入失败: {e}")
+        async with session_maker() as db:
+            await db.execute(
+                update(MessageTask)
+                .where(MessageTask.task_id == task_id)
+                .values(status=MessageStatus.FAILED.value)
+            )
+            await db.commit()
+        return 0
+    
+    # 链路追踪不影响发送，失败只记录日志
+    redis_conn = get_redis()
+    if redis_conn:
+        MessageTracer(redis_conn).start_traces_bulk({
+            row["trace_id"]: {
+                "task_id": task_id,
+                "record_id": row["record_id"],
+                "channel": row["channel"],
+                "recipient": row["receiver_phone"] or row["receiver_userid"]
+            }
+            for row in rows
+        })
+    
+    if on_ready:
+        on_ready(task_id)
+    
+    logger.info(
+        f"[批量写入] 任务 {task_id} 写入 {len(rows)} 条, "
+        f"耗时 {int((time.time() - start_time) * 1000)}ms"
+    )
+    return len(rows)
@@ -0,0 +1,317 @@
+"""
+批量任务执行器
+流式处理一个消息任务下的全部待发送记录
+
+功能：
+- 按主键游标（keyset）分页遍历待发送记录，不受单次 limit 限制
+- 每页内按并发上限同时发送
+- 每页先用一条 UPDATE ... RETURNING 原子认领（pending → processing，updated_at 作为租约起点），
+  只发送本次认领到的记录：消息重投或同一任务并发执行时，同一条记录不会被发送两次
+- 认领超过 BATCH_TASK_CLAIM_LEASE 秒仍未回写的记录视为执行者已退出，可被重新认领，不会卡在发送中
+- 状态回写使用 UPDATE ... WHERE id = ANY(:ids) AND status = 'processing' 批量语句，每页一个事务
+- 按回写实际改动的行数（rowcount）累加 MessageTask.success_count / failed_count
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, update, func, any_, or_, and_, bindparam, text, Integer
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from app.database import async_session_maker
+from app.models_messaging import MessageRecord, MessageTask, MessageStatus
+
+logger = logging.getLogger(__name__)
+
+# 每页读取的记录数 / 每页内的并发发送数（可通过环境变量调整）
+BATCH_PAGE_SIZE = int(os.getenv("BATCH_TASK_PAGE_SIZE", "500"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_TASK_CONCURRENCY", "50"))
+# 认领租约（秒）：需大于发送一页的最长耗时
+BATCH_CLAIM_LEASE = int(os.getenv("BATCH_TASK_CLAIM_LEASE", "300"))
+
+# 发送函数：接收消息字典，返回 (是否成功, 错误信息)
+SendFunc = Callable[[Dict[str, Any]], Awaitable[Tuple[bool, Optional[str]]]]
+
+# 尚未回写结果的记录状态
+_UNSENT_STATUSES = (MessageStatus.PENDING.value, MessageStatus.PROCESSING.value)
+
+# 发送时需要的字段
+_RECORD_COLUMNS = (
+    MessageRecord.id,
+    MessageRecord.record_id,
+    MessageRecord.trace_id,
+    MessageRecord.channel,
+    MessageRecord.receiver_phone,
+    MessageRecord.receiver_userid,
+    MessageRecord.title,
+    MessageRecord.content
+)
+
+
+def _ids_param(name: str):
+    """整型数组参数，渲染为 = ANY(:ids)，只占一个绑定参数"""
+    return any_(bindparam(name, type_=ARRAY(Integer)))
+
+
+class BatchTaskExecutor:
+    """批量任务执行器"""
+    
+    def __init__(
+        self,
+        send: SendFunc,
+        session_maker=async_session_maker,
+        page_size: int = BATCH_PAGE_SIZE,
+        concurrency: int = BATCH_CONCURRENCY,
+        claim_lease: int = BATCH_CLAIM_LEASE
+    ):
+        """
+        初始化
+        
+        Args:
+            send: 单条发送函数
+            session_maker: 数据库会话工厂
+            page_size: 每页记录数
+            concurrency: 每页内的并发发送数
+            claim_lease: 认领租约（秒），超时未回写的记录可被重新认领
+        """
+        self.send = send
+        self.session_maker = session_maker
+        self.page_size = page_size
+        self.concurrency = concurrency
+        self.claim_lease = claim_lease
+    
+    async def run(self, task_id: str) -> Dict[str, Any]:
+        """
+        执行任务
+        
+        Args:
+            task_id: 任务ID
+        
+        Returns:
+            本次执行的汇总 {total, success_count, failed_count, pages, duration_ms}
+            （只统计本次认领并回写的记录）
+        """
+        start_time = time.time()
+        summary = {
+            "task_id": task_id,
+            "total": 0,
+            "success_count": 0,
+            "failed_count": 0,
+            "pages": 0
+        }
+        
+        await self._mark_task(task_id, "processing", started_at=datetime.now())
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        last_id = 0
+        
+        while True:
+            last_id, records = await self._claim_page(task_id, last_id)
+            if last_id is None:
+                break
+            if not records:
+                # 本页已被其他执行者认领
+                continue
+            
+            summary["pages"] += 1
+            summary["total"] += len(records)
+            
+            results = await asyncio.gather(
+                *(self._send_one(record, semaphore) for record in records)
+            )
+            
+            success_ids = [record_id for record_id, ok, _ in results if ok]
+            failures = [(record_id, error) for record_id, ok, error in results if not ok]
+            
+            success_count, failed_count = await self._write_back(task_id, success_ids, failures)
+            
+            summary["success_count"] += success_count
+            summary["failed_count"] += failed_count
+            
+            logger.info(
+                f"[批量任务] {task_id} 第{summary['pages']}页: "
+                f"成功 {success_count}, 失败 {failed_count}"
+            )
+        
+        await self._finish_task(task_id)
+        
+        summary["duration_ms"] = int((time.time() - start_time) * 1000)
+        logger.info(
+            f"[批量任务] {task_id} 完成: 共 {summary['total']} 条, "
+            f"成功 {summary['success_count']}, 失败 {summary['failed_count']}, "
+            f"耗时 {summary['duration_ms']}ms"
+        )
+        return summary
+    
+    async def _claim_page(self, task_id: str, last_id: int) -> Tuple[Optional[int], List[Dict[str, Any]]]:
+        """
+        认领下一页待发送记录
+        
+        先按主键游标取一页候选ID，再用一条 UPDATE ... RETURNING 认领其中仍可认领的记录：
+        pending，或 processing 且租约已过期（执行者中途退出）。并发执行时行锁保证
+        每条记录只被一个执行者认领。
+        
+        Returns:
+            (本页最大ID, 本次认领到的记录)；没有更多候选时返回 (None, [])
+        """
+        lease_expired = func.now() - text(f"interval '{int(self.claim_lease)} seconds'")
+        
+        async with self.session_maker() as db:
+            candidate_ids = (await db.execute(
+                select(MessageRecord.id).where(
+                    MessageRecord.task_id == task_id,
+                    MessageRecord.status.in_(_UNSENT_STATUSES),
+                    MessageRecord.id > last_id
+                ).order_by(MessageRecord.id).limit(self.page_size)
+            )).scalars().all()
+            if not candidate_ids:
+                return None, []
+            
+            result = await db.execute(
+                update(MessageRecord)
+                .where(
+                    MessageRecord.id == _ids_param("ids"),
+                    or_(
+                        MessageRecord.status == MessageStatus.PENDING.value,
+                        and_(
+                            MessageRecord.status == MessageStatus.PROCESSING.value,
+                            or_(MessageRecord.updated_at.is_(None), MessageRecord.updated_at < lease_expired)
+                        )
+                    )
+                )
+                .values(status=MessageStatus.PROCESSING.value, updated_at=func.now())
+                .returning(*_RECORD_COLUMNS)
+                .execution_options(synchronize_session=False),
+                {"ids": list(candidate_ids)}
+            )
+            records = sorted((dict(row._mapping) for row in result), key=lambda record: record["id"])
+            await db.commit()
+        
+        return candidate_ids[-1], records
+    
+    async def _send_one(
+        self,
+        record: Dict[str, Any],
+        semaphore: asyncio.Semaphore
+    ) -> Tuple[int, bool, Optional[str]]:
+        """发送单条记录"""
+        message = {
+            "record_id": record["id"],
+            "trace_id": record["trace_id"],
+            "channel": record["channel"],
+            "recipient": record["receiver_userid"] or record["receiver_phone"],
+            "title": record["title"],
+            "content": record["content"]
+        }
+        
+        async with semaphore:
+            try:
+                success, error = await self.send(message)
+            except Exception as e:
+                logger.error(f"[批量任务] 发送异常 record={record['id']}: {e}")
+                success, error = False, str(e)
+        
+        return record["id"], success, error
+    
+    async def _write_back(
+        self,
+        task_id: str,
+        success_ids: List[int],
+        failures: List[Tuple[int, Optional[str]]]
+    ) -> Tuple[int, int]:
+        """
+        一个事务内回写本页结果并累加任务统计
+        
+        只改动仍处于 processing 的记录；任务统计按实际改动的行数累加，
+        租约过期被重新认领的记录即使两边都回写也只计一次
+        
+        Returns:
+            (成功数, 失败数)
+        """
+        success_count = failed_count = 0
+        
+        async with self.session_maker() as db:
+            if success_ids:
+                result = await db.execute(
+                    update(MessageRecord)
+                    .where(MessageRecord.id == _ids_param("ids"), MessageRecord.status == MessageStatus.PROCESSING.value)
+                    .values(status=MessageStatus.SUCCESS.value, send_time=func.now())
+                    .execution_options(synchronize_session=False),
+                    {"ids": success_ids}
+                )
+                success_count = result.rowcount
+            
+            # 按错误信息分组，同一错误一条语句
+            failed_groups: Dict[str, List[int]] = {}
+            for record_id, error in failures:
+                failed_groups.setdefault(error or "发送失败", []).append(record_id)
+            
+            for error, ids in failed_groups.items():
+                result = await db.execute(
+                    update(MessageRecord)
+                    .where(MessageRecord.id == _ids_param("ids"), MessageRecord.status == MessageStatus.PROCESSING.value)
+                    .values(status=MessageStatus.FAILED.value, error_message=error)
+                    .execution_options(synchronize_session=False),
+                    {"ids": ids}
+                )
+                failed_count += result.rowcount
+            
+            if success_count or failed_count:
+                await db.execute(
+                    update(MessageTask)
+                    .where(MessageTask.task_id == task_id)
+                    .values(
+                        success_count=func.coalesce(MessageTask.success_count, 0) + success_count,
+                        failed_count=func.coalesce(MessageTask.failed_count, 0) + failed_count
+                    )
+                )
+            
+            await db.commit()
+        
+        return success_count, failed_count
+    
+    async def _finish_task(self, task_id: str):
+        """
+        所有记录都已回写时结束任务
+        
+        仍有其他执行者认领中的记录时不改任务状态，由最后完成的执行者结束任务
+        """
+        try:
+            async with self.session_maker() as db:
+                remaining = (await db.execute(
+                    select(func.count(MessageRecord.id)).where(
+                        MessageRecord.task_id == task_id,
+                        MessageRecord.status.in_(_UNSENT_STATUSES)
+                    )
+                )).scalar_one()
+                if remaining:
+                    logger.info(f"[批量任务] {task_id} 仍有 {remaining} 条记录由其他执行者处理中")
+                    return
+                
+                counts = (await db.execute(
+                    select(MessageTask.success_count, MessageTask.failed_count)
+                    .where(MessageTask.task_id == task_id)
+                )).first()
+        except Exception as e:
+            logger.error(f"[批量任务] 查询任务进度失败 {task_id}: {e}")
+            return
+        
+        success_count, failed_count = (counts or (0, 0))
+        final_status = "failed" if failed_count and not success_count else "completed"
+        await self._mark_task(task_id, final_status, finished_at=datetime.now())
+    
+    async def _mark_task(self, task_id: str, status: str, **values):
+        """更新任务状态"""
+        try:
+            async with self.session_maker() as db:
+                await db.execute(
+                    update(MessageTask)
+                    .where(MessageTask.task_id == task_id)
+                    .values(status=status, **values)
+                )
+                await db.commit()
+        except Exception as e:
+            logger.error(f"[批量任务] 更新任务状态失败 {task_id}: {e}")
@@ -0,0 +1,161 @@
+"""
+缓存失效总线
+项目数据变更时，精确清除所有缓存层中该项目的缓存
+
+- 写入方调用 publish_project_changed(project_id)
+- 本进程：立即删除 Redis 键 project_status/project_detail/project_progress:{id}，
+  并执行已注册的进程内失效回调
+- 其他 worker：通过 Redis pub/sub 收到事件，只清除各自的进程内缓存
+- Redis 不可用时退化为仅本进程失效
+"""
+import os
+import json
+import uuid
+import logging
+import threading
+from typing import Callable, Iterable, List, Optional
+
+from app.database import get_redis
+from app.services.cache_service import cache_service
+
+logger = logging.getLogger(__name__)
+
+# 失效事件频道
+INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate:project")
+
+
+class CacheInvalidationBus:
+    """缓存失效总线"""
+    
+    def __init__(self, redis_conn=None, channel: str = INVALIDATION_CHANNEL):
+        """
+        初始化
+        
+        Args:
+            redis_conn: Redis客户端，默认使用 app.database.get_redis()（首次使用时连接，不可用时仅在本进程内失效）
+            channel: pub/sub 频道
+        """
+        self._redis_conn = redis_conn
+        self.channel = channel
+        # 本进程标识，忽略自己发出的事件
+        self.origin = uuid.uuid4().hex
+        
+        self._local_handlers: List[Callable[[str], None]] = []
+        self._pubsub = None
+        self._listener: Optional[threading.Thread] = None
+        
+        self.stats = {"published": 0, "received": 0, "evicted": 0}
+    
+    @property
+    def redis_client(self):
+        """Redis客户端（未指定时每次取共享客户端）"""
+        return self._redis_conn if self._redis_conn is not None else get_redis()
+    
+    def register_local(self, handler: Callable[[str], None]):
+        """
+        注册进程内缓存的失效回调
+        
+        Args:
+            handler: 接收项目ID（字符串）的函数，需线程安全
+        """
+        self._local_handlers.append(handler)
+    
+    def _evict_local(self, project_ids: Iterable[str]):
+        """执行进程内失效回调"""
+        for project_id in project_ids:
+            for handler in self._local_handlers:
+                try:
+                    handler(project_id)
+                except Exception as e:
+                    logger.error(f"[缓存失效] 本地失效回调出错: {e}")
+            self.stats["evicted"] += 1
+    
+    def publish_project_changed(self, project_id, reason: str = ""):
+        """
+        发布单个项目变更事件
+        
+        Args:
+            project_id: 项目ID
+            reason: 变更来源（用于日志）
+        """
+        self.publish_projects_changed([project_id], reason)
+    
+    def publish_projects_changed(self, project_ids: Iterable, reason: str = ""):
+        """
+        发布一批项目变更事件（一次 Redis 删除 + 一次广播）
+        
+        Args:
+            project_ids: 项目ID列表
+            reason: 变更来源（用于日志）
+        """
+        project_ids = [str(project_id) for project_id in project_ids if project_id is not None]
+        if not project_ids:
+            return
+        
+        # 共享的 Redis 缓存只需删除一次
+        if self.redis_client:
+            try:
+                keys = [
+                    f"{namespace}:{project_id}"
+                    for project_id in project_ids
+                    for namespace in cache_service.PROJECT_NAMESPACES
+                ]
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.delete(*keys)
+                pipe.publish(self.channel, json.dumps({
+                    "origin": self.origin,
+                    "project_ids": project_ids,
+                    "reason": reason
+                }))
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"[缓存失效] Redis失效/广播失败: {e}")
+        
+        self._evict_local(project_ids)
+        self.stats["published"] += len(project_ids)
+        
+        logger.debug(f"[缓存失效] {reason or 'changed'}: {project_ids}")
+    
+    # ==================== 订阅 ====================
+    
+    def start(self):
+        """启动订阅线程（应用启动时调用）"""
+        if not self.redis_client or self._listener:
+            return
+        
+        try:
+            self._pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            self._pubsub.subscribe(**{self.channel: self._on_message})
+            self._listener = self._pubsub.run_in_thread(sleep_time=1.0, daemon=True)
+            logger.info(f"[缓存失效] 已订阅频道: {self.channel}")
+        except Exception as e:
+            logger.warning(f"[缓存失效] 订阅失败，仅本进程内失效: {e}")
+            self._pubsub = None
+            self._listener = None
+    
+    def stop(self):
+        """停止订阅线程（应用关闭时调用）"""
+        if self._listener:
+            self._listener.stop()
+            self._listener = None
+        if self._pubsub:
+            self._pubsub.close()
+            self._pubsub = None
+    
+    def _on_message(self, message):
+        """处理其他 worker 发出的失效事件"""
+        try:
+            event = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        
+        if event.get("origin") == self.origin:
+            return
+        
+        self.stats["received"] += 1
+        self._evict_local(event.get("project_ids", []))
+
+
+# 全局缓存失效总线
+invalidation_bus = CacheInvalidationBus()
+invalidation_bus.register_local(cache_service.evict_local_project)
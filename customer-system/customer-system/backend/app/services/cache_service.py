@@ -1,41 +1,374 @@
 """
 Redis缓存服务
 用于缓存项目数据，减少数据库查询压力
+
+两级缓存：
+- 一级：进程内 TTL/LRU 缓存（每个 worker 独立，TTL 较短）
+- 二级：Redis（可选，不可用时自动降级为仅一级缓存）
+
+防击穿：
+- 同一个键的并发未命中只触发一次加载（single-flight），其余请求等待同一结果；
+  加载在独立任务中执行，发起加载的请求被取消不影响其他等待者
+- 不存在的项目做负缓存，避免反复穿透到数据库
+
+异步路径（get_or_load）使用异步Redis客户端，不阻塞事件循环
 """
 import json
-import redis
+import time
+import asyncio
+import logging
+import threading
 import os
-from typing import Optional, Dict, Any
-from datetime import timedelta
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Awaitable, Callable, Hashable, Tuple
+
+from app.database import REDIS_RETRY_INTERVAL, get_async_redis, get_redis
+from app.services.metrics import MetricFamily, metrics
+
+logger = logging.getLogger(__name__)
+
+# 缓存配置（可通过环境变量调整）
+CACHE_LOCAL_MAX_SIZE = int(os.getenv("CACHE_LOCAL_MAX_SIZE", "2048"))
+CACHE_LOCAL_TTL = int(os.getenv("CACHE_LOCAL_TTL", "30"))
+CACHE_NEGATIVE_TTL = int(os.getenv("CACHE_NEGATIVE_TTL", "30"))
+
+# Redis 中表示「确认不存在」的占位值
+NEGATIVE_MARKER = "__not_found__"
+
+# 缓存命中来源
+SOURCE_LOCAL = "local"
+SOURCE_REDIS = "redis"
+SOURCE_LOADER = "loader"
+
+
+class _Negative:
+    """负缓存占位对象（进程内）"""
+    
+    __slots__ = ()
+
+
+NEGATIVE = _Negative()
+
+
+class LocalTTLCache:
+    """进程内 TTL + LRU 缓存"""
+    
+    def __init__(self, max_size: int = CACHE_LOCAL_MAX_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key: Hashable) -> Optional[Any]:
+        """读取，过期或不存在返回 None"""
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            
+            self._items.move_to_end(key)
+            return value
+    
+    def set(self, key: Hashable, value: Any, ttl: int):
+        """写入"""
+        with self._lock:
+            self._items[key] = (time.monotonic() + ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+    
+    def delete(self, key: Hashable):
+        """删除"""
+        with self._lock:
+            self._items.pop(key, None)
+    
+    def clear(self):
+        """清空"""
+        with self._lock:
+            self._items.clear()
+    
+    def __len__(self):
+        return len(self._items)
 
 
 class CacheService:
-    """Redis缓存管理服务"""
+    """两级缓存管理服务"""
     
-    def __init__(self):
-        """初始化Redis连接"""
-        self.redis_client = None
-        self.available = False
+    # 项目相关的缓存命名空间（与 Redis 键前缀一致）
+    PROJECT_NAMESPACES = ("project_status", "project_detail", "project_progress")
+    
+    def __init__(self, redis_conn=None, local_ttl: int = CACHE_LOCAL_TTL, async_redis_conn=None):
+        """
+        初始化
         
-        # 完全跳过Redis连接，避免启动阻塞
-        print("⚠️  Redis功能已禁用，缓存功能不可用")
-        return
+        Args:
+            redis_conn: Redis客户端，默认使用 app.database.get_redis()（首次使用时连接，不可用时仅使用进程内缓存）
+            local_ttl: 进程内缓存的最长TTL（秒）
+            async_redis_conn: 异步Redis客户端（get_or_load 使用），默认使用 app.database.get_async_redis()
+        """
+        self._redis_conn = redis_conn
+        self._async_redis_conn = async_redis_conn
+        # 异步客户端出错后 REDIS_RETRY_INTERVAL 秒内不再访问，避免每次请求都等待连接超时
+        self._async_redis_down_until = 0.0
+        self.local = LocalTTLCache()
+        self.local_ttl = local_ttl
+        
+        # 正在进行的加载（single-flight）
+        self._inflight: Dict[str, asyncio.Task] = {}
         
-        # 以下代码不会执行
-        redis_url = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+        self.stats = {
+            "local_hits": 0,
+            "redis_hits": 0,
+            "negative_hits": 0,
+            "misses": 0,
+            "loads": 0,
+            "coalesced": 0,
+            "redis_errors": 0
+        }
+        
+    @property
+    def redis_client(self):
+        """Redis客户端（未指定时每次取共享客户端，Redis 恢复后自动重新启用）"""
+        return self._redis_conn if self._redis_conn is not None else get_redis()
+    
+    @property
+    def available(self) -> bool:
+        return self.redis_client is not None
+    
+    @property
+    def async_redis_client(self):
+        """异步Redis客户端，未配置或最近出错时返回 None"""
+        if time.monotonic() < self._async_redis_down_until:
+            return None
+        return self._async_redis_conn if self._async_redis_conn is not None else get_async_redis()
+    
+    @staticmethod
+    def _key(namespace: str, key: Any) -> str:
+        return f"{namespace}:{key}"
+    
+    @staticmethod
+    def _decode(data: Optional[str]) -> Optional[Any]:
+        if data is None:
+            return None
+        return NEGATIVE if data == NEGATIVE_MARKER else json.loads(data)
+    
+    @staticmethod
+    def _encode(value: Any) -> str:
+        return NEGATIVE_MARKER if value is NEGATIVE else json.dumps(value, ensure_ascii=False, default=str)
+    
+    # ==================== 基础读写 ====================
+    
+    def _redis_get(self, cache_key: str) -> Optional[Any]:
+        """读取Redis，出错时降级（返回None）"""
+        if not self.available:
+            return None
         try:
-            self.redis_client = redis.from_url(
-                redis_url, 
-                decode_responses=True,
-                socket_connect_timeout=0.1,
-                socket_timeout=0.1
-            )
-            self.available = False
-            print("⚠️  Redis连接跳过测试")
+            return self._decode(self.redis_client.get(cache_key))
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            logger.warning(f"[缓存] Redis读取失败: {e}")
+            return None
+    
+    def _redis_set(self, cache_key: str, value: Any, ttl: int) -> bool:
+        """写入Redis，出错时降级"""
+        if not self.available:
+            return False
+        try:
+            self.redis_client.setex(cache_key, ttl, self._encode(value))
+            return True
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            logger.warning(f"[缓存] Redis写入失败: {e}")
+            return False
+    
+    def _async_redis_failed(self, action: str, e: Exception):
+        self.stats["redis_errors"] += 1
+        self._async_redis_down_until = time.monotonic() + REDIS_RETRY_INTERVAL
+        logger.warning(f"[缓存] Redis{action}失败，{REDIS_RETRY_INTERVAL:.0f}s 内仅使用进程内缓存: {e}")
+    
+    async def _aredis_get(self, cache_key: str) -> Optional[Any]:
+        """异步读取Redis，出错时降级（返回None）"""
+        client = self.async_redis_client
+        if client is None:
+            return None
+        try:
+            return self._decode(await client.get(cache_key))
+        except Exception as e:
+            self._async_redis_failed("读取", e)
+            return None
+    
+    async def _aredis_set(self, cache_key: str, value: Any, ttl: int) -> bool:
+        """异步写入Redis，出错时降级"""
+        client = self.async_redis_client
+        if client is None:
+            return False
+        try:
+            await client.setex(cache_key, ttl, self._encode(value))
+            return True
+        except Exception as e:
+            self._async_redis_failed("写入", e)
+            return False
+    
+    def get(self, namespace: str, key: Any) -> Tuple[Optional[Any], Optional[str]]:
+        """
+        读取缓存（先进程内，后Redis）
+        
+        Returns:
+            (值, 命中来源)；值可能为 NEGATIVE（确认不存在），未命中返回 (None, None)
+        """
+        cache_key = self._key(namespace, key)
+        
+        value = self.local.get(cache_key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            return value, SOURCE_LOCAL
+        
+        value = self._redis_get(cache_key)
+        if value is not None:
+            self.stats["redis_hits"] += 1
+            # 回填一级缓存
+            self.local.set(cache_key, value, self.local_ttl)
+            return value, SOURCE_REDIS
+        
+        self.stats["misses"] += 1
+        return None, None
+    
+    async def aget(self, namespace: str, key: Any) -> Tuple[Optional[Any], Optional[str]]:
+        """get 的异步版本（Redis 使用异步客户端）"""
+        cache_key = self._key(namespace, key)
+        
+        value = self.local.get(cache_key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            return value, SOURCE_LOCAL
+        
+        value = await self._aredis_get(cache_key)
+        if value is not None:
+            self.stats["redis_hits"] += 1
+            self.local.set(cache_key, value, self.local_ttl)
+            return value, SOURCE_REDIS
+        
+        self.stats["misses"] += 1
+        return None, None
+    
+    def set(self, namespace: str, key: Any, value: Any, expire_seconds: int = 600) -> bool:
+        """
+        写入两级缓存
+        
+        Returns:
+            是否写入了Redis
+        """
+        cache_key = self._key(namespace, key)
+        self.local.set(cache_key, value, min(expire_seconds, self.local_ttl))
+        return self._redis_set(cache_key, value, expire_seconds)
+    
+    async def aset(self, namespace: str, key: Any, value: Any, expire_seconds: int = 600) -> bool:
+        """set 的异步版本（Redis 使用异步客户端）"""
+        cache_key = self._key(namespace, key)
+        self.local.set(cache_key, value, min(expire_seconds, self.local_ttl))
+        return await self._aredis_set(cache_key, value, expire_seconds)
+    
+    def delete(self, namespace: str, key: Any) -> bool:
+        """删除两级缓存"""
+        cache_key = self._key(namespace, key)
+        self.local.delete(cache_key)
+        
+        if not self.available:
+            return False
+        try:
+            self.redis_client.delete(cache_key)
+            return True
         except Exception as e:
-            print(f"⚠️  Redis初始化失败: {str(e)[:50]}")
-            self.redis_client = None
-            self.available = False
+            self.stats["redis_errors"] += 1
+            logger.warning(f"[缓存] Redis删除失败: {e}")
+            return False
+    
+    async def get_or_load(
+        self,
+        namespace: str,
+        key: Any,
+        loader: Callable[[], Awaitable[Optional[Any]]],
+        expire_seconds: int = 600,
+        negative_ttl: int = CACHE_NEGATIVE_TTL
+    ) -> Tuple[Optional[Any], str]:
+        """
+        读取缓存，未命中时调用 loader 加载并回填
+        
+        同一个键的并发未命中只执行一次 loader；loader 返回 None 表示数据不存在，
+        结果会以 negative_ttl 负缓存。loader 在独立任务中执行，所有调用方通过
+        asyncio.shield 等待：任一调用方被取消只影响它自己，加载照常完成并回填；
+        loader 抛出的异常会传给本次所有等待者，下一次调用重新加载。
+        
+        Args:
+            namespace: 命名空间，如 project_status
+            key: 键，如项目ID
+            loader: 异步加载函数
+            expire_seconds: 缓存时间（秒）
+            negative_ttl: 负缓存时间（秒）
+        
+        Returns:
+            (值或None, 命中来源 local/redis/loader)
+        """
+        value, source = await self.aget(namespace, key)
+        if source:
+            if value is NEGATIVE:
+                self.stats["negative_hits"] += 1
+                return None, source
+            return value, source
+        
+        cache_key = self._key(namespace, key)
+        task = self._inflight.get(cache_key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["loads"] += 1
+            task = asyncio.ensure_future(
+                self._load(namespace, key, loader, expire_seconds, negative_ttl)
+            )
+            self._inflight[cache_key] = task
+            task.add_done_callback(lambda done: self._load_done(cache_key, done))
+        
+        return await asyncio.shield(task), SOURCE_LOADER
+        
+    async def _load(
+        self,
+        namespace: str,
+        key: Any,
+        loader: Callable[[], Awaitable[Optional[Any]]],
+        expire_seconds: int,
+        negative_ttl: int
+    ) -> Optional[Any]:
+        """执行 loader 并回填两级缓存（在独立任务中运行）"""
+        value = await loader()
+        if value is None:
+            await self.aset(namespace, key, NEGATIVE, negative_ttl)
+        else:
+            await self.aset(namespace, key, value, expire_seconds)
+        return value
+            
+    def _load_done(self, cache_key: str, task: asyncio.Task):
+        if self._inflight.get(cache_key) is task:
+            del self._inflight[cache_key]
+        # 所有等待者都已取消时无人读取结果，在此取走异常，避免「Task exception was never retrieved」警告
+        if not task.cancelled():
+            task.exception()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存统计"""
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "local_size": len(self.local),
+            "redis_available": self.available
+        }
+    
+    # ==================== 项目缓存 ====================
     
     def get_project_progress(self, project_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -43,22 +376,12 @@ class CacheService:
         
         Args:
             project_id: 项目ID
-            
+        
         Returns:
             项目进度数据，未命中缓存返回None
         """
-        if not self.available:
-            return None
-        
-        try:
-            cache_key = f"project_progress:{project_id}"
-            data = self.redis_client.get(cache_key)
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            print(f"⚠️  Redis读取失败: {e}")
-            return None
+        value, _ = self.get("project_progress", project_id)
+        return None if value is NEGATIVE else value
     
     def set_project_progress(
         self,
@@ -73,24 +396,11 @@ class CacheService:
             project_id: 项目ID
             data: 要缓存的数据
             expire_seconds: 过期时间（秒），默认10分钟
-            
+        
         Returns:
-            是否设置成功
+            是否写入了Redis
         """
-        if not self.available:
-            return False
-        
-        try:
-            cache_key = f"project_progress:{project_id}"
-            self.redis_client.setex(
-                cache_key,
-                expire_seconds,
-                json.dumps(data, ensure_ascii=False)
-            )
-            return True
-        except Exception as e:
-            print(f"⚠️  Redis写入失败: {e}")
-            return False
+        return self.set("project_progress", project_id, data, expire_seconds)
     
     def get_project_detail(self, project_id: int) -> Optional[Dict[str, Any]]:
         """
@@ -98,22 +408,12 @@ class CacheService:
         
         Args:
             project_id: 项目ID
-            
+        
         Returns:
             项目详情数据，未命中缓存返回None
         """
-        if not self.available:
-            return None
-        
-        try:
-            cache_key = f"project_detail:{project_id}"
-            data = self.redis_client.get(cache_key)
-            if data:
-                return json.loads(data)
-            return None
-        except Exception as e:
-            print(f"⚠️  Redis读取失败: {e}")
-            return None
+        value, _ = self.get("project_detail", project_id)
+        return None if value is NEGATIVE else value
     
     def set_project_detail(
         self,
@@ -128,49 +428,51 @@ class CacheService:
             project_id: 项目ID
             data: 要缓存的数据
             expire_seconds: 过期时间（秒），默认10分钟
-            
+        
         Returns:
-            是否设置成功
+            是否写入了Redis
         """
-        if not self.available:
-            return False
+        return self.set("project_detail", project_id, data, expire_seconds)
+    
+    def evict_local_project(self, project_id) -> None:
+        """
+        清除进程内的项目缓存（由缓存失效总线调用）
         
-        try:
-            cache_key = f"project_detail:{project_id}"
-            self.redis_client.setex(
-                cache_key,
-                expire_seconds,
-                json.dumps(data, ensure_ascii=False)
-            )
-            return True
-        except Exception as e:
-            print(f"⚠️  Redis写入失败: {e}")
-            return False
+        Args:
+            project_id: 项目ID
+        """
+        for namespace in self.PROJECT_NAMESPACES:
+            self.local.delete(self._key(namespace, project_id))
     
     def invalidate_project_cache(self, project_id: int) -> bool:
         """
-        清除项目相关的所有缓存
+        清除项目相关的所有缓存（所有 worker）
         
         Args:
             project_id: 项目ID
-            
+        
         Returns:
-            是否清除成功
+            是否清除了Redis缓存
         """
-        if not self.available:
-            return False
+        from app.services.cache_invalidation import invalidation_bus
         
-        try:
-            keys = [
-                f"project_progress:{project_id}",
-                f"project_detail:{project_id}"
-            ]
-            self.redis_client.delete(*keys)
-            return True
-        except Exception as e:
-            print(f"⚠️  Redis删除失败: {e}")
-            return False
+        invalidation_bus.publish_project_changed(project_id, "manual")
+        return self.available
 
 
 # 全局缓存服务实例
 cache_service = CacheService()
+
+
+def _collect_cache_metrics():
+    requests = MetricFamily("cache_requests_total", "counter", "缓存查询次数（按命中层级）", ("cache", "result"))
+    for result, stat in (("local_hit", "local_hits"), ("redis_hit", "redis_hits"),
+                         ("negative_hit", "negative_hits"), ("miss", "misses")):
+        requests.add(cache_service.stats[stat], "data", result)
+    return [
+        requests,
+        MetricFamily("cache_entries", "gauge", "进程内缓存条目数", ("cache",)).add(len(cache_service.local), "data")
+    ]
+
+
+metrics.register_collector("cache_service", _collect_cache_metrics)
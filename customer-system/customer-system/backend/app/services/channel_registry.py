@@ -0,0 +1,184 @@
+"""
+渠道配置注册表
+channel_configs 整表加载到内存，发送消息时只做字典查找
+
+- 每个渠道的配置预先建好索引（群机器人：group_id → bot、bot_id → bot）
+- 版本检测：每隔 CHANNEL_CONFIG_REFRESH_INTERVAL 秒查询一次 COUNT(*) + MAX(updated_at)，
+  有变化才重新加载整表（检测在取配置时顺带进行，不需要后台任务）
+- 本进程修改配置后调用 invalidate()，下一次取配置时立即重新加载；
+  其他 worker 在一个检测周期内生效
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from app.database import db_pool as default_db_pool
+
+logger = logging.getLogger(__name__)
+
+# 版本检测间隔（秒）
+CHANNEL_CONFIG_REFRESH_INTERVAL = float(os.getenv("CHANNEL_CONFIG_REFRESH_INTERVAL", "30"))
+
+
+class ChannelConfig:
+    """单个渠道的配置（只读快照）"""
+    
+    __slots__ = ("channel_type", "is_enabled", "data", "bots_by_group", "bots_by_id")
+    
+    def __init__(self, channel_type: str, is_enabled: bool, data: Dict[str, Any]):
+        self.channel_type = channel_type
+        self.is_enabled = is_enabled
+        self.data = data
+        
+        # 群机器人索引（同一群配置了多个机器人时取第一个，与原线性查找一致）
+        self.bots_by_group: Dict[str, Dict[str, Any]] = {}
+        self.bots_by_id: Dict[str, Dict[str, Any]] = {}
+        for bot in data.get("bots") or []:
+            if bot.get("group_id") is not None:
+                self.bots_by_group.setdefault(bot["group_id"], bot)
+            if bot.get("bot_id") is not None:
+                self.bots_by_id.setdefault(bot["bot_id"], bot)
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        """按键读取原始配置（兼容原 dict 写法）"""
+        return self.data.get(key, default)
+    
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+    
+    def bot_for_group(self, group_id: str) -> Optional[Dict[str, Any]]:
+        """按群ID查找机器人"""
+        return self.bots_by_group.get(group_id)
+    
+    def bot_by_id(self, bot_id: str) -> Optional[Dict[str, Any]]:
+        """按机器人ID查找机器人"""
+        return self.bots_by_id.get(bot_id)
+
+
+def _parse_config_data(value: Any) -> Dict[str, Any]:
+    """config_data 在 PostgreSQL 为 JSONB（可能已解码），在 SQLite 为 TEXT"""
+    if isinstance(value, dict):
+        return value
+    if not value:
+        return {}
+    return json.loads(value)
+
+
+class ChannelRegistry:
+    """渠道配置注册表"""
+    
+    def __init__(self, db_pool=None, refresh_interval: float = CHANNEL_CONFIG_REFRESH_INTERVAL):
+        """
+        初始化
+        
+        Args:
+            db_pool: 数据库连接池，默认使用 app.database.db_pool
+            refresh_interval: 版本检测间隔（秒）
+        """
+        self.db = db_pool or default_db_pool
+        self.refresh_interval = refresh_interval
+        
+        self._configs: Optional[Dict[str, ChannelConfig]] = None
+        self._version: Optional[Tuple[Any, Any]] = None
+        self._checked_at = 0.0
+        self._stale = False
+        self._lock = asyncio.Lock()
+        
+        self.stats = {"loads": 0, "version_checks": 0, "load_errors": 0}
+    
+    async def _fetch_version(self, conn) -> Tuple[Any, Any]:
+        row = await conn.fetchrow(
+            "SELECT COUNT(*) AS total, MAX(updated_at) AS version FROM channel_configs"
+        )
+        return (row["total"], row["version"])
+    
+    async def _load(self, conn) -> Dict[str, ChannelConfig]:
+        configs = {}
+        for row in await conn.fetch("SELECT * FROM channel_configs"):
+            try:
+                data = _parse_config_data(row["config_data"])
+            except ValueError as e:
+                logger.error(f"[渠道配置] {row['channel_type']} 配置不是合法的JSON: {e}")
+                data = {}
+            configs[row["channel_type"]] = ChannelConfig(row["channel_type"], bool(row["is_enabled"]), data)
+        return configs
+    
+    async def _refresh(self):
+        """检测版本，有变化（或已标记失效）时重新加载整表"""
+        async with self.db.acquire() as conn:
+            version = await self._fetch_version(conn)
+            self.stats["version_checks"] += 1
+            
+            if self._configs is None or self._stale or version != self._version:
+                configs = await self._load(conn)
+                # 整体替换，读取方拿到的始终是完整快照
+                self._configs = configs
+                self._version = version
+                self._stale = False
+                self.stats["loads"] += 1
+                logger.info(f"[渠道配置] 已加载 {len(configs)} 个渠道 (version={version[1]})")
+        
+        self._checked_at = time.monotonic()
+    
+    async def _ensure_fresh(self):
+        due = time.monotonic() - self._checked_at >= self.refresh_interval
+        if self._configs is not None and not (due or self._stale):
+            return
+        # 已有快照时不排队等待别人的刷新，直接使用当前快照
+        if self._configs is not None and self._lock.locked():
+            return
+        
+        async with self._lock:
+            due = time.monotonic() - self._checked_at >= self.refresh_interval
+            if self._configs is not None and not (due or self._stale):
+                return
+            try:
+                await self._refresh()
+            except Exception as e:
+                self.stats["load_errors"] += 1
+                if self._configs is None:
+                    raise
+                # 数据库异常时继续使用旧配置，下个周期再检测
+                self._checked_at = time.monotonic()
+                logger.error(f"[渠道配置] 刷新失败，继续使用旧配置: {e}")
+    
+    async def get(self, channel_type: str) -> ChannelConfig:
+        """
+        获取启用的渠道配置
+        
+        Args:
+            channel_type: 渠道类型
+        
+        Returns:
+            ChannelConfig
+        
+        Raises:
+            ValueError: 渠道配置不存在或已禁用
+        """
+        await self._ensure_fresh()
+        
+        config = self._configs.get(channel_type)
+        if config is None:
+            raise ValueError(f"渠道配置不存在: {channel_type}")
+        if not config.is_enabled:
+            raise ValueError(f"渠道已禁用: {channel_type}")
+        return config
+    
+    def invalidate(self):
+        """配置已修改，下一次 get 时重新加载"""
+        self._stale = True
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计"""
+        return {
+            **self.stats,
+            "channels": sorted(self._configs) if self._configs else [],
+            "version": str(self._version[1]) if self._version else None
+        }
+
+
+# 全局渠道配置注册表
+channel_registry = ChannelRegistry()
@@ -1,41 +1,245 @@
-"""对话状态管理服务 - 支持多轮对话"""
+"""对话状态管理服务 - 支持多轮对话
+
+存储后端：
+- memory：进程内存储，定期清理过期状态（单 worker / 开发环境）
+- redis：Redis Hash + 原生 TTL，字段原子更新，多 worker 共享
+
+通过环境变量 CONVERSATION_STATE_BACKEND 选择（auto/memory/redis），
+auto 时 Redis 可用则使用 Redis；后端在首次读写时确定，导入本模块不会连接 Redis。
+"""
 from typing import Dict, Optional
 from datetime import datetime, timedelta
 import json
+import os
+import time
+import logging
+import threading
+
+from app.database import get_redis
+
+logger = logging.getLogger(__name__)
+
+# 存储后端：auto / memory / redis
+CONVERSATION_STATE_BACKEND = os.getenv("CONVERSATION_STATE_BACKEND", "auto")
+
+# 内存后端的过期清理间隔（秒）
+CONVERSATION_SWEEP_INTERVAL = int(os.getenv("CONVERSATION_SWEEP_INTERVAL", "60"))
+
+
+class _StateEntry:
+    """内存中的单个对话状态"""
+    
+    __slots__ = ("intent", "data", "created_at", "expires_at")
+    
+    def __init__(self, intent: str, data: dict, created_at: datetime, expires_at: datetime):
+        self.intent = intent
+        self.data = data
+        self.created_at = created_at
+        self.expires_at = expires_at
+    
+    def to_dict(self) -> dict:
+        return {
+            'intent': self.intent,
+            'data': self.data,
+            'created_at': self.created_at,
+            'expires_at': self.expires_at
+        }
+
+
+class MemoryStateStore:
+    """进程内状态存储（定期清理过期状态）"""
+    
+    def __init__(self, sweep_interval: int = CONVERSATION_SWEEP_INTERVAL):
+        self._states: Dict[str, _StateEntry] = {}
+        self._lock = threading.Lock()
+        self.sweep_interval = sweep_interval
+        self._last_sweep = time.monotonic()
+    
+    def _maybe_sweep(self):
+        """距上次清理超过间隔时清理一次（摊还到读写操作中）"""
+        if time.monotonic() - self._last_sweep >= self.sweep_interval:
+            self.sweep()
+    
+    def sweep(self) -> int:
+        """
+        清理过期状态
+        
+        Returns:
+            清理的数量
+        """
+        now = datetime.now()
+        with self._lock:
+            expired = [user_id for user_id, entry in self._states.items() if entry.expires_at <= now]
+            for user_id in expired:
+                del self._states[user_id]
+            self._last_sweep = time.monotonic()
+        
+        if expired:
+            logger.debug(f"[对话状态] 清理过期状态 {len(expired)} 个")
+        return len(expired)
+    
+    def get_state(self, user_id: str) -> Optional[dict]:
+        self._maybe_sweep()
+        entry = self._states.get(user_id)
+        if entry and entry.expires_at > datetime.now():
+            return entry.to_dict()
+        return None
+    
+    def set_state(self, user_id: str, intent: str, data: dict, ttl_minutes: int):
+        self._maybe_sweep()
+        now = datetime.now()
+        with self._lock:
+            self._states[user_id] = _StateEntry(
+                intent, dict(data), now, now + timedelta(minutes=ttl_minutes)
+            )
+    
+    def clear_state(self, user_id: str):
+        with self._lock:
+            self._states.pop(user_id, None)
+    
+    def update_state(self, user_id: str, key: str, value) -> bool:
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is None or entry.expires_at <= datetime.now():
+                return False
+            entry.data[key] = value
+            return True
+    
+    def __len__(self):
+        return len(self._states)
+
+
+class RedisStateStore:
+    """
+    Redis状态存储
+    
+    每个用户一个 Hash：intent / created_at / data:<字段名>（JSON），
+    过期交给 Redis TTL；单个字段更新是原子的，不会覆盖其他 worker 写入的字段。
+    """
+    
+    KEY_PREFIX = "conv_state:"
+    DATA_PREFIX = "data:"
+    
+    # 仅在状态仍存在时更新字段，避免为已过期的状态重建一个没有 TTL 的 Hash
+    UPDATE_IF_EXISTS_SCRIPT = """
+    if redis.call('EXISTS', KEYS[1]) == 1 then
+        redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+        return 1
+    end
+    return 0
+    """
+    
+    def __init__(self, redis_conn):
+        self.redis = redis_conn
+        self._update_if_exists = redis_conn.register_script(self.UPDATE_IF_EXISTS_SCRIPT)
+    
+    def _key(self, user_id: str) -> str:
+        return f"{self.KEY_PREFIX}{user_id}"
+    
+    def get_state(self, user_id: str) -> Optional[dict]:
+        key = self._key(user_id)
+        pipe = self.redis.pipeline(transaction=False)
+        pipe.hgetall(key)
+        pipe.pttl(key)
+        fields, ttl_ms = pipe.execute()
+        
+        if not fields or 'intent' not in fields:
+            return None
+        
+        data = {
+            name[len(self.DATA_PREFIX):]: json.loads(value)
+            for name, value in fields.items()
+            if name.startswith(self.DATA_PREFIX)
+        }
+        
+        return {
+            'intent': fields['intent'],
+            'data': data,
+            'created_at': datetime.fromisoformat(fields['created_at']),
+            'expires_at': datetime.now() + timedelta(milliseconds=max(ttl_ms, 0))
+        }
+    
+    def set_state(self, user_id: str, intent: str, data: dict, ttl_minutes: int):
+        key = self._key(user_id)
+        mapping = {
+            'intent': intent,
+            'created_at': datetime.now().isoformat()
+        }
+        for name, value in data.items():
+            mapping[f"{self.DATA_PREFIX}{name}"] = json.dumps(value, ensure_ascii=False, default=str)
+        
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(key)
+        pipe.hset(key, mapping=mapping)
+        pipe.expire(key, ttl_minutes * 60)
+        pipe.execute()
+    
+    def clear_state(self, user_id: str):
+        self.redis.delete(self._key(user_id))
+    
+    def update_state(self, user_id: str, key: str, value) -> bool:
+        result = self._update_if_exists(
+            keys=[self._key(user_id)],
+            args=[f"{self.DATA_PREFIX}{key}", json.dumps(value, ensure_ascii=False, default=str)]
+        )
+        return bool(result)
 
 
 class ConversationState:
     """对话状态存储"""
     
-    def __init__(self):
-        # 使用内存存储（生产环境应使用Redis）
-        self._states: Dict[str, dict] = {}
+    def __init__(self, backend: str = CONVERSATION_STATE_BACKEND, redis_conn=None):
+        """
+        初始化
+        
+        Args:
+            backend: auto / memory / redis
+            redis_conn: Redis客户端，默认使用 app.database.get_redis()
+        """
+        self.backend = backend
+        self._redis_conn = redis_conn
+        self._store = None
+        self._store_lock = threading.Lock()
+    
+    @property
+    def store(self):
+        """存储后端（首次访问时选定，之后不再切换，避免同一会话的状态分散在两处）"""
+        if self._store is None:
+            with self._store_lock:
+                if self._store is None:
+                    self._store = self._create_store()
+        return self._store
+    
+    def _create_store(self):
+        if self.backend == "memory":
+            store = MemoryStateStore()
+        else:
+            redis_conn = self._redis_conn if self._redis_conn is not None else get_redis()
+            if redis_conn is not None:
+                store = RedisStateStore(redis_conn)
+            elif self.backend == "redis":
+                raise RuntimeError("CONVERSATION_STATE_BACKEND=redis 但 Redis 不可用")
+            else:
+                store = MemoryStateStore()
+        
+        logger.info(f"[对话状态] 使用存储后端: {type(store).__name__}")
+        return store
     
     def get_state(self, user_id: str) -> Optional[dict]:
         """获取用户对话状态"""
-        state = self._states.get(user_id)
-        if state and state.get('expires_at') > datetime.now():
-            return state
-        return None
+        return self.store.get_state(user_id)
     
     def set_state(self, user_id: str, intent: str, data: dict, ttl_minutes: int = 30):
         """设置用户对话状态"""
-        self._states[user_id] = {
-            'intent': intent,
-            'data': data,
-            'created_at': datetime.now(),
-            'expires_at': datetime.now() + timedelta(minutes=ttl_minutes)
-        }
+        self.store.set_state(user_id, intent, data, ttl_minutes)
     
     def clear_state(self, user_id: str):
         """清除用户对话状态"""
-        if user_id in self._states:
-            del self._states[user_id]
+        self.store.clear_state(user_id)
     
     def update_state(self, user_id: str, key: str, value):
         """更新状态中的某个字段"""
-        if user_id in self._states:
-            self._states[user_id]['data'][key] = value
+        self.store.update_state(user_id, key, value)
 
 
 # 全局状态管理器
@@ -6,7 +6,7 @@
 3. 进度通知自动推送
 """
 from typing import Dict, Any, List, Optional
-from ..utils.wechat_work_api import WeChatWorkAPI
+from ..utils.wechat_work_api import WeChatWorkAPI, get_wechat_work_api
 from ..services.secure_link_service import SecureLinkService
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
@@ -71,11 +71,7 @@ class CustomerContactService:
         
         # 5. 调用企业微信API发送消息
         if not wechat_api:
-            wechat_api = WeChatWorkAPI(
-                corp_id=os.getenv("CORP_ID"),
-                corp_secret=os.getenv("CORP_SECRET"),
-                agent_id=os.getenv("AGENT_ID")
-            )
+            wechat_api = get_wechat_work_api()
         
         # 发送图文消息
         result = await CustomerContactService._send_external_message(
@@ -170,12 +166,6 @@ class CustomerContactService:
             发送结果
         """
         
-        # 获取access_token
-        access_token = await wechat_api.get_access_token()
-        
-        # 构建API请求
-        api_url = f"https://qyapi.weixin.qq.com/cgi-bin/externalcontact/message/send?access_token={access_token}"
-        
         # 组装请求体
         request_body = {
             "external_userid": [external_userid],
@@ -193,26 +183,23 @@ class CustomerContactService:
         elif message_type == 'miniprogram':
             request_body["miniprogram"] = content.get('miniprogram', {})
         
-        # 发送请求
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, json=request_body) as response:
-                result = await response.json()
+        # 发送请求（令牌失效时自动刷新并重试一次）
+        result = await wechat_api.post("externalcontact/message/send", json=request_body)
                 
-                if result.get('errcode') == 0:
-                    print(f"✅ 消息发送成功：external_userid={external_userid}")
-                    return {
-                        "success": True,
-                        "errcode": 0,
-                        "errmsg": "ok"
-                    }
-                else:
-                    print(f"❌ 消息发送失败：{result.get('errmsg')}")
-                    return {
-                        "success": False,
-                        "errcode": result.get('errcode'),
-                        "errmsg": result.get('errmsg')
-                    }
+        if result.get('errcode') == 0:
+            print(f"✅ 消息发送成功：external_userid={external_userid}")
+            return {
+                "success": True,
+                "errcode": 0,
+                "errmsg": "ok"
+            }
+        else:
+            print(f"❌ 消息发送失败：{result.get('errmsg')}")
+            return {
+                "success": False,
+                "errcode": result.get('errcode'),
+                "errmsg": result.get('errmsg')
+            }
     
     @staticmethod
     async def auto_notify_on_milestone(
@@ -253,11 +240,7 @@ class CustomerContactService:
         )
         
         # 构建里程碑通知消息
-        wechat_api = WeChatWorkAPI(
-            corp_id=os.getenv("CORP_ID"),
-            corp_secret=os.getenv("CORP_SECRET"),
-            agent_id=os.getenv("AGENT_ID")
-        )
+        wechat_api = get_wechat_work_api()
         
         milestone_emoji = {
             "需求确认": "✅",
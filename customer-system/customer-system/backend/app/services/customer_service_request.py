@@ -6,6 +6,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_
 from app.models import Customer, CustomerServiceRequest
 from app.services.wechat_service import WeChatService
+from app.services.intent_engine import intent_engine
 from typing import Dict, Optional
 from datetime import datetime
 import logging
@@ -375,22 +376,6 @@ class CustomerServiceRequestService:
     
     @staticmethod
     def _detect_request_type(message: str) -> Optional[str]:
-        """从消息中识别请求类型"""
-        message_lower = message.lower()
-        
-        if any(keyword in message_lower for keyword in ['查询', '查看', '订单', '进度', '状态']):
-            return 'query_order'
-        
-        if any(keyword in message_lower for keyword in ['更改', '修改', '变更', '调整']):
-            return 'modify_order'
-        
-        if any(keyword in message_lower for keyword in ['取消', '退单', '不要了']):
-            return 'cancel_order'
-        
-        if any(keyword in message_lower for keyword in ['售后', '维修', '故障', '问题', '坏了']):
-            return 'aftersales'
-        
-        if any(keyword in message_lower for keyword in ['咨询', '了解', '询价', '价格', '多少钱']):
-            return 'inquiry'
-        
-        return None
+        """从消息中识别请求类型（见 intent_engine 的 service_request 意图集合）"""
+        result = intent_engine.classify(message, "service_request")
+        return result.intent if result.matched else None
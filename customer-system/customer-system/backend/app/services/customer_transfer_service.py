@@ -4,11 +4,11 @@
 核心功能：调用企业微信「分配客户」API，实现权限静默切换
 """
 from typing import Dict, Any, Optional
-from ..utils.wechat_work_api import WeChatWorkAPI
+from ..utils.wechat_work_api import WeChatWorkAPI, get_wechat_work_api
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
 from ..models import Project, Customer, WeChatSession
-import os
+from .cache_invalidation import invalidation_bus
 import logging
 
 logger = logging.getLogger(__name__)
@@ -75,11 +75,7 @@ class CustomerTransferService:
         
         # 4. 调用企业微信API转接客户
         if not wechat_api:
-            wechat_api = WeChatWorkAPI(
-                corp_id=os.getenv("CORP_ID"),
-                corp_secret=os.getenv("CORP_SECRET"),
-                agent_id=os.getenv("AGENT_ID")
-            )
+            wechat_api = get_wechat_work_api()
         
         transfer_result = await CustomerTransferService._call_transfer_customer_api(
             wechat_api=wechat_api,
@@ -93,6 +89,7 @@ class CustomerTransferService:
         project.assigned_to = engineer_userid
         project.assigned_to_name = engineer_name
         await db.commit()
+        invalidation_bus.publish_project_changed(project_id, "transfer_to_engineer")
         
         logger.info(
             f"✅ 客户关系转接成功：客户={customer.name}, "
@@ -161,11 +158,7 @@ class CustomerTransferService:
         
         # 5. 调用企业微信API转回客户
         if not wechat_api:
-            wechat_api = WeChatWorkAPI(
-                corp_id=os.getenv("CORP_ID"),
-                corp_secret=os.getenv("CORP_SECRET"),
-                agent_id=os.getenv("AGENT_ID")
-            )
+            wechat_api = get_wechat_work_api()
         
         transfer_result = await CustomerTransferService._call_transfer_customer_api(
             wechat_api=wechat_api,
@@ -180,6 +173,7 @@ class CustomerTransferService:
         project.assigned_to_name = customer.sales_representative  # 恢复销售姓名
         project.original_sales_userid = None  # 清空转接记录
         await db.commit()
+        invalidation_bus.publish_project_changed(project_id, "transfer_back_to_sales")
         
         logger.info(
             f"✅ 客户关系转回成功：客户={customer.name}, "
@@ -221,12 +215,6 @@ class CustomerTransferService:
             API调用结果
         """
         
-        # 获取access_token
-        access_token = await wechat_api.get_access_token()
-        
-        # 构建API请求URL
-        api_url = f"https://qyapi.weixin.qq.com/cgi-bin/externalcontact/transfer_customer?access_token={access_token}"
-        
         # 构建请求体
         request_body = {
             "handover_userid": handover_userid,
@@ -238,33 +226,30 @@ class CustomerTransferService:
         if transfer_success_msg:
             request_body["transfer_success_msg"] = transfer_success_msg
         
-        # 发送请求
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            async with session.post(api_url, json=request_body) as response:
-                result = await response.json()
+        # 发送请求（令牌失效时自动刷新并重试一次）
+        result = await wechat_api.post("externalcontact/transfer_customer", json=request_body)
                 
-                if result.get('errcode') == 0:
-                    logger.info(
-                        f"✅ 企业微信API调用成功：客户={external_userid}, "
-                        f"{handover_userid} → {takeover_userid}"
-                    )
-                    return {
-                        "success": True,
-                        "errcode": 0,
-                        "errmsg": "ok",
-                        "customer": result.get('customer', [])
-                    }
-                else:
-                    logger.error(
-                        f"❌ 企业微信API调用失败：{result.get('errmsg')}, "
-                        f"errcode={result.get('errcode')}"
-                    )
-                    return {
-                        "success": False,
-                        "errcode": result.get('errcode'),
-                        "errmsg": result.get('errmsg')
-                    }
+        if result.get('errcode') == 0:
+            logger.info(
+                f"✅ 企业微信API调用成功：客户={external_userid}, "
+                f"{handover_userid} → {takeover_userid}"
+            )
+            return {
+                "success": True,
+                "errcode": 0,
+                "errmsg": "ok",
+                "customer": result.get('customer', [])
+            }
+        else:
+            logger.error(
+                f"❌ 企业微信API调用失败：{result.get('errmsg')}, "
+                f"errcode={result.get('errcode')}"
+            )
+            return {
+                "success": False,
+                "errcode": result.get('errcode'),
+                "errmsg": result.get('errmsg')
+            }
     
     @staticmethod
     async def batch_transfer_customers(
@@ -337,40 +322,31 @@ class CustomerTransferService:
         """
         
         if not wechat_api:
-            wechat_api = WeChatWorkAPI(
-                corp_id=os.getenv("CORP_ID"),
-                corp_secret=os.getenv("CORP_SECRET"),
-                agent_id=os.getenv("AGENT_ID")
-            )
-        
-        # 获取access_token
-        access_token = await wechat_api.get_access_token()
+            wechat_api = get_wechat_work_api()
         
         # 调用获取客户详情API
-        api_url = f"https://qyapi.weixin.qq.com/cgi-bin/externalcontact/get?access_token={access_token}&external_userid={customer_external_userid}"
-        
-        import aiohttp
-        async with aiohttp.ClientSession() as session:
-            async with session.get(api_url) as response:
-                result = await response.json()
+        result = await wechat_api.get(
+            "externalcontact/get",
+            params={"external_userid": customer_external_userid}
+        )
                 
-                if result.get('errcode') == 0:
-                    external_contact = result.get('external_contact', {})
-                    follow_users = result.get('follow_user', [])
+        if result.get('errcode') == 0:
+            external_contact = result.get('external_contact', {})
+            follow_users = result.get('follow_user', [])
                     
-                    # 获取第一个跟进人（通常是当前负责人）
-                    current_owner = follow_users[0] if follow_users else None
+            # 获取第一个跟进人（通常是当前负责人）
+            current_owner = follow_users[0] if follow_users else None
                     
-                    return {
-                        "success": True,
-                        "customer_name": external_contact.get('name'),
-                        "current_owner_userid": current_owner.get('userid') if current_owner else None,
-                        "current_owner_remark": current_owner.get('remark') if current_owner else None,
-                        "follow_users": follow_users
-                    }
-                else:
-                    return {
-                        "success": False,
-                        "errcode": result.get('errcode'),
-                        "errmsg": result.get('errmsg')
-                    }
+            return {
+                "success": True,
+                "customer_name": external_contact.get('name'),
+                "current_owner_userid": current_owner.get('userid') if current_owner else None,
+                "current_owner_remark": current_owner.get('remark') if current_owner else None,
+                "follow_users": follow_users
+            }
+        else:
+            return {
+                "success": False,
+                "errcode": result.get('errcode'),
+                "errmsg": result.get('errmsg')
+            }
@@ -4,7 +4,8 @@
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, and_
-from app.models import Equipment, Order, MaintenanceRecord, OperationLog
+from app.models import Equipment, Order, MaintenanceRecord
+from app.services.log_sink import operation_log_sink
 from typing import List, Optional, Dict
 from datetime import datetime, date, timedelta
 from decimal import Decimal
@@ -93,7 +94,7 @@ class EquipmentService:
         
         # 记录操作日志
         await EquipmentService._log_operation(
-            db, 'create', equipment.id, operator_userid, operator_name,
+            'create', equipment.id, operator_userid, operator_name,
             {'action': '创建设备档案', 'equipment_no': equipment_no, 'order_id': order_id}
         )
         
@@ -171,7 +172,7 @@ class EquipmentService:
         
         # 记录操作日志
         await EquipmentService._log_operation(
-            db, 'maintenance', equipment_id, engineer_userid, engineer_name,
+            'maintenance', equipment_id, engineer_userid, engineer_name,
             {'action': '添加维护记录', 'type': maintenance_type, 'record_id': record.id}
         )
         
@@ -328,7 +329,6 @@ class EquipmentService:
     
     @staticmethod
     async def _log_operation(
-        db: AsyncSession,
         operation_type: str,
         equipment_id: int,
         operator_userid: str,
@@ -336,16 +336,13 @@ class EquipmentService:
         detail: Dict,
         source: str = 'web_ui'
     ):
-        """记录操作日志"""
-        log = OperationLog(
+        """记录操作日志（缓冲写入，不额外提交事务）"""
+        await operation_log_sink.put(
             operation_type=operation_type,
             entity_type='equipment',
             entity_id=equipment_id,
             operator_userid=operator_userid,
             operator_name=operator_name,
             operation_source=source,
-            operation_detail=detail,
-            created_at=datetime.now()
+            operation_detail=detail
         )
-        db.add(log)
-        await db.commit()
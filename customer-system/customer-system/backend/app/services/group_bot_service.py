@@ -1,5 +1,5 @@
 from fastapi import HTTPException
-import httpx
+from app.services.http_client_service import get_http_client
 
 class GroupBotService:
     """内部群机器人服务"""
@@ -23,10 +23,10 @@ class GroupBotService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(group_webhook_url, json=payload)
-                response.raise_for_status()
-                return {"status": "success", "message": "消息已发送"}
+            client = get_http_client("group_bot")
+            response = await client.post(group_webhook_url, json=payload)
+            response.raise_for_status()
+            return {"status": "success", "message": "消息已发送"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"发送群消息失败: {str(e)}")
     
@@ -51,9 +51,9 @@ class GroupBotService:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(group_webhook_url, json=payload)
-                response.raise_for_status()
-                return {"status": "success", "message": "卡片消息已发送"}
+            client = get_http_client("group_bot")
+            response = await client.post(group_webhook_url, json=payload)
+            response.raise_for_status()
+            return {"status": "success", "message": "卡片消息已发送"}
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"发送卡片消息失败: {str(e)}")
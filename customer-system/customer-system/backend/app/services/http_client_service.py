@@ -0,0 +1,164 @@
+"""
+共享HTTP客户端服务
+为各渠道发送器和企业微信API提供长连接复用的HTTP连接池
+
+功能：
+- 按渠道（客户端名称）复用 httpx.AsyncClient，避免每条消息重新建立TCP/TLS连接
+- 上游支持时启用HTTP/2（需要安装 h2）
+- 可配置的连接数、保活连接数和保活时长
+- 应用关闭时统一释放连接
+"""
+import os
+import asyncio
+import logging
+from typing import Dict, Any, Optional
+
+import httpx
+
+from app.services.tracing import TracingTransport
+
+logger = logging.getLogger(__name__)
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+# 默认连接池参数（可通过环境变量调整）
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("HTTP_POOL_MAX_CONNECTIONS", "100"))
+DEFAULT_MAX_KEEPALIVE = int(os.getenv("HTTP_POOL_MAX_KEEPALIVE", "20"))
+DEFAULT_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_POOL_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "true").lower() == "true"
+
+
+# 各客户端的连接池配置
+# max_connections 即单个客户端（对应一个上游主机）的连接上限
+CLIENT_PROFILES: Dict[str, Dict[str, Any]] = {
+    # 企业微信开放接口 qyapi.weixin.qq.com（支持HTTP/2）
+    "wework": {
+        "http2": True,
+        "max_connections": int(os.getenv("HTTP_POOL_WEWORK_MAX_CONNECTIONS", "50")),
+        "timeout": 10.0
+    },
+    # 群机器人 Webhook（与企业微信同域，但限流独立，单独建池）
+    "group_bot": {
+        "http2": True,
+        "max_connections": int(os.getenv("HTTP_POOL_GROUP_BOT_MAX_CONNECTIONS", "20")),
+        "timeout": 10.0
+    },
+    # 短信网关
+    "sms": {
+        "http2": False,
+        "max_connections": int(os.getenv("HTTP_POOL_SMS_MAX_CONNECTIONS", "50")),
+        "timeout": 10.0
+    },
+    # 微信公众号接口 api.weixin.qq.com
+    "wechat": {
+        "http2": True,
+        "max_connections": int(os.getenv("HTTP_POOL_WECHAT_MAX_CONNECTIONS", "50")),
+        "timeout": 10.0
+    },
+    # 其他外部接口
+    "default": {
+        "http2": False,
+        "max_connections": DEFAULT_MAX_CONNECTIONS,
+        "timeout": 30.0
+    }
+}
+
+
+class HTTPClientRegistry:
+    """HTTP客户端注册表（按名称复用连接池）"""
+    
+    def __init__(self, profiles: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        初始化
+        
+        Args:
+            profiles: 客户端配置，默认使用 CLIENT_PROFILES
+        """
+        self.profiles = profiles or CLIENT_PROFILES
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+    
+    def _build_client(self, name: str) -> httpx.AsyncClient:
+        """按配置创建客户端"""
+        profile = self.profiles.get(name) or self.profiles["default"]
+        
+        max_connections = profile.get("max_connections", DEFAULT_MAX_CONNECTIONS)
+        limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=min(
+                profile.get("max_keepalive", DEFAULT_MAX_KEEPALIVE),
+                max_connections
+            ),
+            keepalive_expiry=profile.get("keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY)
+        )
+        
+        http2 = profile.get("http2", False) and HTTP2_ENABLED and HTTP2_AVAILABLE
+        
+        logger.info(
+            f"[HTTP] 创建连接池: {name} "
+            f"(max_connections={max_connections}, http2={http2})"
+        )
+        
+        # 传输层包装：启用链路追踪时每次上游调用一个 span
+        transport = TracingTransport(httpx.AsyncHTTPTransport(http2=http2, limits=limits))
+        
+        return httpx.AsyncClient(
+            transport=transport,
+            timeout=httpx.Timeout(profile.get("timeout", 30.0))
+        )
+    
+    def get_client(self, name: str = "default") -> httpx.AsyncClient:
+        """
+        获取共享客户端（不存在时创建）
+        
+        Args:
+            name: 客户端名称，对应 CLIENT_PROFILES 的键
+        
+        Returns:
+            httpx.AsyncClient（调用方不要关闭）
+        """
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            client = self._build_client(name)
+            self._clients[name] = client
+        return client
+    
+    async def close_all(self):
+        """关闭所有客户端（应用关闭时调用）"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        
+        results = await asyncio.gather(
+            *(client.aclose() for client in clients),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, Exception):
+                logger.error(f"[HTTP] 关闭连接池失败: {result}")
+        
+        logger.info(f"[HTTP] 已关闭 {len(clients)} 个连接池")
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """获取各连接池配置与状态"""
+        stats = {}
+        for name, client in self._clients.items():
+            profile = self.profiles.get(name) or self.profiles["default"]
+            stats[name] = {
+                "max_connections": profile.get("max_connections", DEFAULT_MAX_CONNECTIONS),
+                "http2": profile.get("http2", False) and HTTP2_ENABLED and HTTP2_AVAILABLE,
+                "closed": client.is_closed
+            }
+        return stats
+
+
+# 全局HTTP客户端注册表
+http_client_registry = HTTPClientRegistry()
+
+
+def get_http_client(name: str = "default") -> httpx.AsyncClient:
+    """获取共享HTTP客户端"""
+    return http_client_registry.get_client(name)
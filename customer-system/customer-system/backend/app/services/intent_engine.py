@@ -0,0 +1,349 @@
+"""
+意图识别引擎
+所有入口（AI路由、自动工单、客户服务请求、工单回复监听）共用的关键词意图识别
+
+- 所有意图集合的关键词编译进同一个 Aho-Corasick 自动机，只构建一次
+- 对消息做一次线性扫描，得到全部命中（含位置），按意图累加权重打分
+- 同分时按意图在规则中的先后顺序决定（与原先 if/elif 的优先级一致）
+- 关键词可在数据字典（data_dictionary）中维护，热加载时重新编译并整体替换自动机
+
+数据字典约定：
+    dict_type = 'intent_keyword'
+    dict_code = '<意图集合>.<意图>'，如 customer.presale
+    dict_value = 关键词；dict_order > 0 时作为权重
+    某个意图在数据字典中有关键词时，替换该意图的默认关键词
+"""
+import os
+import asyncio
+import logging
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 热加载间隔（秒），0 表示只在启动时加载
+INTENT_RELOAD_INTERVAL = int(os.getenv("INTENT_RELOAD_INTERVAL", "300"))
+
+INTENT_DICT_TYPE = "intent_keyword"
+
+UNKNOWN_INTENT = "unknown"
+UNKNOWN_CONFIDENCE = 0.5
+
+# 默认规则：意图集合 -> [(意图, 置信度, 关键词列表)]，按优先级排列
+DEFAULT_INTENT_RULES: Dict[str, List[Tuple[str, float, List[str]]]] = {
+    # AI路由 / AIService.parse_intent
+    "customer": [
+        ("presale", 0.9, ['售前', '咨询', '购买', '价格', '报价', '产品', '空调', '冰箱']),
+        ("aftersale", 0.9, ['售后', '维修', '故障', '问题', '坏了', '不工作']),
+        ("query", 0.85, ['查询', '进度', '状态', '怎么样', '到哪了']),
+    ],
+    # 客户消息自动工单（TicketService.process_customer_message）
+    "ticket": [
+        ("aftersale", 0.9, ['售后', '维修', '坏了', '不工作', '问题']),
+        ("presale", 0.9, ['售前', '咨询', '购买', '价格', '报价']),
+        ("query", 0.85, ['进度', '状态', '怎么样了', '到哪了']),
+    ],
+    # 客户服务请求类型（CustomerServiceRequestService）
+    "service_request": [
+        ("query_order", 0.85, ['查询', '查看', '订单', '进度', '状态']),
+        ("modify_order", 0.85, ['更改', '修改', '变更', '调整']),
+        ("cancel_order", 0.85, ['取消', '退单', '不要了']),
+        ("aftersales", 0.85, ['售后', '维修', '故障', '问题', '坏了']),
+        ("inquiry", 0.85, ['咨询', '了解', '询价', '价格', '多少钱']),
+    ],
+    # 内部群工单回复（"#123 已解决"）
+    "ticket_reply": [
+        ("resolved", 0.9, ['已解决', '已修复']),
+        ("processed", 0.9, ['已处理']),
+        ("escalated", 0.9, ['升级']),
+    ],
+}
+
+
+class KeywordHit:
+    """一次关键词命中"""
+    
+    __slots__ = ("start", "end", "keyword", "domain", "intent", "weight")
+    
+    def __init__(self, start: int, end: int, keyword: str, domain: str, intent: str, weight: float):
+        self.start = start
+        self.end = end
+        self.keyword = keyword
+        self.domain = domain
+        self.intent = intent
+        self.weight = weight
+    
+    def to_dict(self) -> dict:
+        return {"start": self.start, "end": self.end, "keyword": self.keyword, "intent": self.intent}
+
+
+class IntentResult:
+    """意图识别结果"""
+    
+    __slots__ = ("intent", "confidence", "score", "scores", "spans")
+    
+    def __init__(self, intent: str, confidence: float, score: float, scores: Dict[str, float], spans: List[KeywordHit]):
+        self.intent = intent
+        self.confidence = confidence
+        self.score = score
+        self.scores = scores
+        self.spans = spans
+    
+    @property
+    def matched(self) -> bool:
+        return self.intent != UNKNOWN_INTENT
+    
+    def to_dict(self) -> dict:
+        return {
+            "intent": self.intent,
+            "confidence": self.confidence,
+            "score": self.score,
+            "scores": self.scores,
+            "spans": [hit.to_dict() for hit in self.spans]
+        }
+
+
+class AhoCorasick:
+    """Aho-Corasick 多模式匹配自动机（构建后只读，可被多个协程/线程共享）"""
+    
+    def __init__(self, patterns: Iterable[Tuple[str, object]]):
+        """
+        构建自动机
+        
+        Args:
+            patterns: (关键词, 负载) 列表，关键词需已规范化（小写）
+        """
+        # 每个状态：字符 -> 下一状态
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # 每个状态命中的 (关键词长度, 关键词, 负载)
+        self._output: List[List[Tuple[int, str, object]]] = [[]]
+        
+        for keyword, payload in patterns:
+            if keyword:
+                self._add(keyword, payload)
+        self._build_failure_links()
+    
+    def _add(self, keyword: str, payload):
+        state = 0
+        for char in keyword:
+            next_state = self._goto[state].get(char)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto[state][char] = next_state
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            state = next_state
+        self._output[state].append((len(keyword), keyword, payload))
+    
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(char, 0)
+                # 合并后缀状态的输出，扫描时不必沿失败链回溯
+                self._output[next_state].extend(self._output[self._fail[next_state]])
+    
+    def iter_matches(self, text: str):
+        """
+        扫描文本
+        
+        Yields:
+            (起始位置, 结束位置, 关键词, 负载)
+        """
+        goto = self._goto
+        fail = self._fail
+        output = self._output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for length, keyword, payload in output[state]:
+                yield index + 1 - length, index + 1, keyword, payload
+    
+    @property
+    def size(self) -> int:
+        """状态数"""
+        return len(self._goto)
+
+
+class IntentEngine:
+    """意图识别引擎"""
+    
+    def __init__(self, rules: Optional[Dict[str, List[Tuple[str, float, List]]]] = None):
+        """
+        初始化
+        
+        Args:
+            rules: 意图集合 -> [(意图, 置信度, 关键词或(关键词, 权重)列表)]，默认 DEFAULT_INTENT_RULES
+        """
+        self._reload_task: Optional[asyncio.Task] = None
+        self.load(rules or DEFAULT_INTENT_RULES)
+    
+    def load(self, rules: Dict[str, List[Tuple[str, float, List]]]):
+        """
+        编译规则并替换当前自动机（替换是单次赋值，识别中的请求不受影响）
+        
+        Args:
+            rules: 意图集合 -> [(意图, 置信度, 关键词或(关键词, 权重)列表)]
+        """
+        patterns = []
+        # 意图集合 -> {意图: (优先级, 置信度)}
+        intents: Dict[str, Dict[str, Tuple[int, float]]] = {}
+        
+        for domain, domain_rules in rules.items():
+            intents[domain] = {}
+            for priority, (intent, confidence, keywords) in enumerate(domain_rules):
+                intents[domain][intent] = (priority, confidence)
+                for keyword in keywords:
+                    keyword, weight = keyword if isinstance(keyword, tuple) else (keyword, 1.0)
+                    patterns.append((keyword.lower(), (domain, intent, weight)))
+        
+        automaton = AhoCorasick(patterns)
+        # 一次性替换，读取方要么看到旧规则要么看到新规则
+        self._state = (automaton, intents)
+        self.rules = rules
+        
+        logger.info(f"[意图引擎] 已编译 {len(patterns)} 个关键词，{automaton.size} 个状态")
+    
+    def match(self, text: str) -> List[KeywordHit]:
+        """
+        一次扫描找出所有意图集合的关键词命中
+        
+        Args:
+            text: 消息文本
+        
+        Returns:
+            命中列表（按结束位置排序，允许重叠）
+        """
+        automaton, _ = self._state
+        return [
+            KeywordHit(start, end, keyword, domain, intent, weight)
+            for start, end, keyword, (domain, intent, weight) in automaton.iter_matches(text.lower())
+        ]
+    
+    def classify(self, text: str, domain: str = "customer") -> IntentResult:
+        """
+        识别意图
+        
+        Args:
+            text: 消息文本
+            domain: 意图集合，如 customer / ticket / service_request / ticket_reply
+        
+        Returns:
+            IntentResult；未命中时 intent 为 unknown
+        """
+        automaton, intents = self._state
+        domain_intents = intents.get(domain, {})
+        
+        scores: Dict[str, float] = {}
+        spans: List[KeywordHit] = []
+        for start, end, keyword, (hit_domain, intent, weight) in automaton.iter_matches(text.lower()):
+            if hit_domain != domain:
+                continue
+            scores[intent] = scores.get(intent, 0.0) + weight
+            spans.append(KeywordHit(start, end, keyword, hit_domain, intent, weight))
+        
+        if not scores:
+            return IntentResult(UNKNOWN_INTENT, UNKNOWN_CONFIDENCE, 0.0, scores, spans)
+        
+        # 得分最高者胜出，同分按规则顺序
+        best = min(scores, key=lambda intent: (-scores[intent], domain_intents[intent][0]))
+        return IntentResult(best, domain_intents[best][1], scores[best], scores, spans)
+    
+    # ==================== 热加载 ====================
+    
+    async def reload_from_db(self, session_maker=None) -> bool:
+        """
+        从数据字典加载关键词并重新编译
+        
+        Args:
+            session_maker: 异步会话工厂，默认 app.database.async_session_maker
+        
+        Returns:
+            是否加载成功
+        """
+        from sqlalchemy import select
+        from app.models import DataDictionary
+        
+        if session_maker is None:
+            from app.database import async_session_maker as session_maker
+        
+        try:
+            async with session_maker() as db:
+                result = await db.execute(
+                    select(DataDictionary.dict_code, DataDictionary.dict_value, DataDictionary.dict_order)
+                    .where(DataDictionary.dict_type == INTENT_DICT_TYPE)
+                    .where(DataDictionary.is_active == True)
+                )
+                rows = result.all()
+        except Exception as e:
+            logger.warning(f"[意图引擎] 读取数据字典失败，继续使用当前规则: {e}")
+            return False
+        
+        self.load(merge_rules(DEFAULT_INTENT_RULES, rows))
+        return True
+    
+    async def _reload_loop(self, interval: int):
+        while True:
+            await asyncio.sleep(interval)
+            await self.reload_from_db()
+    
+    async def start(self, interval: int = INTENT_RELOAD_INTERVAL):
+        """启动时加载一次，并按间隔定期热加载（应用启动时调用）"""
+        await self.reload_from_db()
+        if interval > 0 and self._reload_task is None:
+            self._reload_task = asyncio.create_task(self._reload_loop(interval))
+    
+    async def stop(self):
+        """停止定期热加载（应用关闭时调用）"""
+        if self._reload_task is not None:
+            self._reload_task.cancel()
+            await asyncio.gather(self._reload_task, return_exceptions=True)
+            self._reload_task = None
+
+
+def merge_rules(
+    defaults: Dict[str, List[Tuple[str, float, List]]],
+    rows: Iterable[Tuple[str, str, Optional[int]]]
+) -> Dict[str, List[Tuple[str, float, List]]]:
+    """
+    合并数据字典中的关键词
+    
+    Args:
+        defaults: 默认规则
+        rows: (dict_code, dict_value, dict_order) 列表
+    
+    Returns:
+        合并后的规则
+    """
+    overrides: Dict[Tuple[str, str], List[Tuple[str, float]]] = {}
+    for code, value, order in rows:
+        if not code or '.' not in code or not value:
+            continue
+        domain, intent = code.split('.', 1)
+        overrides.setdefault((domain, intent), []).append((value, float(order) if order and order > 0 else 1.0))
+    
+    merged: Dict[str, List[Tuple[str, float, List]]] = {}
+    for domain, domain_rules in defaults.items():
+        merged[domain] = [
+            (intent, confidence, overrides.pop((domain, intent), keywords))
+            for intent, confidence, keywords in domain_rules
+        ]
+    
+    # 数据字典中新增的意图排在最后
+    for (domain, intent), keywords in overrides.items():
+        merged.setdefault(domain, []).append((intent, 0.85, keywords))
+    
+    return merged
+
+
+# 全局意图引擎
+intent_engine = IntentEngine()
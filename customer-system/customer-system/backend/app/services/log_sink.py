@@ -0,0 +1,480 @@
+"""
+审计日志缓冲写入服务
+请求处理只把日志行放进内存环形缓冲区，由后台任务攒批后用多行 INSERT 写入
+
+功能：
+- 每 flush_interval 毫秒或攒满 batch_size 条写入一次（一个事务一条多行 INSERT）
+- 缓冲区满时先等待（反压，最多 put_timeout 毫秒），仍然满则按溢出策略处理：
+  drop 丢弃新日志；spill 追加到本地 JSONL 文件，数据库恢复后自动回放
+  （每个进程只回放自己的文件和已退出进程遗留的文件，不碰其他存活进程正在追加的文件）
+- 写入失败的批次放回缓冲区头部重试（指数退避），超出容量的部分同样按溢出策略处理
+- 统计缓冲深度、写入延迟（入队到落库）、丢弃/落盘条数
+
+注意：只适合追加型日志；写入后还要更新的记录（如 WeWorkCustomerEvent.processed）仍走同步写入
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import deque
+from datetime import date, datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import DateTime, insert
+
+from app.database import async_session_maker
+from app.models import OperationLog
+
+logger = logging.getLogger(__name__)
+
+# 缓冲写入配置（可通过环境变量调整）
+LOG_SINK_BATCH_SIZE = int(os.getenv("LOG_SINK_BATCH_SIZE", "500"))
+LOG_SINK_FLUSH_INTERVAL_MS = int(os.getenv("LOG_SINK_FLUSH_INTERVAL_MS", "500"))
+LOG_SINK_CAPACITY = int(os.getenv("LOG_SINK_CAPACITY", "20000"))
+LOG_SINK_PUT_TIMEOUT_MS = int(os.getenv("LOG_SINK_PUT_TIMEOUT_MS", "50"))
+LOG_SINK_OVERFLOW = os.getenv("LOG_SINK_OVERFLOW", "drop")
+LOG_SINK_SPILL_DIR = os.getenv("LOG_SINK_SPILL_DIR", "./log_spill")
+LOG_SINK_MAX_BACKOFF = float(os.getenv("LOG_SINK_MAX_BACKOFF", "30"))
+
+# 溢出策略
+OVERFLOW_DROP = "drop"
+OVERFLOW_SPILL = "spill"
+
+# 刷写后回调：在同一事务内执行（如累加统计字段）
+FlushHook = Callable[[Any, List[Dict[str, Any]]], Awaitable[None]]
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def _pid_alive(pid: int) -> bool:
+    """同一主机上的进程是否仍在运行"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # 进程存在，只是属于其他用户
+        return True
+    except OSError:
+        return False
+    return True
+
+
+class BufferedLogSink:
+    """单张日志表的缓冲写入器"""
+    
+    def __init__(
+        self,
+        name: str,
+        model,
+        session_maker=async_session_maker,
+        batch_size: int = LOG_SINK_BATCH_SIZE,
+        flush_interval_ms: int = LOG_SINK_FLUSH_INTERVAL_MS,
+        capacity: int = LOG_SINK_CAPACITY,
+        put_timeout_ms: int = LOG_SINK_PUT_TIMEOUT_MS,
+        overflow: str = LOG_SINK_OVERFLOW,
+        spill_dir: str = LOG_SINK_SPILL_DIR,
+        on_flush: Optional[FlushHook] = None
+    ):
+        """
+        初始化
+        
+        Args:
+            name: 名称（统计与落盘文件名）
+            model: ORM 模型类
+            session_maker: 数据库会话工厂
+            batch_size: 每批最多写入的行数
+            flush_interval_ms: 最长攒批时间（毫秒）
+            capacity: 缓冲区容量（行）
+            put_timeout_ms: 缓冲区满时 put 最多等待的时间（毫秒）
+            overflow: 溢出策略 drop / spill
+            spill_dir: 落盘目录
+            on_flush: 刷写后回调，与 INSERT 在同一事务内
+        """
+        self.name = name
+        self.model = model
+        self.session_maker = session_maker
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.capacity = capacity
+        self.put_timeout = put_timeout_ms / 1000
+        self.overflow = overflow if overflow in (OVERFLOW_DROP, OVERFLOW_SPILL) else OVERFLOW_DROP
+        # 每个进程写自己的落盘文件 {name}.{pid}.jsonl；回放时改名为 {name}.{pid}.{回放进程pid}.replay
+        self.spill_dir = Path(spill_dir)
+        self.spill_path = self.spill_dir / f"{name}.{os.getpid()}.jsonl"
+        self.on_flush = on_flush
+        
+        # 时间列（落盘回放时从字符串还原）；created_at 入队时补齐，保证是事件发生时间而不是落库时间
+        self._timestamp_columns = [
+            column.name for column in model.__table__.columns
+            if isinstance(column.type, DateTime)
+        ]
+        self._stamp_created_at = "created_at" in self._timestamp_columns
+        
+        # (入队时间, 行)
+        self._buffer: Deque[Tuple[float, Dict[str, Any]]] = deque()
+        self._wakeup = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._task: Optional[asyncio.Task] = None
+        self._flushing: Optional[asyncio.Future] = None
+        self._spill_file = None
+        self._spill_pending = False
+        self._failures = 0
+        
+        self.stats = {
+            "enqueued": 0,
+            "flushed": 0,
+            "batches": 0,
+            "dropped": 0,
+            "spilled": 0,
+            "replayed": 0,
+            "flush_errors": 0,
+            "backpressure_waits": 0,
+            "last_flush_lag_ms": 0,
+            "max_flush_lag_ms": 0,
+            "last_flush_ms": 0
+        }
+    
+    # ==================== 入队 ====================
+    
+    def _prepare(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        if self._stamp_created_at and row.get("created_at") is None:
+            row["created_at"] = datetime.now()
+        return row
+    
+    def emit(self, **row: Any) -> bool:
+        """
+        记录一条日志（不等待）
+        
+        Returns:
+            是否进入缓冲区（溢出时按策略丢弃或落盘，返回 False）
+        """
+        row = self._prepare(row)
+        if len(self._buffer) >= self.capacity:
+            self._not_full.clear()
+            self._overflow([row])
+            return False
+        
+        self._append(row)
+        return True
+    
+    async def put(self, **row: Any) -> bool:
+        """
+        记录一条日志，缓冲区满时最多等待 put_timeout（反压）
+        
+        Returns:
+            是否进入缓冲区
+        """
+        row = self._prepare(row)
+        if len(self._buffer) >= self.capacity and self.put_timeout > 0:
+            self.stats["backpressure_waits"] += 1
+            self._not_full.clear()
+            self._wakeup.set()
+            try:
+                await asyncio.wait_for(self._not_full.wait(), self.put_timeout)
+            except asyncio.TimeoutError:
+                pass
+        
+        if len(self._buffer) >= self.capacity:
+            self._overflow([row])
+            return False
+        
+        self._append(row)
+        return True
+    
+    def _append(self, row: Dict[str, Any]):
+        self._buffer.append((time.monotonic(), row))
+        self.stats["enqueued"] += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+    
+    # ==================== 溢出处理 ====================
+    
+    def _overflow(self, rows: List[Dict[str, Any]]):
+        """按溢出策略处理放不进缓冲区的行"""
+        if self.overflow == OVERFLOW_SPILL and self._spill(rows):
+            return
+        self.stats["dropped"] += len(rows)
+        logger.warning(f"[日志缓冲] {self.name} 缓冲区已满，丢弃 {len(rows)} 条")
+    
+    def _spill(self, rows: List[Dict[str, Any]]) -> bool:
+        """追加到落盘文件，失败返回 False"""
+        try:
+            if self._spill_file is None:
+                self.spill_dir.mkdir(parents=True, exist_ok=True)
+                self._spill_file = open(self.spill_path, "a", encoding="utf-8")
+            for row in rows:
+                self._spill_file.write(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n")
+            self._spill_file.flush()
+            self._spill_pending = True
+            self.stats["spilled"] += len(rows)
+            return True
+        except OSError as e:
+            logger.error(f"[日志缓冲] {self.name} 落盘失败: {e}")
+            return False
+    
+    def _close_spill(self):
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+    
+    def _load_row(self, line: str) -> Dict[str, Any]:
+        row = json.loads(line)
+        for column in self._timestamp_columns:
+            if isinstance(row.get(column), str):
+                row[column] = datetime.fromisoformat(row[column])
+        return row
+    
+    def _spill_files(self) -> List[Path]:
+        """
+        本进程负责回放的文件
+        
+        包括自己的落盘文件，以及写入进程 / 回放进程已退出的落盘文件和回放中文件
+        （回放中途崩溃留下的 .replay 文件由下一个启动的进程接手）
+        """
+        if not self.spill_dir.exists():
+            return []
+        
+        files = []
+        for path in sorted(self.spill_dir.glob(f"{self.name}.*")):
+            parts = path.name[len(self.name) + 1:].split(".")
+            if path.suffix == ".jsonl" and len(parts) == 2:
+                owner = parts[0]
+            elif path.suffix == ".replay" and len(parts) == 3:
+                owner = parts[1]
+            else:
+                continue
+            
+            if not owner.isdigit():
+                continue
+            if int(owner) == os.getpid() or not _pid_alive(int(owner)):
+                files.append(path)
+        return files
+    
+    def _rewrite_replay(self, replay_path: Path, rows: List[Dict[str, Any]]):
+        """回放文件只保留未写入的行（避免下次回放重复写入已入库的行），失败时原样保留"""
+        tmp_path = replay_path.with_name(replay_path.name + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False, default=_json_default) + "\n")
+            tmp_path.replace(replay_path)
+        except OSError as e:
+            logger.error(f"[日志缓冲] {self.name} 回放文件改写失败，原样保留 {replay_path.name}: {e}")
+    
+    async def _replay_spill(self):
+        """数据库恢复后回放落盘文件（按批写入，失败的部分重新落盘，落盘失败则保留回放文件）"""
+        if not self._spill_pending or len(self._buffer) >= self.batch_size:
+            return
+        
+        self._close_spill()
+        self._spill_pending = False
+        replayed = 0
+        
+        for path in self._spill_files():
+            writer_pid = path.name[len(self.name) + 1:].split(".")[0]
+            replay_path = self.spill_dir / f"{self.name}.{writer_pid}.{os.getpid()}.replay"
+            try:
+                # 多个进程同时接手遗留文件时只有一个能改名成功
+                path.replace(replay_path)
+            except FileNotFoundError:
+                continue
+            
+            with open(replay_path, encoding="utf-8") as f:
+                rows = [self._load_row(line) for line in f if line.strip()]
+            
+            keep_file = False
+            for offset in range(0, len(rows), self.batch_size):
+                batch = rows[offset:offset + self.batch_size]
+                try:
+                    await self._write(batch)
+                    replayed += len(batch)
+                except Exception as e:
+                    remaining = rows[offset:]
+                    logger.error(f"[日志缓冲] {self.name} 回放失败，剩余 {len(remaining)} 条重新落盘: {e}")
+                    if self._spill(remaining):
+                        # 这些行之前已计入 spilled
+                        self.stats["spilled"] -= len(remaining)
+                    else:
+                        # 重新落盘失败：保留回放文件（文件名属于本进程，_spill_files 会再次选中）
+                        keep_file = True
+                        self._spill_pending = True
+                        if offset:
+                            self._rewrite_replay(replay_path, remaining)
+                    break
+            
+            if not keep_file:
+                replay_path.unlink()
+        
+        if replayed:
+            self.stats["replayed"] += replayed
+            logger.info(f"[日志缓冲] {self.name} 已回放落盘日志 {replayed} 条")
+    
+    # ==================== 刷写 ====================
+    
+    async def _write(self, rows: List[Dict[str, Any]]):
+        """一个事务内多行 INSERT，并执行刷写回调"""
+        async with self.session_maker() as db:
+            async with db.begin():
+                await db.execute(insert(self.model), rows)
+                if self.on_flush:
+                    await self.on_flush(db, rows)
+    
+    def _take_batch(self) -> List[Tuple[float, Dict[str, Any]]]:
+        batch = []
+        while self._buffer and len(batch) < self.batch_size:
+            batch.append(self._buffer.popleft())
+        if len(self._buffer) < self.capacity:
+            self._not_full.set()
+        return batch
+    
+    async def flush_once(self) -> int:
+        """
+        写入一批
+        
+        Returns:
+            写入的行数；失败时批次放回缓冲区并抛出异常
+        """
+        batch = self._take_batch()
+        if not batch:
+            return 0
+        
+        rows = [row for _, row in batch]
+        start_time = time.monotonic()
+        try:
+            await self._write(rows)
+        except Exception:
+            # 放回头部保持顺序；超出容量的最旧部分按溢出策略处理
+            self._buffer.extendleft(reversed(batch))
+            excess = len(self._buffer) - self.capacity
+            if excess > 0:
+                self._overflow([self._buffer.popleft()[1] for _ in range(excess)])
+            raise
+        
+        now = time.monotonic()
+        lag_ms = int((now - batch[0][0]) * 1000)
+        self.stats["flushed"] += len(rows)
+        self.stats["batches"] += 1
+        self.stats["last_flush_lag_ms"] = lag_ms
+        self.stats["max_flush_lag_ms"] = max(self.stats["max_flush_lag_ms"], lag_ms)
+        self.stats["last_flush_ms"] = int((now - start_time) * 1000)
+        return len(rows)
+    
+    async def _flush_cycle(self):
+        while self._buffer:
+            await self.flush_once()
+            if len(self._buffer) < self.batch_size:
+                break
+        self._failures = 0
+        await self._replay_spill()
+    
+    async def _run(self):
+        while True:
+            if len(self._buffer) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            self._wakeup.clear()
+            
+            # 停止时不打断正在进行的写入
+            self._flushing = asyncio.ensure_future(self._flush_cycle())
+            try:
+                await asyncio.shield(self._flushing)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failures += 1
+                self.stats["flush_errors"] += 1
+                backoff = min(self.flush_interval * (2 ** self._failures), LOG_SINK_MAX_BACKOFF)
+                logger.error(f"[日志缓冲] {self.name} 写入失败，{backoff:.1f}s 后重试: {e}")
+                await asyncio.sleep(backoff)
+    
+    # ==================== 生命周期 ====================
+    
+    def start(self):
+        """启动后台刷写任务"""
+        if self._task is None or self._task.done():
+            # 上次运行遗留的落盘文件和回放中文件
+            self._spill_pending = bool(self._spill_files())
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"[日志缓冲] {self.name} 已启动 (batch={self.batch_size}, "
+                f"interval={int(self.flush_interval * 1000)}ms, capacity={self.capacity}, overflow={self.overflow})"
+            )
+    
+    async def stop(self):
+        """停止后台任务并写完剩余日志（写不进去的按溢出策略处理）"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        
+        if self._flushing and not self._flushing.done():
+            try:
+                await self._flushing
+            except Exception:
+                pass
+        
+        try:
+            while self._buffer:
+                await self.flush_once()
+        except Exception as e:
+            logger.error(f"[日志缓冲] {self.name} 关闭时写入失败: {e}")
+            self._overflow([row for _, row in self._buffer])
+            self._buffer.clear()
+        
+        self._close_spill()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计（含当前缓冲深度和最旧一条的等待时间）"""
+        oldest_ms = int((time.monotonic() - self._buffer[0][0]) * 1000) if self._buffer else 0
+        return {
+            **self.stats,
+            "depth": len(self._buffer),
+            "capacity": self.capacity,
+            "oldest_pending_ms": oldest_ms,
+            "overflow": self.overflow,
+            "spill_pending": self._spill_pending
+        }
+
+
+class LogSinkRegistry:
+    """日志缓冲写入器注册表（统一启停和统计）"""
+    
+    def __init__(self):
+        self._sinks: Dict[str, BufferedLogSink] = {}
+    
+    def register(self, sink: BufferedLogSink) -> BufferedLogSink:
+        self._sinks[sink.name] = sink
+        return sink
+    
+    def get(self, name: str) -> Optional[BufferedLogSink]:
+        return self._sinks.get(name)
+    
+    def start_all(self):
+        for sink in self._sinks.values():
+            sink.start()
+    
+    async def stop_all(self):
+        await asyncio.gather(*(sink.stop() for sink in self._sinks.values()))
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: sink.get_stats() for name, sink in self._sinks.items()}
+
+
+# 全局注册表
+log_sinks = LogSinkRegistry()
+
+# 操作日志（operation_logs）
+operation_log_sink = log_sinks.register(BufferedLogSink("operation_logs", OperationLog))
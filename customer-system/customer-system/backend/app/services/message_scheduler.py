@@ -14,6 +14,8 @@ from datetime import datetime, time
 import logging
 import asyncio
 
+from app.database import db_pool as default_db_pool
+from app.services.metrics import timed_job
 from app.services.unified_message_sender import UnifiedMessageSender, SendMode, MessageStatus
 
 logger = logging.getLogger(__name__)
@@ -22,13 +24,14 @@ logger = logging.getLogger(__name__)
 class MessageScheduler:
     """消息调度器"""
     
-    def __init__(self, db_pool):
+    def __init__(self, db_pool=None):
         """
         初始化调度器
         
         Args:
-            db_pool: 数据库连接池
+            db_pool: 数据库连接池，默认使用 app.database.db_pool（与 ORM 共用引擎）
         """
+        db_pool = db_pool or default_db_pool
         self.db = db_pool
         self.scheduler = AsyncIOScheduler()
         self.sender = UnifiedMessageSender(db_pool)
@@ -124,6 +127,7 @@ class MessageScheduler:
         
         logger.info(f"已添加定时任务: {template_name} ({repeat_type} at {hour:02d}:{minute:02d})")
     
+    @timed_job("template_push")
     async def _execute_template_job(self, template_id: int):
         """
         执行模板定时任务
@@ -158,21 +162,18 @@ class MessageScheduler:
             # 获取变量（这里使用实时数据）
             variables = await self._get_template_variables(template)
             
-            # 批量发送
-            results = await self.sender.send_from_template(
+            # 批量扇出发送（分批写入 + 并发投递）
+            summary = await self.sender.send_from_template_bulk(
                 template_id=template_id,
                 recipients=recipients,
                 variables=variables,
                 send_mode=SendMode.REALTIME  # 定时任务到时间后立即发送
             )
             
-            # 统计结果
-            success_count = sum(1 for r in results if r["success"])
-            failed_count = len(results) - success_count
-            
             logger.info(
                 f"定时任务执行完成: template_id={template_id}, "
-                f"成功={success_count}, 失败={failed_count}"
+                f"成功={summary['success_count']}, 失败={summary['failed_count']}, "
+                f"耗时={summary['duration_ms']}ms"
             )
             
         except Exception as e:
@@ -202,20 +203,19 @@ class MessageScheduler:
             # 群机器人：从target_config获取bot_id，然后查询group_id
             bot_id = target_config.get("bot_id")
             if bot_id:
-                async with self.db.acquire() as conn:
-                    config = await conn.fetchval("""
-                        SELECT config_data FROM channel_configs
-                        WHERE channel_type = 'GROUP_BOT'
-                    """)
+                # 走发送器的渠道配置缓存（按 bot_id 建好索引），不再每次查库线性扫描
+                try:
+                    channel = await self.sender.channels.get("GROUP_BOT")
+                except ValueError as e:
+                    logger.warning(f"模板 {template['name']} 无法解析群机器人: {e}")
+                    channel = None
                     
-                    if config:
-                        bots = config.get("bots", [])
-                        for bot in bots:
-                            if bot["bot_id"] == bot_id:
-                                recipients.append({
-                                    "customer_id": None,
-                                    "identifier": bot["group_id"]
-                                })
+                bot = channel.bot_by_id(bot_id) if channel else None
+                if bot:
+                    recipients.append({
+                        "customer_id": None,
+                        "identifier": bot["group_id"]
+                    })
         
         elif module_type == "AI":
             # @智能助手：从target_config获取目标群列表
@@ -345,6 +345,7 @@ class MessageScheduler:
         
         return variables
     
+    @timed_job("retry_failed_messages")
     async def _retry_failed_messages(self):
         """重试失败的消息"""
         logger.info("开始检查失败消息...")
@@ -379,6 +380,7 @@ class MessageScheduler:
         except Exception as e:
             logger.error(f"重试失败消息时出错: {e}")
     
+    @timed_job("cleanup_old_messages")
     async def _cleanup_old_messages(self):
         """清理过期消息（保留最近30天）"""
         logger.info("开始清理过期消息...")
@@ -461,7 +463,7 @@ class MessageScheduler:
 _scheduler_instance = None
 
 
-async def get_scheduler(db_pool) -> MessageScheduler:
+async def get_scheduler(db_pool=None) -> MessageScheduler:
     """获取调度器单例"""
     global _scheduler_instance
     
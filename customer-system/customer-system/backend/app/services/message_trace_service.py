@@ -1,16 +1,97 @@
 """
 Redis链路追踪服务
 记录消息处理的每个环节
+
+存储结构（每次写操作一个 pipeline，只追加、只做原子自增，没有读-改-写）：
+- msg_trace:{trace_id}:meta    HASH  追踪元数据（开始/结束时间、最终状态、各节点开始信息）
+- msg_trace:{trace_id}:events  LIST  节点事件（开始/完成），最多 MESSAGE_TRACE_MAX_EVENTS 条
+- msg_trace:index              ZSET  按开始时间排序的追踪ID（最近追踪查询），最多 MESSAGE_TRACE_INDEX_MAX 个
+- msg_trace:stats:{YYYYMMDDHH} HASH  按小时滚动的统计（追踪数、成功/失败、各节点次数与耗时和 node:*、耗时直方图 hist:*）
+
+统计查询只读取时间范围内的小时桶，与追踪总数无关
 """
+import os
 import redis
 import json
+import time
 import uuid
+import threading
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 import logging
 
 logger = logging.getLogger(__name__)
 
+# 追踪保留时间（秒）
+MESSAGE_TRACE_TTL = int(os.getenv("MESSAGE_TRACE_TTL", str(7 * 24 * 3600)))
+# 最近追踪索引最多保留的条数
+MESSAGE_TRACE_INDEX_MAX = int(os.getenv("MESSAGE_TRACE_INDEX_MAX", "100000"))
+# 单个追踪最多保留的节点事件数
+MESSAGE_TRACE_MAX_EVENTS = int(os.getenv("MESSAGE_TRACE_MAX_EVENTS", "200"))
+
+# 节点耗时直方图的桶上界（毫秒）
+LATENCY_BUCKETS_MS = (10, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+# 进程内记录的开始时间（结束时计算耗时不必再读Redis），超出容量时淘汰最早的
+_LOCAL_STARTS_MAX = 50000
+
+
+class _LocalStarts:
+    """有容量上限的开始时间缓存"""
+    
+    def __init__(self, capacity: int = _LOCAL_STARTS_MAX):
+        self.capacity = capacity
+        self._items: "OrderedDict[Any, Any]" = OrderedDict()
+        # 消费者在线程池中调用追踪器
+        self._lock = threading.Lock()
+    
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            if len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            return self._items.pop(key, None)
+
+
+_trace_starts = _LocalStarts()
+_node_starts = _LocalStarts()
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+def _iso(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000).isoformat()
+
+
+def _hour_bucket(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000).strftime("%Y%m%d%H")
+
+
+def _latency_bucket(duration_ms: float) -> str:
+    for bound in LATENCY_BUCKETS_MS:
+        if duration_ms <= bound:
+            return str(bound)
+    return "inf"
+
+
+def _percentile(histogram: Dict[str, int], count: int, q: float) -> Optional[float]:
+    """按直方图估算分位数（返回所在桶的上界，毫秒；落在最后一个桶之外时返回最大上界）"""
+    if count <= 0:
+        return None
+    target = count * q
+    seen = 0
+    for bound in LATENCY_BUCKETS_MS:
+        seen += histogram.get(str(bound), 0)
+        if seen >= target:
+            return float(bound)
+    return float(LATENCY_BUCKETS_MS[-1])
+
 
 class MessageTracer:
     """消息链路追踪器"""
@@ -18,30 +99,100 @@ class MessageTracer:
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
         self.trace_prefix = "msg_trace:"
-        self.trace_ttl = 7 * 24 * 3600  # 7天过期
+        self.index_key = f"{self.trace_prefix}index"
+        self.stats_prefix = f"{self.trace_prefix}stats:"
+        self.trace_ttl = MESSAGE_TRACE_TTL
     
     def generate_trace_id(self) -> str:
         """生成追踪ID"""
         return f"trace_{uuid.uuid4().hex}"
     
+    def _meta_key(self, trace_id: str) -> str:
+        return f"{self.trace_prefix}{trace_id}:meta"
+    
+    def _events_key(self, trace_id: str) -> str:
+        return f"{self.trace_prefix}{trace_id}:events"
+    
+    def _stats_key(self, ms: int) -> str:
+        return f"{self.stats_prefix}{_hour_bucket(ms)}"
+    
+    def _queue_start(self, pipe, trace_id: str, message_data: Dict, started_ms: int):
+        meta_key = self._meta_key(trace_id)
+        pipe.hset(meta_key, mapping={
+            "trace_id": trace_id,
+            "started_ms": started_ms,
+            "message_data": json.dumps(message_data, ensure_ascii=False)
+        })
+        pipe.expire(meta_key, self.trace_ttl)
+        pipe.zadd(self.index_key, {trace_id: started_ms})
+        _trace_starts.put(trace_id, started_ms)
+    
+    def _queue_index_trim(self, pipe, stats_key: str, count: int):
+        """计数并限制索引大小：丢弃超过保留时间的和超出条数上限的最早追踪"""
+        pipe.hincrby(stats_key, "traces", count)
+        pipe.expire(stats_key, self.trace_ttl)
+        pipe.zremrangebyscore(self.index_key, 0, _now_ms() - self.trace_ttl * 1000)
+        pipe.zremrangebyrank(self.index_key, 0, -MESSAGE_TRACE_INDEX_MAX - 1)
+    
     def start_trace(self, trace_id: str, message_data: Dict) -> None:
         """开始追踪"""
-        trace_key = f"{self.trace_prefix}{trace_id}"
+        if self.redis is None:
+            return
         
-        trace_data = {
-            "trace_id": trace_id,
-            "started_at": datetime.now().isoformat(),
-            "message_data": message_data,
-            "nodes": []
-        }
+        started_ms = _now_ms()
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            self._queue_start(pipe, trace_id, message_data, started_ms)
+            self._queue_index_trim(pipe, self._stats_key(started_ms), 1)
+            pipe.execute()
         
-        self.redis.setex(
-            trace_key,
-            self.trace_ttl,
-            json.dumps(trace_data, ensure_ascii=False)
-        )
+            logger.info(f"[追踪] 开始追踪: {trace_id}")
         
-        logger.info(f"[追踪] 开始追踪: {trace_id}")
+        except Exception as e:
+            logger.error(f"[追踪] 开始追踪失败: {e}")
+    
+    def start_traces_bulk(self, traces: Dict[str, Dict], chunk_size: int = 1000) -> int:
+        """
+        批量开始追踪（Redis pipeline，每批一次网络往返）
+        
+        Args:
+            traces: {trace_id: message_data}
+            chunk_size: 每个 pipeline 的追踪数
+        
+        Returns:
+            写入的追踪数
+        """
+        if self.redis is None:
+            return 0
+        
+        started_ms = _now_ms()
+        stats_key = self._stats_key(started_ms)
+        written = 0
+        
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for trace_id, message_data in traces.items():
+                self._queue_start(pipe, trace_id, message_data, started_ms)
+                written += 1
+                if written % chunk_size == 0:
+                    self._queue_index_trim(pipe, stats_key, chunk_size)
+                    pipe.execute()
+            if written % chunk_size:
+                self._queue_index_trim(pipe, stats_key, written % chunk_size)
+            pipe.execute()
+            
+            logger.info(f"[追踪] 批量开始追踪: {written} 条")
+        
+        except Exception as e:
+            logger.error(f"[追踪] 批量开始追踪失败: {e}")
+        
+        return written
+    
+    def _queue_event(self, pipe, trace_id: str, event: Dict):
+        events_key = self._events_key(trace_id)
+        pipe.rpush(events_key, json.dumps(event, ensure_ascii=False))
+        pipe.ltrim(events_key, -MESSAGE_TRACE_MAX_EVENTS, -1)
+        pipe.expire(events_key, self.trace_ttl)
     
     def add_node(
         self,
@@ -50,40 +201,30 @@ class MessageTracer:
         node_type: str,
         input_data: Optional[Dict] = None,
         metadata: Optional[Dict] = None
-    ) -> str:
-        """添加追踪节点"""
-        trace_key = f"{self.trace_prefix}{trace_id}"
+    ) -> Optional[str]:
+        """添加追踪节点（只追加事件，不读取追踪数据）"""
+        if self.redis is None or not trace_id:
+            return None
+        
+        node_id = f"node_{uuid.uuid4().hex[:12]}"
+        started_ms = _now_ms()
         
         try:
-            # 获取现有追踪数据
-            trace_json = self.redis.get(trace_key)
-            if not trace_json:
-                logger.warning(f"[追踪] 追踪ID不存在: {trace_id}")
-                return None
-            
-            trace_data = json.loads(trace_json)
-            
-            # 创建新节点
-            node_id = f"node_{len(trace_data['nodes']) + 1}"
-            node = {
+            pipe = self.redis.pipeline(transaction=False)
+            self._queue_event(pipe, trace_id, {
+                "event": "start",
                 "node_id": node_id,
                 "node_name": node_name,
                 "node_type": node_type,
-                "started_at": datetime.now().isoformat(),
+                "ts": started_ms,
                 "input_data": input_data or {},
-                "metadata": metadata or {},
-                "status": "processing"
-            }
-            
-            trace_data["nodes"].append(node)
-            
-            # 更新追踪数据
-            self.redis.setex(
-                trace_key,
-                self.trace_ttl,
-                json.dumps(trace_data, ensure_ascii=False)
-            )
+                "metadata": metadata or {}
+            })
+            # 节点开始信息也写入元数据，其他进程完成节点时可以计算耗时
+            pipe.hset(self._meta_key(trace_id), f"node:{node_id}", f"{started_ms}|{node_name}")
+            pipe.execute()
             
+            _node_starts.put((trace_id, node_id), (started_ms, node_name))
             logger.debug(f"[追踪] 添加节点: {trace_id} -> {node_name}")
             return node_id
             
@@ -91,6 +232,16 @@ class MessageTracer:
             logger.error(f"[追踪] 添加节点失败: {e}")
             return None
     
+    def _node_start(self, trace_id: str, node_id: str) -> Optional[Tuple[int, str]]:
+        cached = _node_starts.pop((trace_id, node_id))
+        if cached:
+            return cached
+        value = self.redis.hget(self._meta_key(trace_id), f"node:{node_id}")
+        if not value:
+            return None
+        started_ms, node_name = value.split("|", 1)
+        return int(started_ms), node_name
+    
     def finish_node(
         self,
         trace_id: str,
@@ -99,38 +250,40 @@ class MessageTracer:
         output_data: Optional[Dict] = None,
         error_message: Optional[str] = None
     ) -> None:
-        """完成追踪节点"""
-        trace_key = f"{self.trace_prefix}{trace_id}"
+        """完成追踪节点（追加完成事件并累加节点统计）"""
+        if self.redis is None or not trace_id or not node_id:
+            return
         
         try:
-            # 获取现有追踪数据
-            trace_json = self.redis.get(trace_key)
-            if not trace_json:
+            start = self._node_start(trace_id, node_id)
+            if not start:
                 return
+            started_ms, node_name = start
+            finished_ms = _now_ms()
+            duration_ms = finished_ms - started_ms
             
-            trace_data = json.loads(trace_json)
+            event = {
+                "event": "finish",
+                "node_id": node_id,
+                "ts": finished_ms,
+                "status": status,
+                "output_data": output_data or {}
+            }
+            if error_message:
+                event["error_message"] = error_message
             
-            # 查找并更新节点
-            for node in trace_data["nodes"]:
-                if node["node_id"] == node_id:
-                    finished_at = datetime.now()
-                    started_at = datetime.fromisoformat(node["started_at"])
-                    duration_ms = (finished_at - started_at).total_seconds() * 1000
+            stats_key = self._stats_key(finished_ms)
+            field = f"node:{node_name}"
                     
-                    node["finished_at"] = finished_at.isoformat()
-                    node["duration_ms"] = duration_ms
-                    node["status"] = status
-                    node["output_data"] = output_data or {}
-                    if error_message:
-                        node["error_message"] = error_message
-                    break
-            
-            # 更新追踪数据
-            self.redis.setex(
-                trace_key,
-                self.trace_ttl,
-                json.dumps(trace_data, ensure_ascii=False)
-            )
+            pipe = self.redis.pipeline(transaction=False)
+            self._queue_event(pipe, trace_id, event)
+            pipe.hincrby(stats_key, f"{field}:count", 1)
+            if status in ("success", "failed"):
+                pipe.hincrby(stats_key, f"{field}:{status}", 1)
+            pipe.hincrby(stats_key, f"{field}:duration_ms", duration_ms)
+            pipe.hincrby(stats_key, f"hist:{node_name}:{_latency_bucket(duration_ms)}", 1)
+            pipe.expire(stats_key, self.trace_ttl)
+            pipe.execute()
             
             logger.debug(f"[追踪] 完成节点: {trace_id} -> {node_id} ({status})")
             
@@ -139,133 +292,192 @@ class MessageTracer:
     
     def finish_trace(self, trace_id: str, final_status: str = "success") -> None:
         """结束追踪"""
-        trace_key = f"{self.trace_prefix}{trace_id}"
+        if self.redis is None or not trace_id:
+            return
+        
+        meta_key = self._meta_key(trace_id)
         
         try:
-            trace_json = self.redis.get(trace_key)
-            if not trace_json:
-                return
-            
-            trace_data = json.loads(trace_json)
+            started_ms = _trace_starts.pop(trace_id)
+            if started_ms is None:
+                value = self.redis.hget(meta_key, "started_ms")
+                if not value:
+                    return
+                started_ms = int(value)
             
-            finished_at = datetime.now()
-            started_at = datetime.fromisoformat(trace_data["started_at"])
-            total_duration_ms = (finished_at - started_at).total_seconds() * 1000
+            finished_ms = _now_ms()
+            total_duration_ms = finished_ms - started_ms
+            stats_key = self._stats_key(finished_ms)
             
-            trace_data["finished_at"] = finished_at.isoformat()
-            trace_data["total_duration_ms"] = total_duration_ms
-            trace_data["final_status"] = final_status
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(meta_key, mapping={
+                "finished_ms": finished_ms,
+                "total_duration_ms": total_duration_ms,
+                "final_status": final_status
+            })
+            pipe.hincrby(stats_key, "finished", 1)
+            if final_status in ("success", "failed"):
+                pipe.hincrby(stats_key, final_status, 1)
+            pipe.hincrby(stats_key, "duration_ms", total_duration_ms)
+            pipe.expire(stats_key, self.trace_ttl)
+            pipe.execute()
             
-            # 更新追踪数据
-            self.redis.setex(
-                trace_key,
-                self.trace_ttl,
-                json.dumps(trace_data, ensure_ascii=False)
-            )
-            
-            logger.info(f"[追踪] 结束追踪: {trace_id} ({final_status}, {total_duration_ms:.2f}ms)")
+            logger.info(f"[追踪] 结束追踪: {trace_id} ({final_status}, {total_duration_ms}ms)")
             
         except Exception as e:
             logger.error(f"[追踪] 结束追踪失败: {e}")
     
+    @staticmethod
+    def _assemble(meta: Dict[str, str], events: List[str]) -> Dict:
+        """由元数据和事件列表还原追踪数据（格式与原先单个JSON相同）"""
+        nodes: "OrderedDict[str, Dict]" = OrderedDict()
+        for raw in events:
+            event = json.loads(raw)
+            if event["event"] == "start":
+                nodes[event["node_id"]] = {
+                    "node_id": event["node_id"],
+                    "node_name": event["node_name"],
+                    "node_type": event["node_type"],
+                    "started_at": _iso(event["ts"]),
+                    "input_data": event.get("input_data", {}),
+                    "metadata": event.get("metadata", {}),
+                    "status": "processing",
+                    "_started_ms": event["ts"]
+                }
+            elif event["node_id"] in nodes:
+                node = nodes[event["node_id"]]
+                node["finished_at"] = _iso(event["ts"])
+                node["duration_ms"] = event["ts"] - node["_started_ms"]
+                node["status"] = event["status"]
+                node["output_data"] = event.get("output_data", {})
+                if event.get("error_message"):
+                    node["error_message"] = event["error_message"]
+        
+        for node in nodes.values():
+            node.pop("_started_ms")
+        
+        trace = {
+            "trace_id": meta["trace_id"],
+            "started_at": _iso(int(meta["started_ms"])),
+            "message_data": json.loads(meta.get("message_data") or "{}"),
+            "nodes": list(nodes.values())
+        }
+        if meta.get("finished_ms"):
+            trace["finished_at"] = _iso(int(meta["finished_ms"]))
+            trace["total_duration_ms"] = int(meta["total_duration_ms"])
+            trace["final_status"] = meta.get("final_status")
+        return trace
+    
+    def _get_traces(self, trace_ids: List[str]) -> List[Dict]:
+        pipe = self.redis.pipeline(transaction=False)
+        for trace_id in trace_ids:
+            pipe.hgetall(self._meta_key(trace_id))
+            pipe.lrange(self._events_key(trace_id), 0, -1)
+        results = pipe.execute()
+        
+        traces = []
+        for i in range(0, len(results), 2):
+            meta, events = results[i], results[i + 1]
+            # 只有节点信息没有开始信息的（未调用 start_trace 或已过期）不返回
+            if meta and "started_ms" in meta:
+                traces.append(self._assemble(meta, events))
+        return traces
+    
     def get_trace(self, trace_id: str) -> Optional[Dict]:
         """获取追踪数据"""
-        trace_key = f"{self.trace_prefix}{trace_id}"
+        if self.redis is None:
+            return None
         
         try:
-            trace_json = self.redis.get(trace_key)
-            if trace_json:
-                return json.loads(trace_json)
-            return None
+            traces = self._get_traces([trace_id])
+            if traces:
+                return traces[0]
+            
+            # 升级前写入的单个JSON格式（保留期内仍可查询）
+            trace_json = self.redis.get(f"{self.trace_prefix}{trace_id}")
+            return json.loads(trace_json) if trace_json else None
         except Exception as e:
             logger.error(f"[追踪] 获取追踪数据失败: {e}")
             return None
     
     def get_recent_traces(self, limit: int = 100) -> List[Dict]:
-        """获取最近的追踪记录"""
+        """获取最近的追踪记录（按开始时间倒序）"""
+        if self.redis is None:
+            return []
+        
         try:
-            # 扫描所有追踪key
-            keys = self.redis.keys(f"{self.trace_prefix}*")
-            traces = []
-            
-            for key in keys[:limit]:
-                trace_json = self.redis.get(key)
-                if trace_json:
-                    traces.append(json.loads(trace_json))
-            
-            # 按时间排序
-            traces.sort(key=lambda x: x.get("started_at", ""), reverse=True)
-            return traces
+            trace_ids = self.redis.zrevrange(self.index_key, 0, limit - 1)
+            return self._get_traces(trace_ids) if trace_ids else []
             
         except Exception as e:
             logger.error(f"[追踪] 获取最近追踪记录失败: {e}")
             return []
     
     def get_statistics(self, time_range_hours: int = 24) -> Dict:
-        """获取追踪统计"""
+        """获取追踪统计（读取时间范围内的小时统计桶，按小时粒度）"""
+        if self.redis is None:
+            return {}
+        
+        time_range_hours = max(1, min(int(time_range_hours), self.trace_ttl // 3600 or 1))
+        
         try:
-            keys = self.redis.keys(f"{self.trace_prefix}*")
+            now = datetime.now()
+            pipe = self.redis.pipeline(transaction=False)
+            for hours_ago in range(time_range_hours):
+                pipe.hgetall(f"{self.stats_prefix}{(now - timedelta(hours=hours_ago)).strftime('%Y%m%d%H')}")
+            buckets = pipe.execute()
             
-            total_count = 0
-            success_count = 0
-            failed_count = 0
-            total_duration_ms = 0
-            node_stats = {}
+            totals: Dict[str, int] = {}
+            for bucket in buckets:
+                for field, value in bucket.items():
+                    totals[field] = totals.get(field, 0) + int(value)
             
-            for key in keys:
-                trace_json = self.redis.get(key)
-                if not trace_json:
+            total_count = totals.get("traces", 0)
+            finished_count = totals.get("finished", 0)
+            success_count = totals.get("success", 0)
+            failed_count = totals.get("failed", 0)
+            
+            node_stats: Dict[str, Dict] = {}
+            histograms: Dict[str, Dict[str, int]] = {}
+            for field, value in totals.items():
+                if field.startswith("hist:"):
+                    # hist:{节点名}:{桶上界}
+                    node_name, _, bound = field[len("hist:"):].rpartition(":")
+                    histograms.setdefault(node_name, {})[bound] = value
                     continue
-                
-                trace_data = json.loads(trace_json)
-                
-                # 检查时间范围
-                started_at = datetime.fromisoformat(trace_data["started_at"])
-                if datetime.now() - started_at > timedelta(hours=time_range_hours):
+                if not field.startswith("node:"):
                     continue
-                
-                total_count += 1
-                
-                if trace_data.get("final_status") == "success":
-                    success_count += 1
-                elif trace_data.get("final_status") == "failed":
-                    failed_count += 1
-                
-                total_duration_ms += trace_data.get("total_duration_ms", 0)
-                
-                # 统计各节点
-                for node in trace_data.get("nodes", []):
-                    node_name = node["node_name"]
-                    if node_name not in node_stats:
-                        node_stats[node_name] = {
-                            "count": 0,
-                            "total_duration_ms": 0,
-                            "success_count": 0,
-                            "failed_count": 0
-                        }
-                    
-                    node_stats[node_name]["count"] += 1
-                    node_stats[node_name]["total_duration_ms"] += node.get("duration_ms", 0)
-                    
-                    if node.get("status") == "success":
-                        node_stats[node_name]["success_count"] += 1
-                    elif node.get("status") == "failed":
-                        node_stats[node_name]["failed_count"] += 1
-            
-            # 计算平均值
-            avg_duration_ms = total_duration_ms / total_count if total_count > 0 else 0
+                node_name, _, metric = field[len("node:"):].rpartition(":")
+                stats = node_stats.setdefault(node_name, {
+                    "count": 0,
+                    "total_duration_ms": 0,
+                    "success_count": 0,
+                    "failed_count": 0
+                })
+                key = {
+                    "count": "count",
+                    "duration_ms": "total_duration_ms",
+                    "success": "success_count",
+                    "failed": "failed_count"
+                }.get(metric)
+                if key:
+                    stats[key] = value
             
             for node_name, stats in node_stats.items():
                 if stats["count"] > 0:
                     stats["avg_duration_ms"] = stats["total_duration_ms"] / stats["count"]
+                    histogram = histograms.get(node_name, {})
+                    stats["p50_ms"] = _percentile(histogram, stats["count"], 0.5)
+                    stats["p95_ms"] = _percentile(histogram, stats["count"], 0.95)
+                    stats["p99_ms"] = _percentile(histogram, stats["count"], 0.99)
             
             return {
                 "time_range_hours": time_range_hours,
                 "total_count": total_count,
                 "success_count": success_count,
                 "failed_count": failed_count,
-                "success_rate": (success_count / total_count * 100) if total_count > 0 else 0,
-                "avg_duration_ms": avg_duration_ms,
+                "success_rate": (success_count / finished_count * 100) if finished_count > 0 else 0,
+                "avg_duration_ms": totals.get("duration_ms", 0) / finished_count if finished_count > 0 else 0,
                 "node_statistics": node_stats
             }
             
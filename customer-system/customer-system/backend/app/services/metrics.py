@@ -0,0 +1,400 @@
+"""
+进程内指标（Prometheus 文本格式）
+
+- 计数器 / 仪表 / 直方图在进程内累加，抓取 /metrics 时一次性渲染，不查询数据库
+- 更新不加锁：计数都在事件循环线程内修改，单次加法不会被打断
+- 各模块已有的 get_stats() 通过 register_collector 在抓取时读取，不改动原有统计
+- 独立进程（如消息消费者）用 serve_metrics 开一个最小的 HTTP 端口供抓取
+"""
+import time
+import asyncio
+import logging
+import functools
+from bisect import bisect_left
+from enum import Enum
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 默认直方图分桶（秒），覆盖短信/邮件/Webhook 的常见延迟
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# 定时任务耗时分桶（秒）
+JOB_BUCKETS = (0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0, 3600.0)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if value == float("-inf"):
+        return "-Inf"
+    if value != value:
+        return "NaN"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def _label(value: Any) -> str:
+    # ChannelType 等 str 枚举取其值，避免 str() 得到 "ChannelType.SMS"
+    return str(value.value if isinstance(value, Enum) else value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# ==================== 指标类型 ====================
+
+class _CounterChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0.0
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class _GaugeChild:
+    __slots__ = ("value",)
+    
+    def __init__(self):
+        self.value = 0.0
+    
+    def set(self, value: float):
+        self.value = float(value)
+    
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+    
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+    
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # 最后一格为 +Inf
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+    
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class _Metric:
+    """带标签的指标：标签值组合 → 子指标（首次使用时创建）"""
+    
+    kind = ""
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+    
+    def _new_child(self):
+        raise NotImplementedError
+    
+    def labels(self, *values, **kwargs):
+        """
+        获取标签值对应的子指标
+        
+        Args:
+            values / kwargs: 按位置或按名称给出全部标签值
+        
+        Raises:
+            ValueError: 标签数量不匹配
+        """
+        if kwargs:
+            values = tuple(kwargs[name] for name in self.labelnames)
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}")
+        key = tuple(_label(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children.setdefault(key, self._new_child())
+        return child
+    
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for key, child in list(self._children.items()):
+            self._render_child(lines, key, child)
+    
+    def _render_child(self, lines: List[str], key: Tuple[str, ...], child):
+        lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}")
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    
+    kind = "counter"
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount: float = 1.0):
+        """无标签计数器加一"""
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+    
+    kind = "gauge"
+    
+    def _new_child(self):
+        return _GaugeChild()
+    
+    def set(self, value: float):
+        """设置无标签仪表的值"""
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    """分桶直方图（_bucket / _sum / _count）"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets if b != float("inf")))
+    
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+    
+    def observe(self, value: float):
+        """无标签直方图记录一次"""
+        self.labels().observe(value)
+    
+    def _render_child(self, lines: List[str], key: Tuple[str, ...], child: _HistogramChild):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), list(child.counts)):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+class MetricFamily:
+    """抓取时由采集函数生成的一组样本（用于导出各模块已有的 get_stats）"""
+    
+    def __init__(self, name: str, kind: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.kind = kind
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.samples: List[Tuple[Tuple[str, ...], float]] = []
+    
+    def add(self, value: Optional[float], *labelvalues) -> "MetricFamily":
+        """添加一个样本（值为 None 时跳过）"""
+        if value is not None:
+            self.samples.append((tuple(_label(v) for v in labelvalues), float(value)))
+        return self
+    
+    def render(self, lines: List[str]):
+        lines.append(f"# HELP {self.name} {self.documentation}")
+        lines.append(f"# TYPE {self.name} {self.kind}")
+        for key, value in self.samples:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+
+
+# ==================== 注册表 ====================
+
+class MetricsRegistry:
+    """进程内指标注册表"""
+    
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Callable[[], Iterable[MetricFamily]]] = {}
+    
+    def _get_or_create(self, cls, name: str, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics.setdefault(name, cls(name, *args, **kwargs))
+        if not isinstance(metric, cls):
+            raise ValueError(f"指标 {name} 已注册为 {metric.kind}")
+        return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """获取或创建计数器（同名重复调用返回同一个）"""
+        return self._get_or_create(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """获取或创建仪表"""
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        """获取或创建直方图"""
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+    
+    def register_collector(self, name: str, collect: Callable[[], Iterable[MetricFamily]]):
+        """
+        注册抓取时调用的采集函数（同名覆盖）
+        
+        Args:
+            name: 采集函数名称（用于去重和日志）
+            collect: 返回 MetricFamily 列表的函数，不应做 I/O
+        """
+        self._collectors[name] = collect
+    
+    def render(self) -> str:
+        """渲染为 Prometheus 文本格式"""
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            metric.render(lines)
+        
+        # 不同采集函数可以输出同名指标（如各缓存的 cache_requests_total），合并后只写一次 HELP/TYPE
+        merged: Dict[str, MetricFamily] = {}
+        for name, collect in list(self._collectors.items()):
+            try:
+                families = list(collect())
+            except Exception as e:
+                logger.warning(f"[指标] 采集 {name} 失败: {e}")
+                continue
+            for family in families:
+                if family.name in merged:
+                    merged[family.name].samples.extend(family.samples)
+                else:
+                    merged[family.name] = family
+        for family in merged.values():
+            family.render(lines)
+        return "\n".join(lines) + "\n"
+
+
+# 全局注册表
+metrics = MetricsRegistry()
+
+
+# ==================== 公共指标 ====================
+
+# API 进程（UnifiedMessageSender）和消费者进程都记录
+MESSAGE_SEND_DURATION = metrics.histogram(
+    "message_send_duration_seconds", "单次上游发送耗时（秒，不含限流排队）", ("channel",)
+)
+MESSAGE_SEND_TOTAL = metrics.counter(
+    "message_send_total", "消息发送结果", ("channel", "result")
+)
+
+SCHEDULER_JOB_DURATION = metrics.histogram(
+    "scheduler_job_duration_seconds", "定时任务执行耗时（秒）", ("job",), buckets=JOB_BUCKETS
+)
+SCHEDULER_JOB_RUNS = metrics.counter(
+    "scheduler_job_runs_total", "定时任务执行次数", ("job", "result")
+)
+
+
+def record_send(channel: str, success: bool):
+    """记录一次消息发送结果"""
+    MESSAGE_SEND_TOTAL.labels(channel, "success" if success else "failed").inc()
+
+
+def timed_job(job: str):
+    """
+    定时任务耗时装饰器（async 函数）
+    
+    Args:
+        job: 任务名（标签值，不要带模板ID等高基数内容）
+    """
+    def decorator(func):
+        duration = SCHEDULER_JOB_DURATION.labels(job)
+        
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.monotonic()
+            result = "failed"
+            try:
+                value = await func(*args, **kwargs)
+                result = "success"
+                return value
+            finally:
+                duration.observe(time.monotonic() - started)
+                SCHEDULER_JOB_RUNS.labels(job, result).inc()
+        
+        return wrapper
+    
+    return decorator
+
+
+def instrument_pool(engine, name: str):
+    """
+    统计 SQLAlchemy 连接池的借出次数
+    
+    Args:
+        engine: AsyncEngine 或 Engine
+        name: 标签值（primary / replica）
+    """
+    from sqlalchemy import event
+    
+    checkouts = metrics.counter(
+        "db_pool_checkouts_total", "数据库连接池借出次数", ("engine",)
+    ).labels(name)
+    sync_engine = getattr(engine, "sync_engine", engine)
+    
+    @event.listens_for(sync_engine.pool, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checkouts.inc()
+
+
+# ==================== 独立进程的抓取端口 ====================
+
+async def _handle_scrape(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # 读完请求头
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, content_type, body = "200 OK", CONTENT_TYPE, metrics.render().encode("utf-8")
+        else:
+            status, content_type, body = "404 Not Found", "text/plain", b"not found\n"
+        
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve_metrics(port: int, host: str = "0.0.0.0") -> Optional[asyncio.AbstractServer]:
+    """
+    在没有 FastAPI 的进程中开放 GET /metrics
+    
+    Args:
+        port: 端口，0 表示不开放
+        host: 监听地址
+    
+    Returns:
+        asyncio Server（调用方负责 close），未开放或端口被占用时返回 None
+    """
+    if not port:
+        return None
+    try:
+        server = await asyncio.start_server(_handle_scrape, host, port)
+    except OSError as e:
+        logger.error(f"[指标] 无法监听 {host}:{port}，指标端口未开放: {e}")
+        return None
+    logger.info(f"[指标] 已开放 http://{host}:{port}/metrics")
+    return server
@@ -4,7 +4,8 @@
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, and_, or_, func
-from app.models import Opportunity, Customer, OperationLog
+from app.models import Opportunity, Customer
+from app.services.log_sink import operation_log_sink
 from typing import List, Optional, Dict
 from datetime import datetime, timedelta
 from decimal import Decimal
@@ -71,7 +72,7 @@ class OpportunityService:
         
         # 记录操作日志
         await OpportunityService._log_operation(
-            db, 'create', opportunity.id, sales_userid, sales_name,
+            'create', opportunity.id, sales_userid, sales_name,
             {'action': '创建商机', 'product': product_name}
         )
         
@@ -116,7 +117,7 @@ class OpportunityService:
         
         # 记录操作日志
         await OpportunityService._log_operation(
-            db, 'claim', opportunity_id, sales_userid, sales_name,
+            'claim', opportunity_id, sales_userid, sales_name,
             {'action': '认领商机'}
         )
         
@@ -168,7 +169,7 @@ class OpportunityService:
         
         # 记录操作日志
         await OpportunityService._log_operation(
-            db, 'follow_up', opportunity_id, sales_userid, sales_name,
+            'follow_up', opportunity_id, sales_userid, sales_name,
             {'action': '添加跟进', 'content': follow_up_content}
         )
         
@@ -213,7 +214,7 @@ class OpportunityService:
         
         # 记录操作日志
         await OpportunityService._log_operation(
-            db, 'quote', opportunity_id, sales_userid, sales_name,
+            'quote', opportunity_id, sales_userid, sales_name,
             {'action': '提交报价', 'amount': float(quoted_amount)}
         )
         
@@ -255,7 +256,7 @@ class OpportunityService:
         
         # 记录操作日志
         await OpportunityService._log_operation(
-            db, 'win', opportunity_id, sales_userid, sales_name,
+            'win', opportunity_id, sales_userid, sales_name,
             {'action': '商机成交'}
         )
         
@@ -300,7 +301,7 @@ class OpportunityService:
         
         # 记录操作日志
         await OpportunityService._log_operation(
-            db, 'lost', opportunity_id, sales_userid, sales_name,
+            'lost', opportunity_id, sales_userid, sales_name,
             {'action': '商机丢失', 'reason': lost_reason}
         )
         
@@ -383,7 +384,6 @@ class OpportunityService:
     
     @staticmethod
     async def _log_operation(
-        db: AsyncSession,
         operation_type: str,
         opportunity_id: int,
         operator_userid: str,
@@ -391,16 +391,13 @@ class OpportunityService:
         detail: Dict,
         source: str = 'group_bot'
     ):
-        """记录操作日志"""
-        log = OperationLog(
+        """记录操作日志（缓冲写入，不额外提交事务）"""
+        await operation_log_sink.put(
             operation_type=operation_type,
             entity_type='opportunity',
             entity_id=opportunity_id,
             operator_userid=operator_userid,
             operator_name=operator_name,
             operation_source=source,
-            operation_detail=detail,
-            created_at=datetime.now()
+            operation_detail=detail
         )
-        db.add(log)
-        await db.commit()
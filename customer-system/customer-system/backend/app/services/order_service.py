@@ -4,7 +4,8 @@
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update
-from app.models import Order, Opportunity, Customer, Equipment, OperationLog
+from app.models import Order, Opportunity, Customer, Equipment
+from app.services.log_sink import operation_log_sink
 from typing import List, Optional, Dict
 from datetime import datetime, date
 from decimal import Decimal
@@ -85,7 +86,7 @@ class OrderService:
         
         # 记录操作日志
         await OrderService._log_operation(
-            db, 'create', order.id, sales_userid, sales_name,
+            'create', order.id, sales_userid, sales_name,
             {'action': '创建订单', 'order_no': order_no, 'opportunity_id': opportunity_id}
         )
         
@@ -126,7 +127,7 @@ class OrderService:
         
         # 记录操作日志
         await OrderService._log_operation(
-            db, 'confirm', order_id, operator_userid, operator_name,
+            'confirm', order_id, operator_userid, operator_name,
             {'action': '确认订单'}
         )
         
@@ -167,7 +168,7 @@ class OrderService:
         
         # 记录操作日志
         await OrderService._log_operation(
-            db, 'paid', order_id, operator_userid, operator_name,
+            'paid', order_id, operator_userid, operator_name,
             {'action': '标记已支付'}
         )
         
@@ -209,7 +210,7 @@ class OrderService:
         
         # 记录操作日志
         await OrderService._log_operation(
-            db, 'delivered', order_id, operator_userid, operator_name,
+            'delivered', order_id, operator_userid, operator_name,
             {'action': '标记已配送'}
         )
         
@@ -255,7 +256,7 @@ class OrderService:
         
         # 记录操作日志
         await OrderService._log_operation(
-            db, 'installed', order_id, installer_userid, installer_name,
+            'installed', order_id, installer_userid, installer_name,
             {'action': '标记已安装'}
         )
         
@@ -365,7 +366,6 @@ class OrderService:
     
     @staticmethod
     async def _log_operation(
-        db: AsyncSession,
         operation_type: str,
         order_id: int,
         operator_userid: str,
@@ -373,16 +373,13 @@ class OrderService:
         detail: Dict,
         source: str = 'web_ui'
     ):
-        """记录操作日志"""
-        log = OperationLog(
+        """记录操作日志（缓冲写入，不额外提交事务）"""
+        await operation_log_sink.put(
             operation_type=operation_type,
             entity_type='order',
             entity_id=order_id,
             operator_userid=operator_userid,
             operator_name=operator_name,
             operation_source=source,
-            operation_detail=detail,
-            created_at=datetime.now()
+            operation_detail=detail
         )
-        db.add(log)
-        await db.commit()
@@ -0,0 +1,368 @@
+"""
+外发消息限流（按渠道、按目的地自适应）
+
+每个目的地（如某个群机器人 webhook）和每个渠道各有一个闸门：
+- 静态配额：令牌桶，例如群机器人每个 webhook 20 条/分钟；
+  可在渠道配置中用 rate_limit / destination_rate_limit（{"count": 20, "seconds": 60}）覆盖
+- 自适应并发（目的地闸门）：按观察到的延迟做梯度调整（延迟接近最低延迟时逐步增加，
+  延迟升高时按比例收缩）；上游返回限频错误时减半（AIMD）并暂停到 retry_after 之后，
+  超时 / 5xx 时减少 10%
+- 超出配额的消息排队等待（FIFO），不直接失败；排队超过 OUTBOUND_MAX_WAIT 秒才失败，
+  被上游限频的消息在闸门内重新排队，最多 OUTBOUND_THROTTLE_RETRIES 次
+
+各闸门当前生效的并发上限和配额通过 get_stats() 暴露（/api/admin/outbound-limits）
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, Tuple
+
+import httpx
+
+from app.services.metrics import MetricFamily, metrics
+
+logger = logging.getLogger(__name__)
+
+# 排队等待的最长时间（秒），超过后本次发送失败（由消息重试机制处理）
+OUTBOUND_MAX_WAIT = float(os.getenv("OUTBOUND_MAX_WAIT", "300"))
+# 被上游限频后在闸门内重新排队的次数
+OUTBOUND_THROTTLE_RETRIES = int(os.getenv("OUTBOUND_THROTTLE_RETRIES", "3"))
+# 上游没有给出 retry_after 时的暂停时间（秒）
+OUTBOUND_THROTTLE_PAUSE = float(os.getenv("OUTBOUND_THROTTLE_PAUSE", "10"))
+# 延迟容忍倍数：平滑延迟不超过 最低延迟 × 倍数 时视为未拥塞
+OUTBOUND_RTT_TOLERANCE = float(os.getenv("OUTBOUND_RTT_TOLERANCE", "2.0"))
+
+# 每个渠道同时在途的最大发送数（渠道闸门为固定值，目的地闸门的自适应上限不超过它）
+CHANNEL_CONCURRENCY = {
+    "SMS": 20,
+    "EMAIL": 10,
+    "GROUP_BOT": 5,
+    "AI": 5,
+    "WORK_WECHAT": 20,
+    "WECHAT": 50
+}
+
+# 渠道级静态配额（条数, 秒），None 表示只限并发
+CHANNEL_QUOTAS: Dict[str, Optional[Tuple[int, float]]] = {
+    "SMS": (100, 1),
+    "EMAIL": (20, 1),
+    "GROUP_BOT": None,
+    "AI": None,
+    "WORK_WECHAT": (50, 1),
+    "WECHAT": (100, 1)
+}
+
+# 目的地级静态配额（企业微信群机器人：每个 webhook 每分钟 20 条）
+DESTINATION_QUOTAS: Dict[str, Optional[Tuple[int, float]]] = {
+    "GROUP_BOT": (20, 60),
+    "AI": (20, 60)
+}
+
+DEFAULT_CONCURRENCY = 10
+
+
+class UpstreamThrottled(Exception):
+    """上游返回限频错误（HTTP 429、企业微信 45009 等），消息会重新排队"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class OutboundQueueTimeout(Exception):
+    """排队等待超过 OUTBOUND_MAX_WAIT"""
+
+
+def _parse_quota(value: Any, default: Optional[Tuple[int, float]]) -> Optional[Tuple[int, float]]:
+    """渠道配置中的 {"count": 20, "seconds": 60} 转为 (20, 60)"""
+    if isinstance(value, dict) and value.get("count"):
+        return int(value["count"]), float(value.get("seconds") or 1)
+    return default
+
+
+class _Gate:
+    """单个闸门：令牌桶 + FIFO 并发槽位（可选自适应并发上限）"""
+    
+    def __init__(
+        self,
+        key: str,
+        quota: Optional[Tuple[int, float]],
+        max_limit: int,
+        adaptive: bool
+    ):
+        self.key = key
+        self.max_limit = max_limit
+        self.adaptive = adaptive
+        self.limit = float(max_limit)
+        
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        
+        self.quota: Optional[Tuple[int, float]] = None
+        self.tokens = 0.0
+        self.refilled_at = time.monotonic()
+        self.paused_until = 0.0
+        self.set_quota(quota)
+        
+        self.min_rtt: Optional[float] = None
+        self.smoothed_rtt: Optional[float] = None
+        
+        self.stats = {"sent": 0, "throttled": 0, "errors": 0, "queue_timeouts": 0, "wait_seconds": 0.0}
+    
+    def set_quota(self, quota: Optional[Tuple[int, float]]):
+        if quota != self.quota:
+            self.quota = quota
+            self.tokens = float(quota[0]) if quota else 0.0
+            self.refilled_at = time.monotonic()
+    
+    @property
+    def effective_limit(self) -> int:
+        return max(1, int(self.limit))
+    
+    # ---------- 并发槽位 ----------
+    
+    async def _acquire_slot(self):
+        if self.in_flight < self.effective_limit and not self._waiters:
+            self.in_flight += 1
+            return
+        
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 已分到槽位但调用方被取消（如排队超时），把槽位让出去
+                self.release()
+            else:
+                try:
+                    self._waiters.remove(future)
+                except ValueError:
+                    # release() 已把这个取消的等待者从队列中弹出
+                    pass
+            raise
+    
+    def _wake(self):
+        while self._waiters and self.in_flight < self.effective_limit:
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+    
+    def release(self):
+        self.in_flight -= 1
+        self._wake()
+    
+    # ---------- 令牌桶 ----------
+    
+    async def _acquire_token(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            if self.quota is None:
+                return
+            
+            count, seconds = self.quota
+            rate = count / seconds
+            self.tokens = min(float(count), self.tokens + (now - self.refilled_at) * rate)
+            self.refilled_at = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / rate)
+    
+    async def acquire(self):
+        """排队取得槽位和令牌（持有槽位时等待令牌，等待者数量不超过并发上限）"""
+        await self._acquire_slot()
+        try:
+            await self._acquire_token()
+        except BaseException:
+            self.release()
+            raise
+    
+    # ---------- 自适应并发 ----------
+    
+    def on_success(self, rtt: float):
+        self.stats["sent"] += 1
+        if not self.adaptive:
+            return
+        
+        # 最低延迟缓慢上浮，避免网络变化后一直以旧的最低值为基准
+        self.min_rtt = rtt if self.min_rtt is None else min(rtt, self.min_rtt * 1.01)
+        self.smoothed_rtt = rtt if self.smoothed_rtt is None else 0.8 * self.smoothed_rtt + 0.2 * rtt
+        
+        # 梯度 = 容忍延迟 / 平滑延迟（截断到 [0.5, 1]），sqrt(limit) 为排队余量：
+        # 延迟正常时上限逐步增长，延迟升高时按比例收缩；新值平滑后生效
+        gradient = max(0.5, min(1.0, self.min_rtt * OUTBOUND_RTT_TOLERANCE / max(self.smoothed_rtt, 1e-6)))
+        new_limit = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = max(1.0, min(float(self.max_limit), 0.8 * self.limit + 0.2 * new_limit))
+        self._wake()
+    
+    def on_throttled(self, retry_after: Optional[float]):
+        self.stats["throttled"] += 1
+        if self.adaptive:
+            self.limit = max(1.0, self.limit / 2)
+        # 上游已经限频：清空本地令牌并暂停，之后从配额重新开始
+        self.tokens = 0.0
+        self.paused_until = max(self.paused_until, time.monotonic() + (retry_after or OUTBOUND_THROTTLE_PAUSE))
+    
+    def on_overload(self):
+        """超时 / 5xx：按比例降低并发"""
+        self.stats["errors"] += 1
+        if self.adaptive:
+            self.limit = max(1.0, self.limit * 0.9)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 3),
+            "limit": self.effective_limit,
+            "max_limit": self.max_limit,
+            "adaptive": self.adaptive,
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "quota": {"count": self.quota[0], "seconds": self.quota[1]} if self.quota else None,
+            "paused_for": round(max(0.0, self.paused_until - time.monotonic()), 3),
+            "min_rtt_ms": round(self.min_rtt * 1000, 1) if self.min_rtt is not None else None,
+            "smoothed_rtt_ms": round(self.smoothed_rtt * 1000, 1) if self.smoothed_rtt is not None else None
+        }
+
+
+def _is_overload(error: BaseException) -> bool:
+    if isinstance(error, (asyncio.TimeoutError, httpx.TimeoutException)):
+        return True
+    return isinstance(error, httpx.HTTPStatusError) and error.response.status_code >= 500
+
+
+class OutboundLimiter:
+    """外发消息限流器（进程内所有发送共用）"""
+    
+    def __init__(self):
+        self._gates: Dict[str, _Gate] = {}
+    
+    def _gate(self, key: str, quota, max_limit: int, adaptive: bool) -> _Gate:
+        gate = self._gates.get(key)
+        if gate is None:
+            gate = self._gates[key] = _Gate(key, quota, max_limit, adaptive)
+        else:
+            gate.set_quota(quota)
+        return gate
+    
+    def _gates_for(self, channel_type: str, destination: Optional[str], config) -> Tuple[_Gate, ...]:
+        concurrency = CHANNEL_CONCURRENCY.get(channel_type, DEFAULT_CONCURRENCY)
+        channel_quota = _parse_quota(config.get("rate_limit") if config else None, CHANNEL_QUOTAS.get(channel_type))
+        
+        if not destination:
+            # 渠道只有一个目的地（短信网关、邮件服务器等）：渠道闸门本身自适应
+            return (self._gate(channel_type, channel_quota, concurrency, adaptive=True),)
+        
+        destination_quota = _parse_quota(
+            config.get("destination_rate_limit") if config else None,
+            DESTINATION_QUOTAS.get(channel_type)
+        )
+        return (
+            self._gate(f"{channel_type}:{destination}", destination_quota, concurrency, adaptive=True),
+            self._gate(channel_type, channel_quota, concurrency, adaptive=False)
+        )
+    
+    @staticmethod
+    async def _acquire_all(gates: Tuple[_Gate, ...]):
+        acquired = []
+        try:
+            # 先目的地后渠道：等待慢目的地时不占用渠道槽位
+            for gate in gates:
+                await gate.acquire()
+                acquired.append(gate)
+        except BaseException:
+            for gate in reversed(acquired):
+                gate.release()
+            raise
+    
+    async def run(
+        self,
+        channel_type: str,
+        destination: Optional[str],
+        call: Callable[[], Awaitable[Any]],
+        config=None
+    ) -> Any:
+        """
+        经限流闸门执行一次发送
+        
+        Args:
+            channel_type: 渠道类型
+            destination: 目的地标识（如群机器人ID），渠道只有一个目的地时为 None
+            call: 实际发送的协程函数
+            config: 渠道配置（可覆盖配额）
+        
+        Returns:
+            call 的返回值
+        
+        Raises:
+            OutboundQueueTimeout: 排队超时
+            UpstreamThrottled: 重新排队次数用完后仍被上游限频
+        """
+        gates = self._gates_for(channel_type, destination, config)
+        gate = gates[0]
+        
+        for attempt in range(OUTBOUND_THROTTLE_RETRIES + 1):
+            queued_at = time.monotonic()
+            try:
+                await asyncio.wait_for(self._acquire_all(gates), timeout=OUTBOUND_MAX_WAIT)
+            except asyncio.TimeoutError:
+                gate.stats["queue_timeouts"] += 1
+                raise OutboundQueueTimeout(f"发送排队超时: {gate.key} ({OUTBOUND_MAX_WAIT}s)")
+            
+            started = time.monotonic()
+            gate.stats["wait_seconds"] += started - queued_at
+            try:
+                result = await call()
+            except UpstreamThrottled as e:
+                # 限频针对的是这个目的地（单目的地渠道即渠道本身）
+                gate.on_throttled(e.retry_after)
+                if attempt >= OUTBOUND_THROTTLE_RETRIES:
+                    raise
+                logger.warning(f"[外发限流] {gate.key} 被上游限频，重新排队 ({attempt + 1}/{OUTBOUND_THROTTLE_RETRIES}): {e}")
+            except Exception as e:
+                if _is_overload(e):
+                    gate.on_overload()
+                raise
+            else:
+                gate.on_success(time.monotonic() - started)
+                return result
+            finally:
+                for g in reversed(gates):
+                    g.release()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """各闸门当前生效的并发上限、配额与排队情况"""
+        return {key: gate.snapshot() for key, gate in sorted(self._gates.items())}
+
+
+# 全局外发限流器
+outbound_limiter = OutboundLimiter()
+
+
+def _collect_outbound_metrics():
+    limit = MetricFamily("outbound_gate_limit", "gauge", "外发闸门当前并发上限", ("gate",))
+    in_flight = MetricFamily("outbound_gate_in_flight", "gauge", "外发闸门正在发送的请求数", ("gate",))
+    queued = MetricFamily("outbound_gate_queued", "gauge", "外发闸门排队等待的请求数", ("gate",))
+    events = MetricFamily(
+        "outbound_gate_events_total", "counter", "外发闸门事件（sent/throttled/errors/queue_timeouts）", ("gate", "event")
+    )
+    wait = MetricFamily("outbound_gate_wait_seconds_total", "counter", "外发闸门累计排队时间（秒）", ("gate",))
+    for key, snapshot in outbound_limiter.get_stats().items():
+        limit.add(snapshot["limit"], key)
+        in_flight.add(snapshot["in_flight"], key)
+        queued.add(snapshot["queued"], key)
+        for event in ("sent", "throttled", "errors", "queue_timeouts"):
+            events.add(snapshot[event], key, event)
+        wait.add(snapshot["wait_seconds"], key)
+    return [limit, in_flight, queued, events, wait]
+
+
+metrics.register_collector("outbound", _collect_outbound_metrics)
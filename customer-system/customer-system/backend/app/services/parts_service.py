@@ -4,7 +4,8 @@
 """
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, update, and_
-from app.models import PartsInventory, PartsUsage, Project, Equipment, OperationLog
+from app.models import PartsInventory, PartsUsage, Project, Equipment
+from app.services.log_sink import operation_log_sink
 from typing import List, Optional, Dict
 from datetime import datetime, date
 from decimal import Decimal
@@ -83,7 +84,7 @@ class PartsService:
         
         # 记录操作日志
         await PartsService._log_operation(
-            db, 'create', part.id, operator_userid, operator_name,
+            'create', part.id, operator_userid, operator_name,
             {'action': '创建配件', 'part_code': part_code, 'part_name': part_name}
         )
         
@@ -161,7 +162,7 @@ class PartsService:
         
         # 记录操作日志
         await PartsService._log_operation(
-            db, 'request', part.id, engineer_userid, engineer_name,
+            'request', part.id, engineer_userid, engineer_name,
             {'action': '领用配件', 'quantity': quantity, 'ticket_id': ticket_id, 'usage_id': usage.id}
         )
         
@@ -210,7 +211,7 @@ class PartsService:
         
         # 记录操作日志
         await PartsService._log_operation(
-            db, 'restock', part.id, operator_userid, operator_name,
+            'restock', part.id, operator_userid, operator_name,
             {'action': '配件入库', 'quantity': quantity, 'new_stock': part.stock_quantity}
         )
         
@@ -350,7 +351,6 @@ class PartsService:
     
     @staticmethod
     async def _log_operation(
-        db: AsyncSession,
         operation_type: str,
         part_id: int,
         operator_userid: str,
@@ -358,16 +358,13 @@ class PartsService:
         detail: Dict,
         source: str = 'web_ui'
     ):
-        """记录操作日志"""
-        log = OperationLog(
+        """记录操作日志（缓冲写入，不额外提交事务）"""
+        await operation_log_sink.put(
             operation_type=operation_type,
             entity_type='parts',
             entity_id=part_id,
             operator_userid=operator_userid,
             operator_name=operator_name,
             operation_source=source,
-            operation_detail=detail,
-            created_at=datetime.now()
+            operation_detail=detail
         )
-        db.add(log)
-        await db.commit()
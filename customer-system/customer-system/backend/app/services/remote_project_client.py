@@ -0,0 +1,128 @@
+"""
+远程项目API客户端
+供项目同步（定时任务和手动同步）使用
+
+接口约定：
+    GET {base}/projects?types=presale,aftersales&updated_since=<ISO时间>&cursor=<游标>&limit=<条数>
+    响应：{"projects": [...], "next_cursor": "..." | null, "server_time": "<ISO时间>"}
+
+- 分页拉取，每页到达后立即解析并交给调用方处理，不在内存中拼接整个项目列表
+- updated_since 为空时为全量拉取
+- 高水位取第一页的 server_time（以远程时钟为准，避免本地时钟偏差漏数据）
+"""
+import os
+import time
+import logging
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from app.services.http_client_service import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# 远程API配置（可通过环境变量调整）
+REMOTE_PROJECT_API_BASE = os.getenv("REMOTE_PROJECT_API_BASE", "https://remote-api.example.com")
+REMOTE_PROJECT_API_KEY = os.getenv("REMOTE_PROJECT_API_KEY", "your-api-key")
+REMOTE_PROJECT_PAGE_SIZE = int(os.getenv("REMOTE_PROJECT_PAGE_SIZE", "500"))
+
+
+class RemoteProjectClient:
+    """远程项目API客户端"""
+    
+    def __init__(
+        self,
+        base_url: str = REMOTE_PROJECT_API_BASE,
+        api_key: str = REMOTE_PROJECT_API_KEY,
+        page_size: int = REMOTE_PROJECT_PAGE_SIZE
+    ):
+        """
+        初始化
+        
+        Args:
+            base_url: 远程API地址
+            api_key: API密钥
+            page_size: 每页条数
+        """
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.page_size = page_size
+        
+        # 最近一次拉取的统计
+        self.server_time: Optional[str] = None
+        self.pages = 0
+        self.fetch_seconds = 0.0
+    
+    async def iter_pages(
+        self,
+        project_types: List[str],
+        updated_since: Optional[str] = None
+    ) -> AsyncIterator[List[Dict[str, Any]]]:
+        """
+        逐页拉取项目
+        
+        Args:
+            project_types: 项目类型
+            updated_since: 增量起点（ISO时间），为空时全量拉取
+        
+        Yields:
+            每页的项目列表
+        """
+        client = get_http_client("default")
+        cursor: Optional[str] = None
+        
+        self.server_time = None
+        self.pages = 0
+        self.fetch_seconds = 0.0
+        
+        while True:
+            params = {"types": ",".join(project_types), "limit": self.page_size}
+            if updated_since:
+                params["updated_since"] = updated_since
+            if cursor:
+                params["cursor"] = cursor
+            
+            start = time.perf_counter()
+            response = await client.get(
+                f"{self.base_url}/projects",
+                params=params,
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            response.raise_for_status()
+            page = response.json()
+            self.fetch_seconds += time.perf_counter() - start
+            
+            if self.server_time is None:
+                self.server_time = page.get("server_time")
+            
+            self.pages += 1
+            projects = page.get("projects", [])
+            if projects:
+                yield projects
+            
+            cursor = page.get("next_cursor")
+            if not cursor:
+                break
+        
+        logger.info(
+            f"[远程项目] 拉取完成: {self.pages} 页, "
+            f"{'增量 since=' + updated_since if updated_since else '全量'}, "
+            f"耗时 {self.fetch_seconds:.2f}s"
+        )
+    
+    async def fetch_all(self, project_types: List[str]) -> List[Dict[str, Any]]:
+        """全量拉取项目（仍按页请求，结果合并返回）"""
+        projects: List[Dict[str, Any]] = []
+        async for page in self.iter_pages(project_types):
+            projects.extend(page)
+        return projects
+    
+    async def fetch_one(self, project_id: str) -> Optional[Dict[str, Any]]:
+        """获取单个项目"""
+        response = await get_http_client("default").get(
+            f"{self.base_url}/projects/{project_id}",
+            headers={"Authorization": f"Bearer {self.api_key}"}
+        )
+        if response.status_code == 200:
+            return response.json()
+        
+        logger.error(f"[远程项目] 获取项目 {project_id} 失败: {response.status_code}")
+        return None
@@ -7,10 +7,19 @@ Group Bot Sender
 - 支持文本、Markdown、图文消息
 """
 
-import aiohttp
+import hashlib
 import logging
 from typing import Dict, Any, Optional
 
+from app.services.channel_registry import ChannelConfig
+from app.services.http_client_service import get_http_client
+from app.services.outbound_limiter import UpstreamThrottled
+
+# 企业微信接口调用频率超限
+WEWORK_FREQ_LIMIT_ERRCODE = 45009
+# 群机器人配额按分钟计算，被限频后暂停一个周期
+GROUP_BOT_THROTTLE_PAUSE = 60
+
 logger = logging.getLogger(__name__)
 
 
@@ -25,10 +34,27 @@ class GroupBotSender:
             db_pool: 数据库连接池
         """
         self.db = db_pool
+        self.http_client = get_http_client("group_bot")
+    
+    def destination_key(self, config: ChannelConfig, recipient: str) -> str:
+        """
+        外发限流的目的地标识：每个机器人（webhook）单独限流
+        
+        Args:
+            config: 渠道配置
+            recipient: 群ID
+        
+        Returns:
+            机器人ID；未配置 bot_id 时使用 webhook 地址的摘要（不暴露 webhook key）
+        """
+        bot_config = config.bot_for_group(recipient)
+        if not bot_config:
+            return recipient
+        return bot_config.get("bot_id") or hashlib.sha1(bot_config["webhook_url"].encode()).hexdigest()[:12]
     
     async def send(
         self,
-        config: Dict[str, Any],
+        config: ChannelConfig,
         recipient: str,
         content: str,
         subject: Optional[str] = None,
@@ -38,7 +64,7 @@ class GroupBotSender:
         发送消息到群机器人
         
         Args:
-            config: 渠道配置
+            config: 渠道配置（原始配置如下，按 group_id 预建了索引）
                 {
                     "bots": [
                         {
@@ -59,12 +85,7 @@ class GroupBotSender:
         """
         try:
             # 查找对应的群机器人配置
-            bot_config = None
-            for bot in config.get("bots", []):
-                if bot["group_id"] == recipient:
-                    bot_config = bot
-                    break
-            
+            bot_config = config.bot_for_group(recipient)
             if not bot_config:
                 raise ValueError(f"未找到群ID对应的机器人配置: {recipient}")
             
@@ -78,20 +99,23 @@ class GroupBotSender:
                 }
             }
             
-            # 发送HTTP请求
-            async with aiohttp.ClientSession() as session:
-                async with session.post(webhook_url, json=message_body) as response:
-                    result = await response.json()
-                    
-                    if result.get("errcode") != 0:
-                        raise Exception(f"群机器人返回错误: {result.get('errmsg')}")
-                    
-                    logger.info(f"群机器人消息发送成功: group_id={recipient}")
-                    
-                    return {
-                        "success": True,
-                        "response": result
-                    }
+            # 发送HTTP请求（复用共享连接池）
+            response = await self.http_client.post(webhook_url, json=message_body)
+            if response.status_code == 429:
+                raise UpstreamThrottled("群机器人返回 HTTP 429", retry_after=GROUP_BOT_THROTTLE_PAUSE)
+            result = response.json()
+            
+            if result.get("errcode") == WEWORK_FREQ_LIMIT_ERRCODE:
+                raise UpstreamThrottled(f"群机器人限频: {result.get('errmsg')}", retry_after=GROUP_BOT_THROTTLE_PAUSE)
+            if result.get("errcode") != 0:
+                raise Exception(f"群机器人返回错误: {result.get('errmsg')}")
+            
+            logger.info(f"群机器人消息发送成功: group_id={recipient}")
+            
+            return {
+                "success": True,
+                "response": result
+            }
         
         except Exception as e:
             logger.error(f"群机器人消息发送失败: {e}")
@@ -2,13 +2,16 @@
 import logging
 from typing import Dict, Any, Optional
 
+from app.services.http_client_service import get_http_client
+
 logger = logging.getLogger(__name__)
 
 class SMSSender:
     def __init__(self, db_pool):
         self.db = db_pool
+        self.http_client = get_http_client("sms")
     
-    async def send(self, config: Dict, Any], recipient: str, content: str,
+    async def send(self, config: Dict[str, Any], recipient: str, content: str,
                    subject: Optional[str] = None, metadata: Optional[Dict] = None) -> Dict[str, Any]:
         """发送短信"""
         logger.info(f"短信: recipient={recipient}")
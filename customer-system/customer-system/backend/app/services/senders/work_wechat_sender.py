@@ -2,11 +2,14 @@
 import logging
 from typing import Dict, Any, Optional
 
+from app.services.http_client_service import get_http_client
+
 logger = logging.getLogger(__name__)
 
 class WorkWechatSender:
     def __init__(self, db_pool):
         self.db = db_pool
+        self.http_client = get_http_client("wework")
     
     async def send(self, config: Dict[str, Any], recipient: str, content: str, 
                    subject: Optional[str] = None, metadata: Optional[Dict] = None) -> Dict[str, Any]:
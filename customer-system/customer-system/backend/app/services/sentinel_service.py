@@ -1,16 +1,130 @@
 """
 Sentinel限流服务
 实现QPS限流、并发线程数限流
+
+- TokenBucketLimiter：本地令牌桶 + Redis 批量租约（@rate_limit 使用）
+  每个 worker 一次从 Redis 租一批令牌，之后在进程内放行，不产生网络I/O；
+  Redis 不可用时退化为纯本地令牌桶
+- QPSRateLimiter / ConcurrentLimiter / SlidingWindowLimiter：同步Redis实现，
+  Lua 脚本注册一次后通过 EVALSHA 执行
 """
+import os
 import time
+import asyncio
 import redis
-from typing import Optional
+from typing import Any, Dict, Optional
 import logging
 from functools import wraps
 from datetime import datetime, timedelta
 
+from app.services.metrics import MetricFamily, metrics
+
 logger = logging.getLogger(__name__)
 
+# 每次从 Redis 租用的令牌数 = max_qps × 比例（至少 1 个）
+RATE_LIMIT_LEASE_RATIO = float(os.getenv("RATE_LIMIT_LEASE_RATIO", "0.1"))
+# 租到的令牌在本地的有效期（毫秒），过期未用完的令牌作废
+RATE_LIMIT_LEASE_TTL_MS = int(os.getenv("RATE_LIMIT_LEASE_TTL_MS", "1000"))
+# Redis 异常后多久再尝试（秒），期间使用纯本地令牌桶
+RATE_LIMIT_REDIS_RETRY = float(os.getenv("RATE_LIMIT_REDIS_RETRY", "5"))
+# 纯本地模式下按 worker 数平分配额（与部署的 worker 数一致时总量不超限）
+RATE_LIMIT_LOCAL_WORKERS = max(1, int(os.getenv("RATE_LIMIT_LOCAL_WORKERS", "1")))
+
+
+# ==================== Lua 脚本 ====================
+    
+# 全局令牌桶：按流逝时间补充令牌（上限 burst），一次发放最多 requested 个
+TOKEN_LEASE_SCRIPT = """
+local key = KEYS[1]
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+    
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+        
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+        
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', key, math.ceil(burst / rate * 1000) + 1000)
+return granted
+"""
+
+QPS_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local max_qps = tonumber(ARGV[1])
+local current_second = tonumber(ARGV[2])
+local window_size = tonumber(ARGV[3])
+            
+-- 清理过期数据
+redis.call('ZREMRANGEBYSCORE', key, 0, current_second - window_size)
+            
+-- 获取当前窗口内的请求数
+local current_qps = redis.call('ZCARD', key)
+            
+if current_qps < max_qps then
+    -- 允许通过，记录请求
+    redis.call('ZADD', key, current_second, current_second .. ':' .. math.random())
+    redis.call('EXPIRE', key, window_size + 1)
+    return 1
+else
+    -- 拒绝请求
+    return 0
+end
+"""
+            
+CONCURRENT_SCRIPT = """
+local key = KEYS[1]
+local max_concurrent = tonumber(ARGV[1])
+local request_id = ARGV[2]
+local current_time = tonumber(ARGV[3])
+
+-- 清理过期请求（超过60秒）
+redis.call('ZREMRANGEBYSCORE', key, 0, current_time - 60)
+
+-- 获取当前并发数
+local current_concurrent = redis.call('ZCARD', key)
+
+if current_concurrent < max_concurrent then
+    -- 允许通过，记录请求
+    redis.call('ZADD', key, current_time, request_id)
+    redis.call('EXPIRE', key, 61)
+    return 1
+else
+    -- 拒绝请求
+    return 0
+end
+"""
+
+SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local max_requests = tonumber(ARGV[1])
+local window_start = tonumber(ARGV[2])
+local current_time = tonumber(ARGV[3])
+
+-- 清理窗口外的数据
+redis.call('ZREMRANGEBYSCORE', key, 0, window_start)
+
+-- 获取窗口内的请求数
+local request_count = redis.call('ZCARD', key)
+
+if request_count < max_requests then
+    -- 允许通过
+    redis.call('ZADD', key, current_time, current_time)
+    redis.call('EXPIRE', key, ARGV[4])
+    return 1
+else
+    -- 拒绝
+    return 0
+end
+"""
+
 
 class RateLimiter:
     """限流器基类"""
@@ -18,6 +132,10 @@ class RateLimiter:
     def __init__(self, redis_client: redis.Redis):
         self.redis = redis_client
     
+    def _register(self, script: str):
+        """注册 Lua 脚本（调用时走 EVALSHA，Redis 中没有缓存时自动 SCRIPT LOAD）"""
+        return self.redis.register_script(script) if self.redis is not None else None
+    
     def is_allowed(self, resource: str, **kwargs) -> bool:
         """检查是否允许通过"""
         raise NotImplementedError
@@ -35,6 +153,7 @@ class QPSRateLimiter(RateLimiter):
         super().__init__(redis_client)
         self.max_qps = max_qps
         self.window_size = window_size  # 窗口大小（秒）
+        self._script = self._register(QPS_WINDOW_SCRIPT)
     
     def is_allowed(self, resource: str, user_id: Optional[str] = None) -> bool:
         """检查QPS是否超限"""
@@ -48,36 +167,9 @@ class QPSRateLimiter(RateLimiter):
         
         try:
             # 使用Lua脚本实现原子性操作
-            lua_script = """
-            local key = KEYS[1]
-            local max_qps = tonumber(ARGV[1])
-            local current_second = tonumber(ARGV[2])
-            local window_size = tonumber(ARGV[3])
-            
-            -- 清理过期数据
-            redis.call('ZREMRANGEBYSCORE', key, 0, current_second - window_size)
-            
-            -- 获取当前窗口内的请求数
-            local current_qps = redis.call('ZCARD', key)
-            
-            if current_qps < max_qps then
-                -- 允许通过，记录请求
-                redis.call('ZADD', key, current_second, current_second .. ':' .. math.random())
-                redis.call('EXPIRE', key, window_size + 1)
-                return 1
-            else
-                -- 拒绝请求
-                return 0
-            end
-            """
-            
-            result = self.redis.eval(
-                lua_script,
-                1,
-                key,
-                self.max_qps,
-                current_second,
-                self.window_size
+            result = self._script(
+                keys=[key],
+                args=[self.max_qps, current_second, self.window_size]
             )
             
             if result == 0:
@@ -102,6 +194,7 @@ class ConcurrentLimiter(RateLimiter):
     ):
         super().__init__(redis_client)
         self.max_concurrent = max_concurrent
+        self._script = self._register(CONCURRENT_SCRIPT)
     
     def is_allowed(self, resource: str, request_id: str) -> bool:
         """检查并发数是否超限"""
@@ -109,36 +202,9 @@ class ConcurrentLimiter(RateLimiter):
         
         try:
             # 使用Lua脚本
-            lua_script = """
-            local key = KEYS[1]
-            local max_concurrent = tonumber(ARGV[1])
-            local request_id = ARGV[2]
-            local current_time = tonumber(ARGV[3])
-            
-            -- 清理过期请求（超过60秒）
-            redis.call('ZREMRANGEBYSCORE', key, 0, current_time - 60)
-            
-            -- 获取当前并发数
-            local current_concurrent = redis.call('ZCARD', key)
-            
-            if current_concurrent < max_concurrent then
-                -- 允许通过，记录请求
-                redis.call('ZADD', key, current_time, request_id)
-                redis.call('EXPIRE', key, 61)
-                return 1
-            else
-                -- 拒绝请求
-                return 0
-            end
-            """
-            
-            result = self.redis.eval(
-                lua_script,
-                1,
-                key,
-                self.max_concurrent,
-                request_id,
-                int(time.time())
+            result = self._script(
+                keys=[key],
+                args=[self.max_concurrent, request_id, int(time.time())]
             )
             
             if result == 0:
@@ -173,6 +239,7 @@ class SlidingWindowLimiter(RateLimiter):
         super().__init__(redis_client)
         self.max_requests = max_requests
         self.window_seconds = window_seconds
+        self._script = self._register(SLIDING_WINDOW_SCRIPT)
     
     def is_allowed(self, resource: str, user_id: Optional[str] = None) -> bool:
         """滑动窗口限流"""
@@ -186,37 +253,9 @@ class SlidingWindowLimiter(RateLimiter):
         
         try:
             # Lua脚本
-            lua_script = """
-            local key = KEYS[1]
-            local max_requests = tonumber(ARGV[1])
-            local window_start = tonumber(ARGV[2])
-            local current_time = tonumber(ARGV[3])
-            
-            -- 清理窗口外的数据
-            redis.call('ZREMRANGEBYSCORE', key, 0, window_start)
-            
-            -- 获取窗口内的请求数
-            local request_count = redis.call('ZCARD', key)
-            
-            if request_count < max_requests then
-                -- 允许通过
-                redis.call('ZADD', key, current_time, current_time)
-                redis.call('EXPIRE', key, ARGV[4])
-                return 1
-            else
-                -- 拒绝
-                return 0
-            end
-            """
-            
-            result = self.redis.eval(
-                lua_script,
-                1,
-                key,
-                self.max_requests,
-                window_start,
-                current_time,
-                self.window_seconds + 1
+            result = self._script(
+                keys=[key],
+                args=[self.max_requests, window_start, current_time, self.window_seconds + 1]
             )
             
             if result == 0:
@@ -233,28 +272,241 @@ class SlidingWindowLimiter(RateLimiter):
             return True
 
 
+# ==================== 本地令牌桶 + Redis 租约 ====================
+
+class _LocalBucket:
+    """单个资源在本进程内的令牌桶"""
+    
+    __slots__ = ("tokens", "updated_at", "expires_at", "empty_until", "lock")
+    
+    def __init__(self):
+        self.tokens = 0.0
+        # 初始为 0：首次进入纯本地模式时桶是满的
+        self.updated_at = 0.0
+        self.expires_at = 0.0
+        self.empty_until = 0.0
+        self.lock = asyncio.Lock()
+
+
+class TokenBucketLimiter:
+    """
+    令牌桶限流器（异步）
+    
+    - 全局令牌桶保存在 Redis（速率 max_qps/秒，容量 burst），每个 worker 一次租 lease_size 个
+    - 放行只扣本地令牌；本地用完才访问 Redis，同一资源同时只有一个租约请求在途
+    - 全局令牌不足时，在补足一批令牌所需的时间内直接本地拒绝，不再访问 Redis
+    - 没有 Redis 或 Redis 异常时使用纯本地令牌桶（速率 max_qps / RATE_LIMIT_LOCAL_WORKERS）
+    """
+    
+    def __init__(
+        self,
+        max_qps: float = 100,
+        burst: Optional[float] = None,
+        redis_client=None,
+        lease_ratio: float = RATE_LIMIT_LEASE_RATIO,
+        lease_ttl_ms: int = RATE_LIMIT_LEASE_TTL_MS,
+        key_prefix: str = "rate_limit:bucket"
+    ):
+        """
+        初始化
+        
+        Args:
+            max_qps: 全局每秒令牌数
+            burst: 桶容量，默认等于 max_qps（1 秒的量）
+            redis_client: 异步Redis客户端，默认使用 app.database.get_async_redis()
+            lease_ratio: 每次租约的令牌数占 max_qps 的比例
+            lease_ttl_ms: 租到的令牌在本地的有效期（毫秒）
+            key_prefix: Redis 键前缀
+        """
+        self.max_qps = max_qps
+        self.burst = burst or max_qps
+        self.lease_size = max(1, int(max_qps * lease_ratio))
+        self.lease_ttl = lease_ttl_ms / 1000
+        self.key_prefix = key_prefix
+        self.local_rate = max_qps / RATE_LIMIT_LOCAL_WORKERS
+        
+        self._redis = redis_client
+        self._redis_resolved = redis_client is not None
+        self._script = None
+        self._redis_down_until = 0.0
+        self._buckets: Dict[str, _LocalBucket] = {}
+        
+        self.stats = {
+            "allowed": 0, "rejected": 0, "leases": 0, "leased_tokens": 0,
+            "expired_tokens": 0, "redis_errors": 0, "local_decisions": 0
+        }
+    
+    def _get_script(self):
+        """首次租约时取Redis客户端并注册脚本；没有Redis返回 None"""
+        if not self._redis_resolved:
+            from app.database import get_async_redis
+            self._redis = get_async_redis()
+            self._redis_resolved = True
+        if self._script is None and self._redis is not None:
+            self._script = self._redis.register_script(TOKEN_LEASE_SCRIPT)
+        return self._script
+    
+    def _get_bucket(self, key: str) -> _LocalBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _LocalBucket()
+        return bucket
+    
+    def _take(self, bucket: _LocalBucket, now: float) -> bool:
+        if bucket.tokens >= 1:
+            if now < bucket.expires_at:
+                bucket.tokens -= 1
+                return True
+            # 租约过期，剩余令牌作废（已从全局桶扣除，不能再使用）
+            self.stats["expired_tokens"] += int(bucket.tokens)
+            bucket.tokens = 0.0
+        return False
+    
+    def _take_local(self, bucket: _LocalBucket, now: float) -> bool:
+        """纯本地令牌桶"""
+        self.stats["local_decisions"] += 1
+        elapsed = max(0.0, now - bucket.updated_at)
+        # 从租约模式切换过来时，桶里的租约令牌按本地桶继续使用
+        bucket.tokens = min(self.burst / RATE_LIMIT_LOCAL_WORKERS, bucket.tokens + elapsed * self.local_rate)
+        bucket.updated_at = now
+        bucket.expires_at = float("inf")
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return True
+        return False
+    
+    async def _lease(self, key: str) -> Optional[int]:
+        """从全局桶租一批令牌，Redis 不可用返回 None"""
+        script = self._get_script()
+        if script is None or time.monotonic() < self._redis_down_until:
+            return None
+        
+        try:
+            granted = await script(
+                keys=[f"{self.key_prefix}:{key}"],
+                args=[self.max_qps, self.burst, self.lease_size]
+            )
+        except Exception as e:
+            self.stats["redis_errors"] += 1
+            self._redis_down_until = time.monotonic() + RATE_LIMIT_REDIS_RETRY
+            logger.warning(f"[限流] Redis租约失败，{RATE_LIMIT_REDIS_RETRY}s 内使用本地令牌桶: {e}")
+            return None
+        
+        self.stats["leases"] += 1
+        self.stats["leased_tokens"] += int(granted)
+        return int(granted)
+    
+    async def _acquire(self, key: str) -> bool:
+        bucket = self._get_bucket(key)
+        now = time.monotonic()
+        
+        # 快速路径：本地还有令牌
+        if self._take(bucket, now):
+            return True
+        if now < bucket.empty_until:
+            return False
+        if (self._redis_resolved and self._redis is None) or now < self._redis_down_until:
+            return self._take_local(bucket, now)
+        
+        async with bucket.lock:
+            # 等锁期间其他请求可能已经租到令牌
+            now = time.monotonic()
+            if self._take(bucket, now):
+                return True
+            if now < bucket.empty_until:
+                return False
+            
+            granted = await self._lease(key)
+            now = time.monotonic()
+            if granted is None:
+                return self._take_local(bucket, now)
+            
+            if granted == 0:
+                # 全局令牌耗尽：补足一批令牌之前直接本地拒绝
+                bucket.empty_until = now + self.lease_size / self.max_qps
+                return False
+            
+            bucket.tokens = float(granted)
+            bucket.updated_at = now
+            bucket.expires_at = now + self.lease_ttl
+            return self._take(bucket, now)
+    
+    async def acquire(self, key: str) -> bool:
+        """
+        申请一个令牌
+        
+        Args:
+            key: 限流资源（如 "api:/messages/send"，按用户限流时带上用户ID）
+        
+        Returns:
+            是否放行
+        """
+        allowed = await self._acquire(key)
+        if allowed:
+            self.stats["allowed"] += 1
+        else:
+            self.stats["rejected"] += 1
+        return allowed
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计"""
+        return {
+            **self.stats,
+            "max_qps": self.max_qps,
+            "burst": self.burst,
+            "lease_size": self.lease_size,
+            "mode": "local" if self._redis_resolved and self._redis is None else "lease"
+        }
+
+
+# @rate_limit 创建的限流器（resource → limiter）
+_route_limiters: Dict[str, TokenBucketLimiter] = {}
+
+
+def get_rate_limit_stats() -> Dict[str, Any]:
+    """获取 @rate_limit 限流器统计"""
+    return {resource: limiter.get_stats() for resource, limiter in _route_limiters.items()}
+
+
+def _collect_rate_limit_metrics():
+    decisions = MetricFamily(
+        "rate_limit_requests_total", "counter", "@rate_limit 放行/拒绝次数", ("resource", "result")
+    )
+    leases = MetricFamily(
+        "rate_limit_leases_total", "counter", "@rate_limit 向 Redis 租用令牌的次数", ("resource",)
+    )
+    for resource, limiter in list(_route_limiters.items()):
+        decisions.add(limiter.stats["allowed"], resource, "allowed")
+        decisions.add(limiter.stats["rejected"], resource, "rejected")
+        leases.add(limiter.stats["leases"], resource)
+    return [decisions, leases]
+
+
+metrics.register_collector("rate_limit", _collect_rate_limit_metrics)
+
+
 def rate_limit(
     resource: str,
     max_qps: int = 100,
-    redis_client: Optional[redis.Redis] = None
+    redis_client=None
 ):
-    """限流装饰器"""
+    """
+    限流装饰器（令牌桶，放行判断不访问网络）
+    
+    Args:
+        resource: 限流资源名
+        max_qps: 全局每秒请求数上限
+        redis_client: 异步Redis客户端，默认使用 app.database.get_async_redis()
+    """
+    limiter = TokenBucketLimiter(max_qps, redis_client=redis_client)
+    _route_limiters[resource] = limiter
+    
     def decorator(func):
         @wraps(func)
         async def wrapper(*args, **kwargs):
-            # 获取Redis客户端
-            if redis_client is None:
-                # 从全局获取
-                from app.database import redis_client as rc
-                client = rc
-            else:
-                client = redis_client
-            
-            # 创建限流器
-            limiter = QPSRateLimiter(client, max_qps)
-            
             # 检查限流
-            if not limiter.is_allowed(resource):
+            if not await limiter.acquire(resource):
+                logger.warning(f"[限流] QPS超限: {resource} (max={max_qps})")
                 from fastapi import HTTPException
                 raise HTTPException(
                     status_code=429,
@@ -294,11 +546,14 @@ sliding_limiter = SlidingWindowLimiter(redis_client, max_requests=1000, window_s
 if sliding_limiter.is_allowed("api:/query", user_id="user_123"):
     query_data()
 
-# 方式2：装饰器
-from app.database import redis_client
+# 令牌桶（异步，本地放行）
+bucket_limiter = TokenBucketLimiter(max_qps=100)
+if await bucket_limiter.acquire("api:/query:user_123"):
+    await query_data()
 
+# 方式2：装饰器
 @router.post("/api/send-message")
-@rate_limit(resource="api:/send_message", max_qps=100, redis_client=redis_client)
+@rate_limit(resource="api:/send_message", max_qps=100)
 async def send_message():
     # 业务逻辑
     pass
@@ -343,4 +598,5 @@ class SentinelManager:
                 "type": type(limiter).__name__,
                 "config": getattr(limiter, 'max_qps', None) or getattr(limiter, 'max_concurrent', None)
             }
+        stats["routes"] = get_rate_limit_stats()
         return stats
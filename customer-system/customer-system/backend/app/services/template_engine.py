@@ -0,0 +1,208 @@
+"""
+消息模板编译引擎
+Compiled Template Engine
+
+功能：
+- 模板只解析一次，编译为「文本片段 + 变量」列表
+- 单次遍历完成渲染，不再对每个变量做整串替换
+- 统一支持 {key}、${key}、{{key}} 三种占位符
+- 编译结果按（模板ID, 版本）缓存在LRU中
+"""
+
+from typing import Dict, List, Optional, Any, Hashable, Tuple
+from collections import OrderedDict
+import os
+import re
+import threading
+
+from app.services.metrics import MetricFamily, metrics
+
+# 占位符：${key} | {{key}} | {key}（顺序决定匹配优先级）
+PLACEHOLDER_PATTERN = re.compile(
+    r'\$\{([a-zA-Z_][a-zA-Z0-9_]*)\}'
+    r'|\{\{\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*\}\}'
+    r'|\{([a-zA-Z_][a-zA-Z0-9_]*)\}'
+)
+
+# 编译缓存容量
+TEMPLATE_CACHE_SIZE = int(os.getenv("TEMPLATE_CACHE_SIZE", "512"))
+
+_MISSING = object()
+
+
+class CompiledTemplate:
+    """编译后的模板"""
+    
+    __slots__ = ("source", "_head", "_fields", "variables")
+    
+    def __init__(self, source: str):
+        """
+        解析模板
+        
+        Args:
+            source: 模板内容，如 "您好，{customer_name}！"
+        """
+        self.source = source
+        
+        # _head 为第一个占位符之前的文本
+        # _fields 为 (变量名, 占位符原文, 其后的文本) 列表
+        fields: List[Tuple[str, str, str]] = []
+        position = 0
+        head = None
+        
+        for match in PLACEHOLDER_PATTERN.finditer(source):
+            literal = source[position:match.start()]
+            if head is None:
+                head = literal
+            else:
+                name, raw, _ = fields[-1]
+                fields[-1] = (name, raw, literal)
+            
+            name = match.group(1) or match.group(2) or match.group(3)
+            fields.append((name, match.group(0), ""))
+            position = match.end()
+        
+        tail = source[position:]
+        if head is None:
+            head = tail
+        else:
+            name, raw, _ = fields[-1]
+            fields[-1] = (name, raw, tail)
+        
+        self._head = head
+        self._fields = tuple(fields)
+        
+        # 去重并保持出现顺序
+        self.variables = list(dict.fromkeys(name for name, _, _ in fields))
+    
+    def render(self, variables: Dict[str, Any]) -> str:
+        """
+        渲染模板（未提供的变量保留占位符原文）
+        
+        Args:
+            variables: 变量字典
+        
+        Returns:
+            渲染后的内容
+        """
+        if not self._fields:
+            return self._head
+        
+        parts = [self._head]
+        append = parts.append
+        get = variables.get
+        
+        for name, raw, literal in self._fields:
+            value = get(name, _MISSING)
+            append(raw if value is _MISSING else str(value))
+            append(literal)
+        
+        return "".join(parts)
+
+
+class TemplateCache:
+    """编译模板LRU缓存"""
+    
+    def __init__(self, max_size: int = TEMPLATE_CACHE_SIZE):
+        self.max_size = max_size
+        self._items: "OrderedDict[Hashable, CompiledTemplate]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, source: str, cache_key: Optional[Hashable] = None) -> CompiledTemplate:
+        """
+        获取编译后的模板（未命中时编译并缓存）
+        
+        Args:
+            source: 模板内容
+            cache_key: 缓存键，通常为 (模板ID, 版本)；为空时以模板内容为键
+        
+        Returns:
+            编译后的模板
+        """
+        key = cache_key if cache_key is not None else source
+        
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is not None and compiled.source == source:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return compiled
+        
+        compiled = CompiledTemplate(source)
+        
+        with self._lock:
+            self.misses += 1
+            self._items[key] = compiled
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+        
+        return compiled
+    
+    def clear(self):
+        """清空缓存（模板批量变更时调用）"""
+        with self._lock:
+            self._items.clear()
+    
+    def get_stats(self) -> Dict[str, int]:
+        """获取缓存统计"""
+        return {
+            "size": len(self._items),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# 全局模板缓存
+template_cache = TemplateCache()
+
+
+def _collect_template_cache_metrics():
+    return [
+        MetricFamily("cache_requests_total", "counter", "缓存查询次数（按命中层级）", ("cache", "result"))
+        .add(template_cache.hits, "template", "hit")
+        .add(template_cache.misses, "template", "miss"),
+        MetricFamily("cache_entries", "gauge", "进程内缓存条目数", ("cache",))
+        .add(len(template_cache._items), "template")
+    ]
+
+
+metrics.register_collector("template_cache", _collect_template_cache_metrics)
+
+
+def render_template(
+    source: str,
+    variables: Dict[str, Any],
+    template_id: Optional[int] = None,
+    version: Optional[Hashable] = None
+) -> str:
+    """
+    渲染模板
+    
+    Args:
+        source: 模板内容
+        variables: 变量字典
+        template_id: 模板ID（提供时按 (模板ID, 版本) 缓存编译结果）
+        version: 模板版本，通常为 updated_at
+    
+    Returns:
+        渲染后的内容
+    """
+    cache_key = (template_id, version) if template_id is not None else None
+    return template_cache.get(source, cache_key).render(variables)
+
+
+def extract_variables(source: str) -> List[str]:
+    """
+    提取模板中的变量
+    
+    Args:
+        source: 模板内容
+    
+    Returns:
+        变量列表（按出现顺序去重）
+    """
+    return list(template_cache.get(source).variables)
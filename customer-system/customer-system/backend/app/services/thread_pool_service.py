@@ -11,6 +11,8 @@ import logging
 from dataclasses import dataclass
 import time
 
+from app.services.metrics import MetricFamily, metrics
+
 logger = logging.getLogger(__name__)
 
 
@@ -238,6 +240,21 @@ class ThreadPoolManager:
 thread_pool_manager = ThreadPoolManager()
 
 
+def _collect_thread_pool_metrics():
+    active = MetricFamily("thread_pool_active", "gauge", "线程池正在执行的任务数", ("pool",))
+    queued = MetricFamily("thread_pool_queue_size", "gauge", "线程池排队任务数", ("pool",))
+    tasks = MetricFamily("thread_pool_tasks_total", "counter", "线程池任务数（completed/rejected）", ("pool", "result"))
+    for name, m in thread_pool_manager.get_all_metrics().items():
+        active.add(m.active_count, name)
+        queued.add(m.queue_size, name)
+        tasks.add(m.completed_tasks, name, "completed")
+        tasks.add(m.rejected_tasks, name, "rejected")
+    return [active, queued, tasks]
+
+
+metrics.register_collector("thread_pool", _collect_thread_pool_metrics)
+
+
 # 预定义线程池
 def init_default_pools():
     """初始化默认线程池"""
@@ -15,6 +15,7 @@ from ..models import Project, Customer
 from ..utils.wechat_work_api import WeChatWorkAPI
 from ..services.secure_link_service import SecureLinkService
 from ..services.customer_transfer_service import CustomerTransferService
+from ..services.intent_engine import intent_engine
 import re
 import os
 
@@ -57,7 +58,7 @@ class TicketInteractionService:
                 db, message, from_user_id, from_user_name, wechat_api
             )
         
-        elif '已解决' in message or '已处理' in message or '已修复' in message:
+        elif intent_engine.classify(message, "ticket_reply").intent in ('resolved', 'processed'):
             # 这是对工单的回复，尝试解析并更新状态
             return await TicketInteractionService._handle_ticket_reply(
                 db, message, from_user_id, from_user_name, chat_id, wechat_api
@@ -514,7 +515,8 @@ class TicketInteractionService:
                 }
             
             # 更新状态
-            if '已解决' in message or '已修复' in message:
+            reply_intent = intent_engine.classify(message, "ticket_reply").intent
+            if reply_intent == 'resolved':
                 ticket.status = 'resolved'
                 ticket.progress = 100
                 status_text = "已解决"
@@ -531,12 +533,12 @@ class TicketInteractionService:
                     except Exception as e:
                         print(f"⚠️ 客户转回失败：{str(e)}")
                 
-            elif '已处理' in message:
+            elif reply_intent == 'processed':
                 ticket.status = 'processing'
                 ticket.progress = 80
                 status_text = "处理中"
                 transfer_back_result = None
-            elif '升级' in message:
+            elif reply_intent == 'escalated':
                 ticket.status = 'escalated'
                 status_text = "已升级"
                 transfer_back_result = None
@@ -3,6 +3,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from app.models import Project, Customer
 from app.services.conversation_state import conversation_state
 from app.services.secure_link_service import SecureLinkService
+from app.services.intent_engine import intent_engine
 from app.utils.wechat_work_api import WeChatWorkAPI, GroupBotAPI
 import re
 import os
@@ -28,8 +29,10 @@ class TicketService:
         # 获取当前对话状态
         state = conversation_state.get_state(user_id)
         
-        # 1. 识别关键词
-        if any(keyword in message for keyword in ['售后', '维修', '坏了', '不工作', '问题']):
+        # 1. 识别关键词（一次扫描，见 intent_engine 的 ticket 意图集合）
+        intent = intent_engine.classify(message, "ticket").intent
+        
+        if intent == 'aftersale':
             if not state or state['intent'] != 'aftersale':
                 # 开始售后流程
                 conversation_state.set_state(user_id, 'aftersale', {})
@@ -88,7 +91,7 @@ class TicketService:
                     }
         
         # 2. 识别售前咨询
-        elif any(keyword in message for keyword in ['售前', '咨询', '购买', '价格', '报价']):
+        elif intent == 'presale':
             if not state or state['intent'] != 'presale':
                 conversation_state.set_state(user_id, 'presale', {})
                 return {
@@ -120,7 +123,7 @@ class TicketService:
                     }
         
         # 3. 查询进度
-        elif any(keyword in message for keyword in ['进度', '状态', '怎么样了', '到哪了']):
+        elif intent == 'query':
             phone = extract_phone(message)
             if phone:
                 # 查询项目
@@ -0,0 +1,368 @@
+"""
+分布式链路追踪（OpenTelemetry）
+
+覆盖消息链路：HTTP 请求 → RabbitMQ 发布 → 消费者 → 模板渲染 / 数据库 / 渠道发送 → 上游HTTP调用
+- 追踪上下文通过 W3C traceparent 头在 HTTP 和 RabbitMQ 消息头中传递
+- 导出器由 TRACING_EXPORTER 选择：none（默认，不采集）/ otlp / console / file / memory
+  otlp 使用标准环境变量 OTEL_EXPORTER_OTLP_ENDPOINT 等；file 写入 TRACING_FILE_PATH（每行一个 span）；
+  memory 只保存在进程内（测试用，get_finished_spans() 读取）
+- 未安装 opentelemetry-api / opentelemetry-sdk 或未启用时，所有埋点都是空操作
+"""
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+try:
+    from opentelemetry import propagate
+    from opentelemetry import trace as otel_trace
+    from opentelemetry.trace import SpanKind, Status, StatusCode
+    OTEL_AVAILABLE = True
+except ImportError:  # 链路追踪为可选功能
+    OTEL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "customer-system")
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "./traces.jsonl")
+
+# SQL 语句记录的最大长度（不记录参数）
+_MAX_STATEMENT_LENGTH = 1000
+
+_tracer = None
+_provider = None
+_memory_exporter = None
+
+
+# ==================== 空操作（未启用时） ====================
+
+class _NoopSpan:
+    """未启用追踪时返回的 span，所有方法为空操作"""
+    
+    def set_attribute(self, key: str, value: Any):
+        pass
+    
+    def set_attributes(self, attributes: Dict[str, Any]):
+        pass
+    
+    def add_event(self, name: str, attributes: Optional[Dict[str, Any]] = None):
+        pass
+    
+    def record_exception(self, exception: BaseException):
+        pass
+    
+    def set_status(self, *args, **kwargs):
+        pass
+    
+    def update_name(self, name: str):
+        pass
+    
+    def end(self):
+        pass
+
+
+class _NoopSpanContext:
+    def __enter__(self):
+        return _NOOP_SPAN
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+_NOOP_SPAN_CONTEXT = _NoopSpanContext()
+
+
+# ==================== 初始化 ====================
+
+def _build_exporter(name: str):
+    if name == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return OTLPSpanExporter()
+    if name == "console":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter()
+    if name == "file":
+        from opentelemetry.sdk.trace.export import ConsoleSpanExporter
+        return ConsoleSpanExporter(
+            out=open(TRACING_FILE_PATH, "a", encoding="utf-8"),
+            formatter=lambda span: json.dumps(json.loads(span.to_json()), ensure_ascii=False) + "\n"
+        )
+    if name == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+        return InMemorySpanExporter()
+    raise ValueError(f"未知的 TRACING_EXPORTER: {name}")
+
+
+def setup_tracing(service_name: Optional[str] = None, exporter: Optional[str] = None) -> bool:
+    """
+    初始化链路追踪（进程启动时调用一次）
+    
+    Args:
+        service_name: 服务名，默认 OTEL_SERVICE_NAME
+        exporter: 导出器，默认 TRACING_EXPORTER
+    
+    Returns:
+        是否已启用
+    """
+    global _tracer, _provider, _memory_exporter
+    
+    exporter = (exporter or TRACING_EXPORTER).lower()
+    if exporter == "none" or _tracer is not None:
+        return _tracer is not None
+    if not OTEL_AVAILABLE:
+        logger.warning("[链路追踪] 未安装 opentelemetry-api / opentelemetry-sdk，链路追踪未启用")
+        return False
+    
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor, SimpleSpanProcessor
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+        
+        span_exporter = _build_exporter(exporter)
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": service_name or TRACING_SERVICE_NAME}),
+            sampler=ParentBased(TraceIdRatioBased(TRACING_SAMPLE_RATIO))
+        )
+        # 内存导出器同步写入，测试中 span 结束即可读取；其他导出器后台批量发送
+        processor = SimpleSpanProcessor if exporter == "memory" else BatchSpanProcessor
+        provider.add_span_processor(processor(span_exporter))
+    except Exception as e:
+        logger.error(f"[链路追踪] 初始化失败，链路追踪未启用: {e}")
+        return False
+    
+    _provider = provider
+    _memory_exporter = span_exporter if exporter == "memory" else None
+    _tracer = provider.get_tracer("app.services.tracing")
+    logger.info(f"[链路追踪] 已启用 (exporter={exporter}, service={service_name or TRACING_SERVICE_NAME})")
+    return True
+
+
+def shutdown_tracing():
+    """导出剩余的 span 并关闭（进程退出时调用）"""
+    global _tracer, _provider, _memory_exporter
+    
+    if _provider is not None:
+        try:
+            _provider.shutdown()
+        except Exception as e:
+            logger.error(f"[链路追踪] 关闭失败: {e}")
+    _tracer = None
+    _provider = None
+    _memory_exporter = None
+
+
+def is_enabled() -> bool:
+    """是否已启用链路追踪"""
+    return _tracer is not None
+
+
+def get_finished_spans() -> List[Any]:
+    """memory 导出器中已结束的 span（测试用）"""
+    return list(_memory_exporter.get_finished_spans()) if _memory_exporter is not None else []
+
+
+# ==================== span 与上下文传递 ====================
+
+_SPAN_KINDS = {
+    "internal": "INTERNAL",
+    "server": "SERVER",
+    "client": "CLIENT",
+    "producer": "PRODUCER",
+    "consumer": "CONSUMER"
+}
+
+
+def start_span(
+    name: str,
+    kind: str = "internal",
+    attributes: Optional[Dict[str, Any]] = None,
+    context=None
+):
+    """
+    创建 span 并设为当前 span（with start_span(...) as span:）
+    
+    Args:
+        name: span 名称
+        kind: internal / server / client / producer / consumer
+        attributes: span 属性
+        context: 父上下文（extract_context 的返回值），默认使用当前上下文
+    
+    Returns:
+        上下文管理器；未启用时为空操作
+    """
+    if _tracer is None:
+        return _NOOP_SPAN_CONTEXT
+    return _tracer.start_as_current_span(
+        name,
+        context=context,
+        kind=getattr(SpanKind, _SPAN_KINDS.get(kind, "INTERNAL")),
+        attributes=attributes
+    )
+
+
+def inject_headers(headers: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """把当前追踪上下文写入消息头/请求头（traceparent），返回同一个字典"""
+    headers = {} if headers is None else headers
+    if _tracer is not None:
+        propagate.inject(headers)
+    return headers
+
+
+def extract_context(headers):
+    """从消息头/请求头读取上游追踪上下文，未启用时返回 None"""
+    if _tracer is None or not headers:
+        return None
+    return propagate.extract(headers)
+
+
+def current_trace_id() -> Optional[str]:
+    """当前 span 的 trace_id（32位十六进制），用于和日志、消息记录关联"""
+    if _tracer is None:
+        return None
+    span_context = otel_trace.get_current_span().get_span_context()
+    return f"{span_context.trace_id:032x}" if span_context.is_valid else None
+
+
+def _mark_error(span, error: BaseException):
+    span.record_exception(error)
+    span.set_status(Status(StatusCode.ERROR, str(error)))
+
+
+# ==================== HTTP ====================
+
+async def trace_http_request(request, call_next):
+    """
+    FastAPI HTTP 中间件：每个请求一个 SERVER span（app.middleware("http")(trace_http_request)）
+    """
+    if _tracer is None:
+        return await call_next(request)
+    
+    method = request.method
+    with start_span(
+        f"{method} {request.url.path}",
+        kind="server",
+        context=extract_context(request.headers),
+        attributes={"http.method": method, "http.target": request.url.path}
+    ) as span:
+        response = await call_next(request)
+        route = request.scope.get("route")
+        if route is not None and getattr(route, "path", None):
+            # 用路由模板命名，避免路径参数导致 span 名称过多
+            span.update_name(f"{method} {route.path}")
+            span.set_attribute("http.route", route.path)
+        span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            span.set_status(Status(StatusCode.ERROR))
+        return response
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """httpx 传输层包装：每次上游调用一个 CLIENT span，并在请求头中传递 traceparent"""
+    
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        if _tracer is None:
+            return await self._transport.handle_async_request(request)
+        
+        with start_span(
+            f"HTTP {request.method}",
+            kind="client",
+            attributes={
+                "http.method": request.method,
+                "server.address": request.url.host,
+                "url.path": request.url.path
+            }
+        ) as span:
+            propagate.inject(request.headers)
+            response = await self._transport.handle_async_request(request)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500 or response.status_code == 429:
+                span.set_status(Status(StatusCode.ERROR))
+            return response
+    
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+# ==================== 数据库 ====================
+
+def _db_span_name(statement: str) -> str:
+    return f"db {statement.lstrip().split(None, 1)[0].upper()}" if statement.strip() else "db"
+
+
+def instrument_engine(engine):
+    """
+    为 SQLAlchemy 引擎注册 span（ORM 会话和非 asyncpg 的原生SQL都经过这里）
+    
+    Args:
+        engine: AsyncEngine 或 Engine
+    """
+    from sqlalchemy import event
+    
+    sync_engine = getattr(engine, "sync_engine", engine)
+    db_system = sync_engine.dialect.name
+    
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if _tracer is None or context is None:
+            return
+        # AsyncEngine 在 greenlet 中执行同步代码，SQLAlchemy 会沿用调用方的 contextvars，父 span 正确
+        context._tracing_span = _tracer.start_span(
+            _db_span_name(statement),
+            kind=SpanKind.CLIENT,
+            attributes={"db.system": db_system, "db.statement": statement[:_MAX_STATEMENT_LENGTH]}
+        )
+    
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        span = getattr(context, "_tracing_span", None)
+        if span is not None:
+            span.end()
+            context._tracing_span = None
+    
+    @event.listens_for(sync_engine, "handle_error")
+    def _handle_error(exception_context):
+        context = exception_context.execution_context
+        span = getattr(context, "_tracing_span", None)
+        if span is not None:
+            _mark_error(span, exception_context.original_exception)
+            span.end()
+            context._tracing_span = None
+
+
+class TracedConnection:
+    """asyncpg 原生连接包装：查询方法各一个 span，其他属性直接转发"""
+    
+    _TRACED_METHODS = ("fetch", "fetchrow", "fetchval", "execute", "executemany")
+    
+    def __init__(self, conn, db_system: str = "postgresql"):
+        self._conn = conn
+        self._db_system = db_system
+    
+    def __getattr__(self, name: str):
+        attr = getattr(self._conn, name)
+        if name not in self._TRACED_METHODS:
+            return attr
+        
+        async def traced(query, *args, **kwargs):
+            with start_span(
+                _db_span_name(query),
+                kind="client",
+                attributes={"db.system": self._db_system, "db.statement": query[:_MAX_STATEMENT_LENGTH]}
+            ):
+                return await attr(query, *args, **kwargs)
+        
+        return traced
+
+
+def wrap_db_connection(conn, db_system: str = "postgresql"):
+    """启用追踪时返回带 span 的连接，否则原样返回"""
+    return TracedConnection(conn, db_system) if _tracer is not None else conn
@@ -12,9 +12,20 @@ Unified Message Sender Service
 from typing import Dict, List, Optional, Any
 from datetime import datetime
 from enum import Enum
+import asyncio
 import logging
 import json
+import os
 import re
+import time
+import uuid
+
+from app.database import db_pool as default_db_pool
+from app.services.channel_registry import ChannelConfig, ChannelRegistry, channel_registry
+from app.services.metrics import MESSAGE_SEND_DURATION, record_send
+from app.services.outbound_limiter import outbound_limiter
+from app.services.tracing import start_span
+from .template_engine import render_template, extract_variables
 
 logger = logging.getLogger(__name__)
 
@@ -53,30 +64,37 @@ CHANNEL_RECIPIENT_TYPE = {
     "WECHAT": "openid"  # 微信公众号OpenID
 }
 
+# 批量扇出发送参数
+BULK_CHUNK_SIZE = int(os.getenv("MESSAGE_BULK_CHUNK_SIZE", "500"))  # 每批写入的消息条数
+BULK_WORKER_COUNT = int(os.getenv("MESSAGE_BULK_WORKERS", "50"))  # 并发发送协程数
+
 
 class TemplateRenderer:
-    """模板渲染引擎"""
+    """模板渲染引擎（基于编译模板缓存）"""
     
     @staticmethod
-    def render(template_content: str, variables: Dict[str, Any]) -> str:
+    def render(
+        template_content: str,
+        variables: Dict[str, Any],
+        template_id: Optional[int] = None,
+        version: Optional[Any] = None
+    ) -> str:
         """
         渲染模板内容
         
         Args:
             template_content: 模板内容，如 "您好，{customer_name}！"
             variables: 变量字典，如 {"customer_name": "张三"}
+            template_id: 模板ID（可选，用于缓存编译结果）
+            version: 模板版本（可选，通常为 updated_at）
         
         Returns:
             渲染后的内容
         """
-        result = template_content
-        
-        for key, value in variables.items():
-            # 支持 {key} 和 ${key} 两种格式
-            result = result.replace(f"{{{key}}}", str(value))
-            result = result.replace(f"${{{key}}}", str(value))
-        
-        return result
+        # 支持 {key}、${key} 和 {{key}} 三种格式
+        attributes = {"template.id": template_id} if template_id is not None else None
+        with start_span("template.render", attributes=attributes):
+            return render_template(template_content, variables, template_id, version)
     
     @staticmethod
     def extract_variables(template_content: str) -> List[str]:
@@ -89,32 +107,27 @@ class TemplateRenderer:
         Returns:
             变量列表，如 ["customer_name", "project_name"]
         """
-        # 匹配 {key} 和 ${key} 格式
-        pattern = r'\{([a-zA-Z_][a-zA-Z0-9_]*)\}'
-        variables = re.findall(pattern, template_content)
-        
-        pattern2 = r'\$\{([a-zA-Z_][a-zA-Z0-9_]*)\}'
-        variables2 = re.findall(pattern2, template_content)
-        
-        return list(set(variables + variables2))
+        return extract_variables(template_content)
 
 
 class UnifiedMessageSender:
     """统一消息发送服务"""
     
-    def __init__(self, db_pool):
+    def __init__(self, db_pool=None):
         """
         初始化
         
         Args:
-            db_pool: 数据库连接池
+            db_pool: 数据库连接池，默认使用 app.database.db_pool（与 ORM 共用引擎）
         """
-        self.db = db_pool
+        self.db = db_pool or default_db_pool
+        # 渠道配置从内存注册表读取（使用默认连接池时共用全局注册表）
+        self.channels = channel_registry if db_pool is None else ChannelRegistry(db_pool)
         self.renderer = TemplateRenderer()
         
         # 延迟导入各渠道的发送器（避免循环导入）
         self._senders = {}
-    
+        
     def _get_sender(self, channel_type: str):
         """获取指定渠道的发送器"""
         if channel_type not in self._senders:
@@ -141,30 +154,73 @@ class UnifiedMessageSender:
         
         return self._senders[channel_type]
     
-    async def get_channel_config(self, channel_type: str) -> Dict[str, Any]:
+    async def _send_limited(
+        self,
+        channel_type: str,
+        config: ChannelConfig,
+        message: Dict[str, Any]
+    ) -> Dict[str, Any]:
         """
-        获取渠道配置
+        经外发限流闸门调用渠道发送器（按渠道和目的地排队、限速）
         
         Args:
             channel_type: 渠道类型
+            config: 渠道配置
+            message: 消息记录
         
         Returns:
-            配置数据
+            发送器返回的结果
         """
-        async with self.db.acquire() as conn:
-            row = await conn.fetchrow("""
-                SELECT config_data, is_enabled
-                FROM channel_configs
-                WHERE channel_type = $1
-            """, channel_type)
-            
-            if not row:
-                raise ValueError(f"渠道配置不存在: {channel_type}")
-            
-            if not row['is_enabled']:
-                raise ValueError(f"渠道已禁用: {channel_type}")
-            
-            return row['config_data']
+        sender = self._get_sender(channel_type)
+        recipient = message["recipient_value"]
+        
+        # 有多个上游目的地的渠道（如群机器人的各个 webhook）由发送器给出目的地标识
+        destination_key = getattr(sender, "destination_key", None)
+        destination = destination_key(config, recipient) if destination_key else None
+        
+        attributes = {"message.channel": str(channel_type)}
+        if destination is not None:
+            attributes["message.destination"] = str(destination)
+        duration = MESSAGE_SEND_DURATION.labels(channel_type)
+        
+        async def call():
+            # 只计上游调用本身，排队时间见 outbound_gate_wait_seconds_total
+            started = time.monotonic()
+            try:
+                return await sender.send(
+                    config=config,
+                    recipient=recipient,
+                    content=message["content"],
+                    subject=message.get("subject"),
+                    metadata=message.get("metadata")
+                )
+            finally:
+                duration.observe(time.monotonic() - started)
+        
+        # span 包含限流排队时间，HTTP 调用的 client span 挂在其下
+        success = False
+        try:
+            with start_span(f"message.send {channel_type}", attributes=attributes):
+                result = await outbound_limiter.run(channel_type, destination, call, config)
+            success = True
+            return result
+        finally:
+            record_send(channel_type, success)
+    
+    async def get_channel_config(self, channel_type: str) -> ChannelConfig:
+        """
+        获取渠道配置（内存注册表，按版本自动刷新）
+        
+        Args:
+            channel_type: 渠道类型
+        
+        Returns:
+            ChannelConfig（兼容 dict 的 get / [] 读取）
+        
+        Raises:
+            ValueError: 渠道配置不存在或已禁用
+        """
+        return await self.channels.get(channel_type)
     
     async def validate_recipient(self, channel_type: str, recipient_value: str) -> bool:
         """
@@ -268,6 +324,98 @@ class UnifiedMessageSender:
             
             return dict(row)
     
+    async def create_message_records_bulk(
+        self,
+        template_id: Optional[int],
+        channel_type: str,
+        recipients: List[Dict[str, Any]],
+        content: str,
+        subject: Optional[str] = None,
+        send_mode: str = SendMode.REALTIME,
+        scheduled_time: Optional[datetime] = None,
+        start_index: int = 0
+    ) -> List[Dict[str, Any]]:
+        """
+        批量创建消息记录（一条多行INSERT写入一批接收者）
+        
+        Args:
+            template_id: 模板ID
+            channel_type: 渠道类型
+            recipients: 接收者列表，格式同 send_from_template
+            content: 消息内容（同一批次内容相同）
+            subject: 主题（邮件）
+            send_mode: 发送模式
+            scheduled_time: 定时发送时间
+            start_index: 本批在整个发送任务中的起始序号（分批写入时传入偏移量）
+        
+        Returns:
+            消息记录列表（与 recipients 顺序一致）
+        """
+        if not recipients:
+            return []
+        
+        # 编号 = 时间 + 本次调用的随机段 + 客户ID + 全局序号：
+        # 同一秒内的多个批次、并发的多个批量发送（客户ID 都为空时）也不会重复
+        prefix = f"MSG{datetime.now().strftime('%Y%m%d%H%M%S')}{uuid.uuid4().hex[:8]}"
+        message_nos = []
+        recipient_values = []
+        customer_ids = []
+        metadatas = []
+        for index, recipient in enumerate(recipients):
+            customer_id = recipient.get("customer_id")
+            message_nos.append(f"{prefix}{customer_id or 0:06d}{start_index + index:06d}")
+            recipient_values.append(recipient["identifier"])
+            customer_ids.append(customer_id)
+            metadata = recipient.get("metadata")
+            metadatas.append(json.dumps(metadata) if metadata else None)
+        
+        recipient_type = CHANNEL_RECIPIENT_TYPE.get(channel_type)
+        
+        async with self.db.acquire() as conn:
+            rows = await conn.fetch("""
+                INSERT INTO messages (
+                    message_no,
+                    template_id,
+                    channel_type,
+                    sender_type,
+                    sender_id,
+                    recipient_type,
+                    recipient_value,
+                    customer_id,
+                    subject,
+                    content,
+                    content_type,
+                    status,
+                    send_mode,
+                    scheduled_time,
+                    metadata,
+                    created_at
+                )
+                SELECT
+                    r.message_no, $1, $2, 'system', NULL, $3, r.recipient_value,
+                    r.customer_id, $4, $5, 'text', $6, $7, $8, r.metadata::jsonb, NOW()
+                FROM unnest($9::text[], $10::text[], $11::int[], $12::text[])
+                    AS r(message_no, recipient_value, customer_id, metadata)
+                RETURNING *
+            """,
+                template_id,
+                channel_type,
+                recipient_type,
+                subject,
+                content,
+                MessageStatus.PENDING,
+                send_mode,
+                scheduled_time,
+                message_nos,
+                recipient_values,
+                customer_ids,
+                metadatas
+            )
+        
+        # RETURNING 不保证顺序，按消息编号还原为输入顺序
+        by_no = {row["message_no"]: dict(row) for row in rows}
+        return [by_no[no] for no in message_nos if no in by_no]
+    
     async def update_message_status(
         self,
         message_id: int,
@@ -294,6 +442,55 @@ class UnifiedMessageSender:
                 WHERE id = $4
             """, status, sent_at, error_message, message_id)
     
+    async def update_messages_status_bulk(self, message_ids: List[int], status: str):
+        """
+        批量更新消息状态（单条 UPDATE ... WHERE id = ANY）
+        
+        Args:
+            message_ids: 消息ID列表
+            status: 状态
+        """
+        if not message_ids:
+            return
+        
+        sent_at = datetime.now() if status == MessageStatus.SENT else None
+        
+        async with self.db.acquire() as conn:
+            await conn.execute("""
+                UPDATE messages
+                SET status = $1,
+                    sent_at = COALESCE($2, sent_at),
+                    updated_at = NOW()
+                WHERE id = ANY($3::int[])
+            """, status, sent_at, message_ids)
+    
+    async def mark_messages_failed_bulk(self, failures: List[Dict[str, Any]]):
+        """
+        批量写回发送失败的消息，并按重试次数决定是否重新排队
+        
+        Args:
+            failures: [{"id": 1, "error": "xxx"}, ...]
+        """
+        if not failures:
+            return
+        
+        async with self.db.acquire() as conn:
+            await conn.execute("""
+                UPDATE messages AS m
+                SET status = CASE WHEN m.retry_count < m.max_retries THEN $1 ELSE $2 END,
+                    retry_count = CASE WHEN m.retry_count < m.max_retries
+                                       THEN m.retry_count + 1 ELSE m.retry_count END,
+                    error_message = f.error,
+                    updated_at = NOW()
+                FROM unnest($3::int[], $4::text[]) AS f(id, error)
+                WHERE m.id = f.id
+            """,
+                MessageStatus.PENDING,
+                MessageStatus.FAILED,
+                [f["id"] for f in failures],
+                [f["error"] for f in failures]
+            )
+    
     async def send_message(self, message_record: Dict[str, Any]) -> Dict[str, Any]:
         """
         发送消息
@@ -330,19 +527,10 @@ class UnifiedMessageSender:
                 MessageStatus.SENDING
             )
             
-            # 4. 获取对应渠道的发送器
-            sender = self._get_sender(channel_type)
+            # 4. 经外发限流发送消息（超出上游配额时排队等待）
+            result = await self._send_limited(channel_type, config, message_record)
             
-            # 5. 发送消息
-            result = await sender.send(
-                config=config,
-                recipient=message_record["recipient_value"],
-                content=message_record["content"],
-                subject=message_record.get("subject"),
-                metadata=message_record.get("metadata")
-            )
-            
-            # 6. 更新状态为已发送
+            # 5. 更新状态为已发送
             await self.update_message_status(
                 message_record["id"],
                 MessageStatus.SENT,
@@ -396,6 +584,26 @@ class UnifiedMessageSender:
         
         logger.info(f"已安排重试: message_id={message_id}")
     
+    async def _load_template(self, template_id: int) -> Dict[str, Any]:
+        """
+        加载消息模板
+        
+        Args:
+            template_id: 模板ID
+        
+        Returns:
+            模板记录
+        """
+        async with self.db.acquire() as conn:
+            template = await conn.fetchrow("""
+                SELECT * FROM message_templates WHERE id = $1
+            """, template_id)
+        
+        if not template:
+            raise ValueError(f"模板不存在: {template_id}")
+        
+        return dict(template)
+    
     async def send_from_template(
         self,
         template_id: int,
@@ -427,16 +635,12 @@ class UnifiedMessageSender:
             ]
         """
         # 1. 加载模板
-        async with self.db.acquire() as conn:
-            template = await conn.fetchrow("""
-                SELECT * FROM message_templates WHERE id = $1
-            """, template_id)
-            
-            if not template:
-                raise ValueError(f"模板不存在: {template_id}")
+        template = await self._load_template(template_id)
         
         # 2. 渲染内容
-        rendered_content = self.renderer.render(template["content"], variables)
+        rendered_content = self.renderer.render(
+            template["content"], variables, template_id, template.get("updated_at")
+        )
         
         # 3. 批量创建消息记录
         messages = []
@@ -476,6 +680,182 @@ class UnifiedMessageSender:
         
         return results
     
+    async def _deliver(
+        self,
+        message: Dict[str, Any],
+        config: Dict[str, Any]
+    ) -> Optional[str]:
+        """
+        投递单条消息（不写数据库，供批量发送使用）
+        
+        Args:
+            message: 消息记录
+            config: 渠道配置（批量发送时只查询一次）
+        
+        Returns:
+            失败原因，成功返回None
+        """
+        channel_type = message["channel_type"]
+        
+        try:
+            is_valid = await self.validate_recipient(channel_type, message["recipient_value"])
+            if not is_valid:
+                raise ValueError(f"无效的接收者标识符: {message['recipient_value']}")
+            
+            await self._send_limited(channel_type, config, message)
+            return None
+        
+        except Exception as e:
+            logger.error(f"消息发送失败: {message['message_no']}, 错误: {e}")
+            return str(e) or type(e).__name__
+    
+    async def _fan_out(
+        self,
+        messages: List[Dict[str, Any]],
+        config: Dict[str, Any],
+        worker_count: int
+    ) -> List[Optional[str]]:
+        """
+        使用固定数量的协程并发投递一批消息
+        
+        Args:
+            messages: 消息记录列表
+            config: 渠道配置
+            worker_count: 并发协程数
+        
+        Returns:
+            与 messages 对应的失败原因列表（成功为None）
+        """
+        errors: List[Optional[str]] = [None] * len(messages)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index in range(len(messages)):
+            queue.put_nowait(index)
+        
+        async def worker():
+            while True:
+                try:
+                    index = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                errors[index] = await self._deliver(messages[index], config)
+        
+        workers = [asyncio.create_task(worker()) for _ in range(min(worker_count, len(messages)))]
+        await asyncio.gather(*workers)
+        return errors
+    
+    async def send_from_template_bulk(
+        self,
+        template_id: int,
+        recipients: List[Dict[str, Any]],
+        variables: Dict[str, Any],
+        send_mode: str = SendMode.REALTIME,
+        scheduled_time: Optional[datetime] = None,
+        chunk_size: int = BULK_CHUNK_SIZE,
+        worker_count: int = BULK_WORKER_COUNT
+    ) -> Dict[str, Any]:
+        """
+        使用模板批量扇出发送（大批量接收者）
+        
+        与 send_from_template 的区别：
+        - 每批接收者用一条多行INSERT写入，而不是逐条INSERT
+        - 渠道配置只查询一次，状态按批次用 WHERE id = ANY 写回
+        - 发送由固定数量的协程并发执行，并受外发限流（渠道/目的地配额与自适应并发）约束
+        
+        Args:
+            template_id: 模板ID
+            recipients: 接收者列表，格式同 send_from_template
+            variables: 变量字典
+            send_mode: 发送模式
+            scheduled_time: 定时发送时间
+            chunk_size: 每批写入条数
+            worker_count: 并发发送协程数
+        
+        Returns:
+            汇总结果
+            {
+                "total": 50000,
+                "success_count": 49990,
+                "failed_count": 10,
+                "scheduled_count": 0,
+                "errors": {"无效的接收者标识符: xxx": 10},
+                "duration_ms": 123456.7
+            }
+        """
+        started = time.perf_counter()
+        
+        # 1. 加载模板并渲染（所有接收者共用同一内容）
+        template = await self._load_template(template_id)
+        channel_type = template["module_type"]
+        rendered_content = self.renderer.render(
+            template["content"], variables, template_id, template.get("updated_at")
+        )
+        
+        summary = {
+            "total": len(recipients),
+            "success_count": 0,
+            "failed_count": 0,
+            "scheduled_count": 0,
+            "errors": {}
+        }
+        
+        # 2. 实时发送时渠道配置只获取一次
+        config = None
+        config_error = None
+        if send_mode == SendMode.REALTIME:
+            try:
+                config = await self.get_channel_config(channel_type)
+            except ValueError as e:
+                config_error = str(e)
+        
+        # 3. 按批次写入并发送
+        for offset in range(0, len(recipients), chunk_size):
+            chunk = recipients[offset:offset + chunk_size]
+            messages = await self.create_message_records_bulk(
+                template_id=template_id,
+                channel_type=channel_type,
+                recipients=chunk,
+                content=rendered_content,
+                subject=template.get("name"),
+                send_mode=send_mode,
+                scheduled_time=scheduled_time,
+                start_index=offset
+            )
+            
+            if send_mode != SendMode.REALTIME:
+                summary["scheduled_count"] += len(messages)
+                continue
+            
+            message_ids = [m["id"] for m in messages]
+            
+            if config_error:
+                errors = [config_error] * len(messages)
+            else:
+                await self.update_messages_status_bulk(message_ids, MessageStatus.SENDING)
+                errors = await self._fan_out(messages, config, worker_count)
+            
+            sent_ids = []
+            failures = []
+            for message, error in zip(messages, errors):
+                if error is None:
+                    sent_ids.append(message["id"])
+                else:
+                    failures.append({"id": message["id"], "error": error})
+                    summary["errors"][error] = summary["errors"].get(error, 0) + 1
+            
+            await self.update_messages_status_bulk(sent_ids, MessageStatus.SENT)
+            await self.mark_messages_failed_bulk(failures)
+            
+            summary["success_count"] += len(sent_ids)
+            summary["failed_count"] += len(failures)
+            
+            logger.info(
+                f"批量发送进度: template_id={template_id}, "
+                f"{offset + len(chunk)}/{len(recipients)}"
+            )
+        
+        summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return summary
+    
     async def get_message_by_no(self, message_no: str) -> Optional[Dict[str, Any]]:
         """
         根据消息编号查询消息
@@ -0,0 +1,489 @@
+"""
+企业微信回调事件队列
+回调接口只做验签、解析和持久化入队，立即应答；事件由后台工作池异步处理
+
+- 持久化：Redis Stream（消费组 + XACK，进程重启后未确认的事件会重新处理）
+- 去重：按 (ExternalUserID, ChangeType, CreateTime) 在入队时去重，企业微信重推不会重复处理；
+  非客户变更事件缺少前两项时改用 (FromUserName, Event, MsgId)
+- 顺序：按 ExternalUserID 分区；每个分区同一时刻只由一个进程（持有租约）读取，
+  进程内按 ExternalUserID 分配到固定的处理通道，同一客户的事件严格按顺序处理
+- 失败重试：在通道内退避重试，超过次数后转入死信 Stream
+- Redis 不可用时退化为进程内队列（不持久化），并每隔 REDIS_RETRY_INTERVAL 秒重试连接，
+  恢复后新事件重新写入 Redis Stream
+- 所有 Redis 命令都在线程池中执行，不阻塞事件循环
+"""
+import os
+import json
+import time
+import uuid
+import zlib
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.database import REDIS_RETRY_INTERVAL, get_redis, async_session_maker
+from app.services.cache_service import LocalTTLCache
+
+logger = logging.getLogger(__name__)
+
+# 队列配置（可通过环境变量调整）
+WEWORK_EVENT_STREAM = os.getenv("WEWORK_EVENT_STREAM", "wework:callback:events")
+WEWORK_EVENT_PARTITIONS = int(os.getenv("WEWORK_EVENT_PARTITIONS", "4"))
+WEWORK_EVENT_WORKERS = int(os.getenv("WEWORK_EVENT_WORKERS", "8"))
+WEWORK_EVENT_MAX_RETRIES = int(os.getenv("WEWORK_EVENT_MAX_RETRIES", "3"))
+WEWORK_EVENT_DEDUP_TTL = int(os.getenv("WEWORK_EVENT_DEDUP_TTL", "86400"))
+WEWORK_EVENT_MAX_INFLIGHT = int(os.getenv("WEWORK_EVENT_MAX_INFLIGHT", "200"))
+# 为 false 时本进程只入队、不读取 Redis Stream（由其他进程处理）
+WEWORK_EVENT_CONSUME = os.getenv("WEWORK_EVENT_CONSUME", "true").lower() == "true"
+
+EventHandler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class WeWorkEventQueue:
+    """企业微信回调事件队列"""
+    
+    GROUP = "wework_callback"
+    LEASE_PREFIX = "lease:wework_callback:"
+    DEDUP_PREFIX = "wework_event_dedup:"
+    LEASE_TTL = 30
+    READ_BLOCK_MS = 2000
+    READ_COUNT = 50
+    
+    # 去重键不存在时才写入 Stream（原子操作）
+    ENQUEUE_SCRIPT = """
+    if redis.call('SET', KEYS[1], '1', 'NX', 'EX', ARGV[1]) then
+        return redis.call('XADD', KEYS[2], '*', 'event', ARGV[2])
+    end
+    return false
+    """
+    
+    # 仅租约持有者可续期/释放
+    RENEW_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('EXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+    
+    def __init__(
+        self,
+        handler: Optional[EventHandler] = None,
+        redis_conn=None,
+        stream: str = WEWORK_EVENT_STREAM,
+        partitions: int = WEWORK_EVENT_PARTITIONS,
+        workers: int = WEWORK_EVENT_WORKERS,
+        max_retries: int = WEWORK_EVENT_MAX_RETRIES,
+        dedup_ttl: int = WEWORK_EVENT_DEDUP_TTL,
+        consume: bool = WEWORK_EVENT_CONSUME
+    ):
+        """
+        初始化
+        
+        Args:
+            handler: 事件处理函数，默认 handle_wework_event
+            redis_conn: Redis客户端，默认在 start() 时取 app.database.get_redis()；不可用时使用进程内队列并定期重试
+            stream: Stream 键前缀（每个分区一个 Stream）
+            partitions: 分区数
+            workers: 进程内处理通道数
+            max_retries: 单个事件最多重试次数
+            dedup_ttl: 去重窗口（秒）
+            consume: 是否读取 Redis Stream
+        """
+        self.handler = handler or handle_wework_event
+        self._redis_conn = redis_conn
+        # start() 时确定（不可用时由后台任务重试，连上后不再切换；消费组、租约都绑定在同一个客户端上）
+        self.redis_client = None
+        self.stream = stream
+        self.partitions = max(1, partitions)
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.dedup_ttl = dedup_ttl
+        self.consume = consume
+        
+        # 租约持有者标识（本进程）
+        self.owner = uuid.uuid4().hex
+        self._owned: Set[int] = set()
+        
+        self._lanes: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._readers: List[asyncio.Task] = []
+        self._attacher: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Semaphore] = None
+        self._running = False
+        
+        # 进程内模式的去重
+        self._local_seen = LocalTTLCache(max_size=100000)
+        
+        self.stats = {"enqueued": 0, "duplicates": 0, "processed": 0, "retries": 0, "dead": 0}
+    
+    @staticmethod
+    def dedup_key(event: Dict[str, Any]) -> str:
+        """
+        去重键 (ExternalUserID, ChangeType, CreateTime)
+        
+        ExternalUserID / ChangeType 为空的事件（如应用消息、进入会话）改用
+        FromUserName / Event 补位，并带上 MsgId，避免同一秒内的不同事件互相吞掉
+        """
+        subject = event.get('ExternalUserID') or event.get('FromUserName') or ''
+        kind = event.get('ChangeType') or event.get('Event') or event.get('MsgType') or ''
+        key = f"{subject}:{kind}:{event.get('CreateTime') or ''}"
+        if event.get('MsgId'):
+            key = f"{key}:{event['MsgId']}"
+        return key
+    
+    @staticmethod
+    def _hash(event: Dict[str, Any]) -> int:
+        """按 ExternalUserID 的稳定哈希（跨进程一致）"""
+        ordering_key = event.get('ExternalUserID') or event.get('FromUserName') or ''
+        return zlib.crc32(ordering_key.encode('utf-8'))
+    
+    def _stream_key(self, partition: int) -> str:
+        return f"{self.stream}:{partition}"
+    
+    # ==================== 入队 ====================
+    
+    async def enqueue(self, event: Dict[str, Any]) -> bool:
+        """
+        事件入队（回调接口中调用，只做一次 Redis 往返，在线程池中执行，不阻塞事件循环）
+        
+        Args:
+            event: 解析后的回调事件
+        
+        Returns:
+            True 已入队；False 重复事件被丢弃
+        """
+        dedup_key = self.dedup_key(event)
+        
+        if self.redis_client is not None:
+            try:
+                partition = self._hash(event) % self.partitions
+                entry_id = await asyncio.to_thread(
+                    self._enqueue_script,
+                    keys=[f"{self.DEDUP_PREFIX}{dedup_key}", self._stream_key(partition)],
+                    args=[self.dedup_ttl, json.dumps(event, ensure_ascii=False)]
+                )
+                if not entry_id:
+                    self.stats["duplicates"] += 1
+                    logger.info(f"[回调队列] 重复事件已忽略: {dedup_key}")
+                    return False
+                self.stats["enqueued"] += 1
+                return True
+            except Exception as e:
+                logger.warning(f"[回调队列] Redis入队失败，改为进程内处理: {e}")
+        
+        if self._local_seen.get(dedup_key) is not None:
+            self.stats["duplicates"] += 1
+            logger.info(f"[回调队列] 重复事件已忽略: {dedup_key}")
+            return False
+        self._local_seen.set(dedup_key, True, self.dedup_ttl)
+        
+        if not self._lanes:
+            logger.error(f"[回调队列] 工作池未启动，事件丢失: {dedup_key}")
+            return False
+        
+        self._lanes[self._hash(event) % self.workers].put_nowait((None, None, event))
+        self.stats["enqueued"] += 1
+        return True
+    
+    # ==================== 启停 ====================
+    
+    async def start(self):
+        """启动工作池（应用启动时调用）"""
+        if self._running:
+            return
+        self._running = True
+        self._inflight = asyncio.Semaphore(WEWORK_EVENT_MAX_INFLIGHT)
+        
+        self._lanes = [asyncio.Queue() for _ in range(self.workers)]
+        self._workers = [asyncio.create_task(self._lane_worker(lane)) for lane in self._lanes]
+        
+        redis_conn = self._redis_conn if self._redis_conn is not None else await asyncio.to_thread(get_redis)
+        if redis_conn is not None:
+            await self._attach_redis(redis_conn)
+        else:
+            self._attacher = asyncio.create_task(self._retry_attach())
+        
+        logger.info(
+            f"[回调队列] 已启动 (workers={self.workers}, partitions={self.partitions}, "
+            f"redis={'是' if self.redis_client is not None else '否'}, consume={self.consume})"
+        )
+    
+    async def stop(self, timeout: float = 10.0):
+        """
+        停止工作池（应用关闭时调用）
+        
+        已读取但未处理完的事件不确认，租约过期后由其他进程重新处理
+        """
+        if not self._running:
+            return
+        self._running = False
+        
+        # 1. 停止读取新事件
+        if self._attacher is not None:
+            self._attacher.cancel()
+            await asyncio.gather(self._attacher, return_exceptions=True)
+            self._attacher = None
+        for task in self._readers:
+            task.cancel()
+        await asyncio.gather(*self._readers, return_exceptions=True)
+        self._readers = []
+        
+        # 2. 等待通道中已有的事件处理完
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(lane.join() for lane in self._lanes)),
+                timeout=timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("[回调队列] 停止超时，未处理完的事件将由其他进程重新处理")
+        
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._lanes = []
+        
+        # 3. 释放租约，其他进程可立即接手
+        
+        if self.redis_client is not None:
+            for partition in list(self._owned):
+                try:
+                    await asyncio.to_thread(
+                        self._release_script, keys=[f"{self.LEASE_PREFIX}{partition}"], args=[self.owner]
+                    )
+                except Exception as e:
+                    logger.warning(f"[回调队列] 释放分区 {partition} 租约失败: {e}")
+            self._owned.clear()
+        
+        logger.info("[回调队列] 已停止")
+    
+    # ==================== Redis 连接 ====================
+    
+    async def _attach_redis(self, redis_conn):
+        """绑定 Redis 客户端：注册脚本，需要消费时创建消费组并启动分区读取和租约维护"""
+        self._enqueue_script = redis_conn.register_script(self.ENQUEUE_SCRIPT)
+        self._renew_script = redis_conn.register_script(self.RENEW_SCRIPT)
+        self._release_script = redis_conn.register_script(self.RELEASE_SCRIPT)
+        self.redis_client = redis_conn
+        
+        if not self.consume:
+            return
+        try:
+            for partition in range(self.partitions):
+                await asyncio.to_thread(self._ensure_group, partition)
+                self._readers.append(asyncio.create_task(self._partition_reader(partition)))
+            self._readers.append(asyncio.create_task(self._lease_keeper()))
+        except Exception as e:
+            logger.error(f"[回调队列] 创建消费组失败，本进程不读取Redis队列: {e}")
+    
+    async def _retry_attach(self):
+        """启动时 Redis 不可用：定期重试，连上后切换到 Redis Stream"""
+        while True:
+            await asyncio.sleep(REDIS_RETRY_INTERVAL)
+            redis_conn = await asyncio.to_thread(get_redis)
+            if redis_conn is not None:
+                await self._attach_redis(redis_conn)
+                logger.info("[回调队列] Redis已恢复，新事件写入Redis队列")
+                return
+    
+    # ==================== 分区读取 ====================
+    
+    def _ensure_group(self, partition: int):
+        """创建消费组（已存在时忽略）"""
+        try:
+            self.redis_client.xgroup_create(self._stream_key(partition), self.GROUP, id="0", mkstream=True)
+        except Exception as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+    
+    def _hold_lease(self, partition: int, owned: bool) -> bool:
+        """续期（已持有）或尝试获取分区租约，返回之后是否持有"""
+        lease_key = f"{self.LEASE_PREFIX}{partition}"
+        if owned:
+            return bool(self._renew_script(keys=[lease_key], args=[self.owner, self.LEASE_TTL]))
+        return bool(self.redis_client.set(lease_key, self.owner, nx=True, ex=self.LEASE_TTL))
+    
+    async def _lease_keeper(self):
+        """获取/续期分区租约"""
+        while True:
+            for partition in range(self.partitions):
+                owned = partition in self._owned
+                try:
+                    held = await asyncio.to_thread(self._hold_lease, partition, owned)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"[回调队列] 分区 {partition} 租约操作失败: {e}")
+                    continue
+                
+                if owned and not held:
+                    self._owned.discard(partition)
+                    logger.warning(f"[回调队列] 失去分区 {partition} 租约")
+                elif held and not owned:
+                    self._owned.add(partition)
+                    logger.info(f"[回调队列] 获得分区 {partition} 租约")
+            
+            await asyncio.sleep(self.LEASE_TTL / 3)
+    
+    async def _partition_reader(self, partition: int):
+        """读取本进程持有租约的分区，按 ExternalUserID 分配到处理通道"""
+        stream_key = self._stream_key(partition)
+        # 分区同一时刻只有一个读取者，消费者名固定，接手后可直接读到上一任未确认的事件
+        consumer = f"partition-{partition}"
+        backlog = True
+        
+        while True:
+            if partition not in self._owned:
+                backlog = True
+                await asyncio.sleep(1)
+                continue
+            
+            try:
+                response = await asyncio.to_thread(
+                    self.redis_client.xreadgroup,
+                    self.GROUP,
+                    consumer,
+                    {stream_key: "0" if backlog else ">"},
+                    count=self.READ_COUNT,
+                    block=None if backlog else self.READ_BLOCK_MS
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"[回调队列] 读取分区 {partition} 失败: {e}")
+                await asyncio.sleep(1)
+                continue
+            
+            entries = response[0][1] if response else []
+            if backlog and not entries:
+                backlog = False
+                continue
+            
+            for entry_id, fields in entries:
+                try:
+                    event = json.loads(fields["event"])
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.error(f"[回调队列] 事件格式错误，丢弃 {entry_id}: {e}")
+                    await asyncio.to_thread(self._ack, stream_key, entry_id)
+                    continue
+                
+                await self._inflight.acquire()
+                self._lanes[self._hash(event) % self.workers].put_nowait((stream_key, entry_id, event))
+            
+            if backlog:
+                # 积压中的事件已全部分发，等它们确认后再读新事件，避免重复分发
+                await asyncio.gather(*(lane.join() for lane in self._lanes))
+    
+    def _ack(self, stream_key: str, entry_id: str):
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.xack(stream_key, self.GROUP, entry_id)
+            pipe.xdel(stream_key, entry_id)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"[回调队列] 确认事件 {entry_id} 失败: {e}")
+    
+    async def _dead_letter(self, event: Dict[str, Any], error: str):
+        """重试耗尽的事件转入死信 Stream"""
+        self.stats["dead"] += 1
+        logger.error(f"[回调队列] 事件处理失败转入死信: {self.dedup_key(event)}: {error}")
+        if self.redis_client is None:
+            return
+        try:
+            await asyncio.to_thread(
+                self.redis_client.xadd,
+                f"{self.stream}:dead",
+                {"event": json.dumps(event, ensure_ascii=False), "error": error[:500]},
+                maxlen=10000,
+                approximate=True
+            )
+        except Exception as e:
+            logger.warning(f"[回调队列] 写入死信失败: {e}")
+    
+    # ==================== 处理 ====================
+    
+    async def _lane_worker(self, lane: asyncio.Queue):
+        """处理通道：同一通道内的事件按入队顺序逐个处理"""
+        while True:
+            stream_key, entry_id, event = await lane.get()
+            try:
+                await self._process(event)
+                if entry_id is not None:
+                    await asyncio.to_thread(self._ack, stream_key, entry_id)
+            finally:
+                if entry_id is not None:
+                    self._inflight.release()
+                lane.task_done()
+    
+    async def _process(self, event: Dict[str, Any]):
+        """处理单个事件，失败时退避重试"""
+        for attempt in range(self.max_retries + 1):
+            try:
+                start = time.perf_counter()
+                await self.handler(event)
+                self.stats["processed"] += 1
+                logger.debug(
+                    f"[回调队列] 处理完成 {self.dedup_key(event)} "
+                    f"({(time.perf_counter() - start) * 1000:.1f}ms)"
+                )
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    await self._dead_letter(event, str(e))
+                    return
+                self.stats["retries"] += 1
+                logger.warning(f"[回调队列] 处理失败，第 {attempt + 1} 次重试: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """获取统计"""
+        return {
+            **self.stats,
+            "owned_partitions": sorted(self._owned),
+            "queued": sum(lane.qsize() for lane in self._lanes)
+        }
+
+
+async def handle_wework_event(event_data: Dict[str, Any]):
+    """
+    处理企业微信回调事件（在工作池中执行）
+    
+    Args:
+        event_data: 解析后的回调事件
+    """
+    from app.services.auto_binding_service import AutoBindingService
+    
+    msg_type = event_data.get('MsgType')
+    event_type = event_data.get('Event')
+    change_type = event_data.get('ChangeType')
+    
+    if msg_type != 'event' or event_type != 'change_external_contact':
+        return
+    
+    if change_type == 'add_external_contact':
+        # 处理添加客户事件
+        async with async_session_maker() as db:
+            result = await AutoBindingService.handle_wework_add_customer_event(db, event_data)
+        logger.info(f"添加客户事件处理结果: {result}")
+    
+    elif change_type == 'del_external_contact':
+        # 处理删除客户事件
+        logger.info(f"客户删除事件: UserID={event_data.get('UserID')}, ExternalUserID={event_data.get('ExternalUserID')}")
+        # TODO: 实现客户删除处理逻辑
+    
+    elif change_type == 'edit_external_contact':
+        # 处理编辑客户事件
+        logger.info(f"客户编辑事件: ExternalUserID={event_data.get('ExternalUserID')}")
+        # TODO: 实现客户编辑处理逻辑
+
+
+# 全局回调事件队列
+wework_event_queue = WeWorkEventQueue()
@@ -0,0 +1,296 @@
+"""
+企业微信 access_token 管理服务
+进程内共享（可选 Redis 跨 worker 共享）的令牌缓存，供所有企业微信客户端和发送器复用
+
+- 按 (corp_id, agent_id) 缓存令牌，不再随 WeChatWorkAPI 实例创建而丢失
+- 同一应用的并发刷新只发起一次 gettoken 请求（single-flight），其余调用方等待同一结果；
+  刷新在独立任务中执行，发起刷新的调用方被取消不影响其他等待者
+- Redis 可用时令牌写入 Redis，并用短期锁保证多个 worker 只有一个去调用 gettoken
+- 后台任务在令牌过期前主动刷新，业务请求不需要等待 gettoken
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+from fastapi import HTTPException
+
+from app.database import get_redis
+from app.services.http_client_service import get_http_client
+
+logger = logging.getLogger(__name__)
+
+# 令牌配置（可通过环境变量调整）
+# 距离过期不足该秒数时视为需要刷新
+WEWORK_TOKEN_REFRESH_MARGIN = int(os.getenv("WEWORK_TOKEN_REFRESH_MARGIN", "300"))
+# 后台主动刷新的检查间隔（秒）
+WEWORK_TOKEN_CHECK_INTERVAL = int(os.getenv("WEWORK_TOKEN_CHECK_INTERVAL", "60"))
+# 是否通过 Redis 在多个 worker 间共享令牌
+WEWORK_TOKEN_SHARED = os.getenv("WEWORK_TOKEN_SHARED", "true").lower() == "true"
+
+WEWORK_API_BASE = "https://qyapi.weixin.qq.com/cgi-bin"
+
+# 企业微信返回的令牌失效错误码（access_token 无效 / 已过期）
+INVALID_TOKEN_ERRCODES = (40014, 42001)
+
+
+class WeWorkTokenManager:
+    """企业微信 access_token 管理器"""
+    
+    KEY_PREFIX = "wework_token:"
+    LOCK_PREFIX = "lock:wework_token:"
+    # 等待其他 worker 刷新的最长时间（秒）
+    LOCK_WAIT_SECONDS = 5.0
+    
+    def __init__(
+        self,
+        redis_conn=None,
+        refresh_margin: int = WEWORK_TOKEN_REFRESH_MARGIN,
+        check_interval: int = WEWORK_TOKEN_CHECK_INTERVAL,
+        shared: bool = WEWORK_TOKEN_SHARED
+    ):
+        """
+        初始化
+        
+        Args:
+            redis_conn: Redis客户端，默认使用 app.database.get_redis()（首次使用时连接）
+            refresh_margin: 提前刷新的秒数
+            check_interval: 后台刷新检查间隔（秒）
+            shared: 是否通过 Redis 在 worker 间共享令牌，否则仅在本进程内共享
+        """
+        self._redis_conn = redis_conn
+        self.shared = shared
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        
+        # (corp_id, agent_id) -> (access_token, 过期时间戳)
+        self._tokens: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        # (corp_id, agent_id) -> secret，后台刷新使用
+        self._credentials: Dict[Tuple[str, str], str] = {}
+        # 正在进行的刷新（single-flight）
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        
+        self.stats = {"hits": 0, "refreshes": 0, "shared_hits": 0, "coalesced": 0, "errors": 0}
+    
+    @property
+    def redis_client(self):
+        """Redis客户端（不共享时为 None；未指定时每次取共享客户端）"""
+        if not self.shared:
+            return None
+        return self._redis_conn if self._redis_conn is not None else get_redis()
+    
+    @staticmethod
+    def _app_key(corp_id: str, agent_id) -> Tuple[str, str]:
+        return str(corp_id), str(agent_id)
+    
+    def _redis_key(self, app_key: Tuple[str, str]) -> str:
+        return f"{self.KEY_PREFIX}{app_key[0]}:{app_key[1]}"
+    
+    def _is_fresh(self, expires_at: float, ahead: float = 0) -> bool:
+        return expires_at - self.refresh_margin - ahead > time.time()
+    
+    async def get_token(
+        self,
+        corp_id: str,
+        secret: str,
+        agent_id,
+        force_refresh: bool = False,
+        ahead: float = 0
+    ) -> str:
+        """
+        获取 access_token
+        
+        Args:
+            corp_id: 企业ID
+            secret: 应用Secret
+            agent_id: 应用AgentId
+            force_refresh: 忽略缓存强制刷新（令牌被企业微信判定失效时使用）
+            ahead: 额外要求令牌至少还能使用的秒数（后台提前刷新使用）
+        
+        Returns:
+            access_token
+        """
+        app_key = self._app_key(corp_id, agent_id)
+        self._credentials[app_key] = secret
+        
+        if not force_refresh:
+            cached = self._tokens.get(app_key)
+            if cached and self._is_fresh(cached[1], ahead):
+                self.stats["hits"] += 1
+                return cached[0]
+        
+        task = self._inflight.get(app_key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            # 刷新在独立任务中执行，所有调用方通过 shield 等待：任一调用方被取消只影响它自己
+            task = asyncio.ensure_future(self._refresh(app_key, secret, force_refresh, ahead))
+            self._inflight[app_key] = task
+            task.add_done_callback(lambda done: self._refresh_done(app_key, done))
+        
+        return await asyncio.shield(task)
+        
+    def _refresh_done(self, app_key: Tuple[str, str], task: asyncio.Task):
+        if self._inflight.get(app_key) is task:
+            del self._inflight[app_key]
+        # 在此取走异常：所有等待者都已取消时也不会出现「Task exception was never retrieved」警告
+        if not task.cancelled() and task.exception() is not None:
+            self.stats["errors"] += 1
+    
+    def invalidate(self, corp_id: str, agent_id):
+        """
+        丢弃缓存的令牌（所有 worker）
+        
+        Args:
+            corp_id: 企业ID
+            agent_id: 应用AgentId
+        """
+        app_key = self._app_key(corp_id, agent_id)
+        self._tokens.pop(app_key, None)
+        if self.redis_client:
+            try:
+                self.redis_client.delete(self._redis_key(app_key))
+            except Exception as e:
+                logger.warning(f"[企业微信令牌] Redis删除失败: {e}")
+    
+    # ==================== 刷新 ====================
+    
+    def _read_shared(self, app_key: Tuple[str, str]) -> Optional[Tuple[str, float]]:
+        """读取 Redis 中其他 worker 刷新的令牌"""
+        if not self.redis_client:
+            return None
+        try:
+            data = self.redis_client.get(self._redis_key(app_key))
+            if data is None:
+                return None
+            payload = json.loads(data)
+            return payload["access_token"], float(payload["expires_at"])
+        except Exception as e:
+            logger.warning(f"[企业微信令牌] Redis读取失败: {e}")
+            return None
+    
+    def _write_shared(self, app_key: Tuple[str, str], token: str, expires_at: float):
+        """写入 Redis 供其他 worker 使用"""
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.setex(
+                self._redis_key(app_key),
+                max(int(expires_at - time.time()), 1),
+                json.dumps({"access_token": token, "expires_at": expires_at})
+            )
+        except Exception as e:
+            logger.warning(f"[企业微信令牌] Redis写入失败: {e}")
+    
+    def _try_lock(self, app_key: Tuple[str, str]) -> bool:
+        """获取跨 worker 刷新锁，Redis 不可用时视为获取成功"""
+        if not self.redis_client:
+            return True
+        try:
+            lock_key = f"{self.LOCK_PREFIX}{app_key[0]}:{app_key[1]}"
+            return bool(self.redis_client.set(lock_key, "1", nx=True, ex=int(self.LOCK_WAIT_SECONDS) * 2))
+        except Exception as e:
+            logger.warning(f"[企业微信令牌] Redis加锁失败: {e}")
+            return True
+    
+    def _unlock(self, app_key: Tuple[str, str]):
+        if not self.redis_client:
+            return
+        try:
+            self.redis_client.delete(f"{self.LOCK_PREFIX}{app_key[0]}:{app_key[1]}")
+        except Exception as e:
+            logger.warning(f"[企业微信令牌] Redis解锁失败: {e}")
+    
+    async def _refresh(self, app_key: Tuple[str, str], secret: str, force_refresh: bool, ahead: float) -> str:
+        """刷新令牌：优先使用其他 worker 已刷新的令牌，否则调用 gettoken"""
+        if not force_refresh:
+            shared = self._read_shared(app_key)
+            if shared and self._is_fresh(shared[1], ahead):
+                self.stats["shared_hits"] += 1
+                self._tokens[app_key] = shared
+                return shared[0]
+        
+        locked = self._try_lock(app_key)
+        if not locked:
+            # 其他 worker 正在刷新，等待其结果
+            deadline = time.monotonic() + self.LOCK_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+                shared = self._read_shared(app_key)
+                if shared and self._is_fresh(shared[1], ahead):
+                    self.stats["shared_hits"] += 1
+                    self._tokens[app_key] = shared
+                    return shared[0]
+            logger.warning(f"[企业微信令牌] 等待其他worker刷新超时，直接获取: {app_key}")
+        
+        try:
+            token, expires_at = await self._fetch(app_key[0], secret)
+            self._tokens[app_key] = (token, expires_at)
+            self._write_shared(app_key, token, expires_at)
+            return token
+        finally:
+            if locked:
+                self._unlock(app_key)
+    
+    async def _fetch(self, corp_id: str, secret: str) -> Tuple[str, float]:
+        """调用企业微信 gettoken 接口"""
+        client = get_http_client("wework")
+        response = await client.get(
+            f"{WEWORK_API_BASE}/gettoken",
+            params={"corpid": corp_id, "corpsecret": secret}
+        )
+        data = response.json()
+        
+        if data.get("errcode") != 0:
+            raise HTTPException(
+                status_code=500,
+                detail=f"获取access_token失败: {data.get('errmsg')}"
+            )
+        
+        self.stats["refreshes"] += 1
+        expires_in = int(data.get("expires_in", 7200))
+        logger.info(f"[企业微信令牌] 已刷新 corp_id={corp_id}, 有效期 {expires_in}s")
+        return data["access_token"], time.time() + expires_in
+    
+    # ==================== 后台刷新 ====================
+    
+    async def _refresh_loop(self):
+        """定期检查已使用过的应用，在过期前主动刷新"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            
+            # 下次检查前就会进入刷新窗口的令牌，现在就刷新（其他 worker 已刷新的直接复用）
+            for app_key, secret in list(self._credentials.items()):
+                try:
+                    await self.get_token(app_key[0], secret, app_key[1], ahead=self.check_interval)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"[企业微信令牌] 后台刷新失败 {app_key}: {e}")
+    
+    def start(self):
+        """启动后台刷新任务（应用启动时调用）"""
+        if self._refresher is None:
+            self._refresher = asyncio.get_running_loop().create_task(self._refresh_loop())
+            logger.info("[企业微信令牌] 后台刷新已启动")
+    
+    async def stop(self):
+        """停止后台刷新任务（应用关闭时调用）"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+    
+    def get_stats(self) -> Dict[str, int]:
+        """获取统计"""
+        return {**self.stats, "apps": len(self._credentials)}
+
+
+# 全局令牌管理器
+wework_token_manager = WeWorkTokenManager()
@@ -7,7 +7,8 @@ from datetime import datetime, timedelta
 from typing import Callable
 from pyxxl import ExecutorConfig, PyxxlRunner
 
-from app.database import SessionLocal
+from app.database import async_session_maker
+from app.services.metrics import timed_job
 from app.models_messaging import MessageStatistics, MessageRecord, MessageTask
 from sqlalchemy import select, func, and_
 
@@ -42,9 +43,9 @@ class XxlJobService:
         logger.info(f"[Xxl-job] 执行器已配置: {app_name}")
     
     def register_handler(self, handler_name: str):
-        """注册任务处理器（装饰器）"""
+        """注册任务处理器（装饰器，执行耗时计入 scheduler_job_duration_seconds）"""
         def decorator(func: Callable):
-            self.runner.register(name=handler_name, handler=func)
+            self.runner.register(name=handler_name, handler=timed_job(handler_name)(func))
             logger.info(f"[Xxl-job] 注册处理器: {handler_name}")
             return func
         
@@ -71,7 +72,7 @@ async def update_message_statistics_job(job_param: str = None):
     """
     logger.info("[定时任务] 开始更新消息统计...")
     
-    db = SessionLocal()
+    db = async_session_maker()
     try:
         # 统计昨天的数据
         yesterday = datetime.now() - timedelta(days=1)
@@ -135,7 +136,7 @@ async def send_daily_report_job(job_param: str = None):
     """
     logger.info("[定时任务] 开始发送每日报告...")
     
-    db = SessionLocal()
+    db = async_session_maker()
     try:
         # 查询昨天的统计数据
         yesterday = datetime.now() - timedelta(days=1)
@@ -204,7 +205,7 @@ async def clean_expired_data_job(job_param: str = None):
     """
     logger.info("[定时任务] 开始清理过期数据...")
     
-    db = SessionLocal()
+    db = async_session_maker()
     try:
         # 删除30天前的消息记录
         thirty_days_ago = datetime.now() - timedelta(days=30)
@@ -261,7 +262,7 @@ async def retry_failed_messages_job(job_param: str = None):
     """
     logger.info("[定时任务] 开始重试失败消息...")
     
-    db = SessionLocal()
+    db = async_session_maker()
     try:
         # 查询失败的消息（24小时内，重试次数<3）
         twenty_four_hours_ago = datetime.now() - timedelta(hours=24)
@@ -6,14 +6,20 @@
 
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+import asyncio
+import hashlib
 import json
 import logging
-from sqlalchemy import select, and_
-from typing import Optional, List, Dict, Any
-import httpx
+import os
+import time
+from sqlalchemy import select, and_, delete
+from typing import Optional, List, Dict, Any, Tuple
 
-from app.database import AsyncSessionLocal
+from app.database import async_session_maker
+from app.services.cache_invalidation import invalidation_bus
+from app.services.remote_project_client import RemoteProjectClient
 from app.models import (
     ProjectCache, ProjectSyncHistory, ProjectSyncConfig,
     ProjectStatusNotifications
@@ -24,6 +30,54 @@ logger = logging.getLogger(__name__)
 # 全局调度器实例
 scheduler: Optional[AsyncIOScheduler] = None
 
+# 同步参数（可通过环境变量调整）
+SYNC_UPSERT_CHUNK_SIZE = int(os.getenv("PROJECT_SYNC_UPSERT_CHUNK_SIZE", "1000"))
+SYNC_NOTIFY_WORKERS = int(os.getenv("PROJECT_SYNC_NOTIFY_WORKERS", "10"))
+SYNC_NOTIFY_QUEUE_SIZE = int(os.getenv("PROJECT_SYNC_NOTIFY_QUEUE_SIZE", "100"))
+
+# upsert 时更新的列（project_id 为唯一键）
+UPSERT_UPDATE_COLUMNS = ('project_type', 'title', 'status', 'data',
+                         'remote_updated_at', 'cached_at', 'expires_at')
+
+
+def _payload_digest(payload: Any) -> str:
+    """项目数据摘要（与键顺序无关），用于判断缓存内容是否真的变化"""
+    return hashlib.sha1(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _phase(timings: Dict[str, float], name: str):
+    """记录同步阶段耗时（秒）"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round(timings.get(name, 0) + time.perf_counter() - start, 3)
+
+
+def _upsert_statement(db, rows: List[Dict[str, Any]]):
+    """按数据库方言生成批量 upsert 语句"""
+    table = ProjectCache.__table__
+    dialect = db.bind.dialect.name
+    
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as mysql_insert
+        stmt = mysql_insert(table).values(rows)
+        return stmt.on_duplicate_key_update(
+            {column: stmt.inserted[column] for column in UPSERT_UPDATE_COLUMNS}
+        )
+    
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    
+    stmt = dialect_insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=[table.c.project_id],
+        set_={column: stmt.excluded[column] for column in UPSERT_UPDATE_COLUMNS}
+    )
+
 
 class ProjectSyncScheduler:
     """项目同步调度器"""
@@ -85,87 +139,115 @@ class ProjectSyncScheduler:
     
     async def sync_projects(self):
         """
-        同步所有项目的状态
+        同步项目状态
         这是定时任务的主要执行函数
+        
+        流程：逐页拉取远程（增量或全量）→ 查询本地状态 → 内存比对
+        → 分块批量 upsert → 失效本页内容有变化的项目缓存
+        → 全量时删除远程已不存在的项目（对账）→ 有界队列并发发送变更通知 → 保存高水位 → 记录各阶段耗时
         """
         start_time = datetime.utcnow()
+        timings: Dict[str, float] = {}
         logger.info("Starting automatic project sync")
         
         try:
-            async with AsyncSessionLocal() as db:
-                # 获取配置
-                config = await self._get_sync_config()
-                
-                if not config.get('auto_sync_enabled'):
-                    logger.info("Auto sync is disabled, skipping sync")
-                    return
-                
-                # 获取同步的项目类型
-                project_types = config.get('sync_types', ['presale', 'aftersales', 'sales'])
-                cache_ttl = config.get('cache_ttl', 30)
-                notify_on_change = config.get('notify_on_change', True)
-                
-                # 从远程API获取所有项目
-                all_projects = await self._fetch_remote_projects(project_types)
-                
-                if not all_projects:
-                    logger.warning("No projects fetched from remote API")
-                    return
-                
-                # 统计信息
-                total = len(all_projects)
-                updated = 0
-                unchanged = 0
-                failed = 0
-                changes = []
+            # 获取配置
+            config = await self._get_sync_config()
+            
+            if not config.get('auto_sync_enabled'):
+                logger.info("Auto sync is disabled, skipping sync")
+                return
+            
+            # 获取同步的项目类型
+            project_types = config.get('sync_types', ['presale', 'aftersales', 'sales'])
+            cache_ttl = config.get('cache_ttl', 30)
+            notify_on_change = config.get('notify_on_change', True)
+            
+            # 增量 / 全量（定期全量对账）
+            sync_cursor = config.get('sync_cursor') or {}
+            full_sync = self._needs_full_sync(config, sync_cursor)
+            updated_since = None if full_sync else sync_cursor.get('updated_since')
+            
+            client = RemoteProjectClient()
+            total = 0
+            failed = 0
+            invalidated = 0
+            removed = 0
+            seen_ids = set()
+            changes: List[Dict[str, Any]] = []
+            changed_projects: Dict[str, Dict[str, Any]] = {}
+            
+            async with async_session_maker() as db:
+                # 全量时一次查询预加载所有状态；增量时按页查询
+                old_cached = None
+                if full_sync:
+                    with _phase(timings, 'preload'):
+                        old_cached = await self._load_cached_projects(db)
                 
-                # 同步每个项目
-                for project in all_projects:
-                    try:
-                        project_id = project.get('id')
-                        new_status = project.get('status')
-                        
-                        # 获取旧的缓存数据
-                        old_cache = await self._get_project_cache(project_id, db)
-                        old_status = old_cache.get('status') if old_cache else None
-                        
-                        # 更新缓存
-                        cache = await self._update_project_cache(
-                            project_id, project, cache_ttl, db
+                # 1. 逐页拉取，每页到达后立即处理
+                async for page in client.iter_pages(project_types, updated_since):
+                    cached = old_cached
+                    if cached is None:
+                        with _phase(timings, 'preload'):
+                            cached = await self._load_cached_projects(
+                                db, [str(project.get('id')) for project in page]
+                            )
+                    
+                    # 2. 内存比对
+                    with _phase(timings, 'diff'):
+                        projects, page_changes, dirty_ids = self._diff_projects(page, cached)
+                    
+                    # 3. 分块批量 upsert
+                    with _phase(timings, 'upsert'):
+                        page_synced, page_failed = await self._bulk_upsert_projects(
+                            projects, cache_ttl, db
                         )
-                        
-                        # 检测状态变更
-                        if old_cache and old_status != new_status:
-                            updated += 1
-                            changes.append({
-                                'project_id': project_id,
-                                'old_status': old_status,
-                                'new_status': new_status,
-                                'project_title': project.get('title'),
-                                'notified': False
-                            })
-                            
-                            # 发送通知
-                            if notify_on_change:
-                                await self._send_notifications(
-                                    project_id, old_status, new_status, project, db
-                                )
-                                
-                                # 标记为已通知
-                                if changes:
-                                    changes[-1]['notified'] = True
-                        else:
-                            unchanged += 1
                     
-                    except Exception as e:
-                        logger.error(f"Failed to sync project {project.get('id')}: {e}")
-                        failed += 1
-                        continue
-                
-                # 记录同步历史
-                duration = (datetime.utcnow() - start_time).total_seconds()
-                status = "success" if failed == 0 else ("partial" if failed < total else "failed")
+                    total += len(projects)
+                    failed += page_failed
+                    seen_ids.update(projects)
+                    
+                    # 本页已提交，立即失效内容有变化的项目（Redis + 所有 worker 的进程内缓存）；
+                    # 后续页面拉取失败时，已写入的页面也不会继续返回旧数据
+                    synced = set(page_synced)
+                    page_invalidate = [project_id for project_id in page_synced if project_id in dirty_ids]
+                    invalidation_bus.publish_projects_changed(page_invalidate, "sync")
+                    invalidated += len(page_invalidate)
+                    
+                    for change in page_changes:
+                        if change['project_id'] in synced:
+                            changes.append(change)
+                            changed_projects[change['project_id']] = projects[change['project_id']]
                 
+                # 全量对账：所有页面都拉取成功后，删除远程已删除/关闭（不再返回）的项目
+                if full_sync:
+                    with _phase(timings, 'reconcile'):
+                        removed = await self._remove_unseen_projects(
+                            db, project_types, seen_ids, start_time
+                        )
+            
+            timings['fetch'] = round(client.fetch_seconds, 3)
+            
+            # 4. 并发发送变更通知（只针对写入成功的项目）
+            if notify_on_change and changes:
+                with _phase(timings, 'notify'):
+                    await self._dispatch_notifications(
+                        changes, changed_projects, config.get('notify_channels', [])
+                    )
+            
+            # 5. 全部写入成功才推进高水位，失败的部分下次重新拉取
+            if failed == 0 and client.server_time:
+                await self._save_sync_cursor(sync_cursor, client.server_time, full_sync)
+            
+            # 统计信息
+            updated = len(changes)
+            unchanged = total - updated - failed
+            
+            # 6. 记录同步历史
+            duration = (datetime.utcnow() - start_time).total_seconds()
+            status = "success" if failed == 0 else ("partial" if failed < total else "failed")
+            
+            async with async_session_maker() as db:
                 await self._record_sync_history(
                     db=db,
                     total=total,
@@ -174,20 +256,242 @@ class ProjectSyncScheduler:
                     failed=failed,
                     duration=duration,
                     status=status,
-                    changes=changes
-                )
-                
-                logger.info(
-                    f"Project sync completed: total={total}, updated={updated}, "
-                    f"unchanged={unchanged}, failed={failed}, duration={duration:.2f}s"
+                    changes=changes,
+                    phase_timings=timings,
+                    mode='full' if full_sync else 'incremental'
                 )
+            
+            logger.info(
+                f"Project sync completed ({'full' if full_sync else 'incremental'}): "
+                f"total={total}, updated={updated}, unchanged={unchanged}, "
+                f"failed={failed}, invalidated={invalidated}, removed={removed}, duration={duration:.2f}s, phases={timings}"
+            )
         
         except Exception as e:
             logger.error(f"Project sync failed: {e}", exc_info=True)
     
+    @staticmethod
+    def _needs_full_sync(config: Dict[str, Any], sync_cursor: Dict[str, Any]) -> bool:
+        """判断本次是否需要全量同步"""
+        if config.get('sync_mode') == 'full' or not sync_cursor.get('updated_since'):
+            return True
+        
+        last_full_sync = sync_cursor.get('last_full_sync')
+        if not last_full_sync:
+            return True
+        
+        interval = timedelta(hours=config.get('full_sync_interval_hours', 24))
+        return datetime.utcnow() - datetime.fromisoformat(last_full_sync) >= interval
+    
+    async def _save_sync_cursor(self, sync_cursor: Dict[str, Any], server_time: str, full_sync: bool):
+        """保存增量同步高水位"""
+        cursor = dict(sync_cursor)
+        cursor['updated_since'] = server_time
+        if full_sync:
+            cursor['last_full_sync'] = datetime.utcnow().isoformat()
+        
+        async with async_session_maker() as db:
+            stmt = select(ProjectSyncConfig).where(ProjectSyncConfig.config_key == 'sync_cursor')
+            result = await db.execute(stmt)
+            record = result.scalar_one_or_none()
+            
+            if not record:
+                record = ProjectSyncConfig(config_key='sync_cursor', description='增量同步高水位')
+                db.add(record)
+            record.config_value = json.dumps({"value": cursor})
+            
+            await db.commit()
+    
+    async def _load_cached_projects(self, db, project_ids: Optional[List[str]] = None
+                                    ) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+        """
+        加载已缓存项目的状态和数据摘要（不指定项目ID时一次查询全部）
+        
+        Returns:
+            {project_id: (status, 数据摘要)}，只保留摘要，全量时不在内存中保存整份数据
+        """
+        stmt = select(ProjectCache.project_id, ProjectCache.status, ProjectCache.data)
+        if project_ids is not None:
+            stmt = stmt.where(ProjectCache.project_id.in_(project_ids))
+        result = await db.execute(stmt)
+        
+        cached = {}
+        for project_id, status, data in result.all():
+            try:
+                digest = _payload_digest(json.loads(data)) if data else None
+            except (TypeError, ValueError):
+                digest = None
+            cached[project_id] = (status, digest)
+        return cached
+    
+    @staticmethod
+    def _diff_projects(
+        all_projects: List[Dict[str, Any]],
+        cached: Dict[str, Tuple[Optional[str], Optional[str]]]
+    ):
+        """
+        比对远程项目与本地缓存
+        
+        Returns:
+            (按项目ID去重后的项目字典, 状态变更列表, 缓存内容有变化的项目ID集合)
+        """
+        projects: Dict[str, Dict[str, Any]] = {}
+        for project in all_projects:
+            project_id = project.get('id')
+            if project_id is not None:
+                projects[str(project_id)] = project
+        
+        changes = []
+        dirty_ids = set()
+        for project_id, project in projects.items():
+            old = cached.get(project_id)
+            # 按写入时的序列化结果计算摘要（datetime 等已转为字符串）
+            if old is None or old[1] != _payload_digest(json.loads(json.dumps(project, default=str))):
+                # 新项目也要失效：之前的查询可能已写入「不存在」的负缓存
+                dirty_ids.add(project_id)
+            if old is None:
+                continue
+            
+            old_status = old[0]
+            new_status = project.get('status')
+            if old_status != new_status:
+                changes.append({
+                    'project_id': project_id,
+                    'old_status': old_status,
+                    'new_status': new_status,
+                    'project_title': project.get('title'),
+                    'notified': False
+                })
+        
+        return projects, changes, dirty_ids
+    
+    async def _remove_unseen_projects(self, db, project_types: List[str], seen_ids: set,
+                                      started_at: datetime) -> int:
+        """
+        删除全量同步中远程没有返回的缓存项目，并失效其缓存
+        
+        Args:
+            project_types: 本次同步的项目类型（其他类型的缓存不动）
+            seen_ids: 本次全量同步远程返回的项目ID
+            started_at: 同步开始时间（之后由其他途径写入的缓存不动）
+        
+        Returns:
+            删除的项目数
+        """
+        # 远程一个项目都没返回时更可能是接口异常，不做删除
+        if not seen_ids:
+            logger.warning("Full sync returned no projects, skipping reconciliation")
+            return 0
+        
+        result = await db.execute(
+            select(ProjectCache.project_id).where(
+                ProjectCache.project_type.in_(project_types),
+                ProjectCache.cached_at < started_at
+            )
+        )
+        stale_ids = sorted(set(result.scalars().all()) - seen_ids)
+        removed = 0
+        for offset in range(0, len(stale_ids), SYNC_UPSERT_CHUNK_SIZE):
+            chunk = stale_ids[offset:offset + SYNC_UPSERT_CHUNK_SIZE]
+            try:
+                await db.execute(delete(ProjectCache).where(ProjectCache.project_id.in_(chunk)))
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.error(f"Failed to remove stale projects at {offset}: {e}")
+                continue
+            invalidation_bus.publish_projects_changed(chunk, "reconcile")
+            removed += len(chunk)
+        
+        if removed:
+            logger.info(f"Full sync removed {removed} projects no longer returned by remote")
+        return removed
+    
+    async def _bulk_upsert_projects(
+        self,
+        projects: Dict[str, Dict[str, Any]],
+        cache_ttl: int,
+        db
+    ):
+        """
+        分块批量写入项目缓存（INSERT ... ON CONFLICT / ON DUPLICATE KEY UPDATE）
+        
+        Returns:
+            (写入成功的项目ID列表, 失败数)
+        """
+        now = datetime.utcnow()
+        expires_at = now + timedelta(minutes=cache_ttl)
+        
+        rows = [
+            {
+                'project_id': project_id,
+                'project_type': project.get('type', 'unknown'),
+                'title': project.get('title'),
+                'status': project.get('status'),
+                'data': json.dumps(project, default=str),
+                'remote_updated_at': now,
+                'cached_at': now,
+                'expires_at': expires_at
+            }
+            for project_id, project in projects.items()
+        ]
+        
+        synced_ids: List[str] = []
+        failed = 0
+        
+        for offset in range(0, len(rows), SYNC_UPSERT_CHUNK_SIZE):
+            chunk = rows[offset:offset + SYNC_UPSERT_CHUNK_SIZE]
+            try:
+                await db.execute(_upsert_statement(db, chunk))
+                await db.commit()
+                synced_ids.extend(row['project_id'] for row in chunk)
+            except Exception as e:
+                await db.rollback()
+                failed += len(chunk)
+                logger.error(f"Failed to upsert project chunk at {offset}: {e}")
+        
+        return synced_ids, failed
+    
+    async def _dispatch_notifications(
+        self,
+        changes: List[Dict[str, Any]],
+        projects: Dict[str, Dict[str, Any]],
+        notify_channels: List[str]
+    ):
+        """通过有界队列并发发送状态变更通知"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=SYNC_NOTIFY_QUEUE_SIZE)
+        
+        async def worker():
+            async with async_session_maker() as db:
+                while True:
+                    change = await queue.get()
+                    try:
+                        if change is None:
+                            return
+                        change['notified'] = await self._send_notifications(
+                            change['project_id'],
+                            change['old_status'],
+                            change['new_status'],
+                            projects[change['project_id']],
+                            db,
+                            notify_channels=notify_channels
+                        )
+                    finally:
+                        queue.task_done()
+        
+        worker_count = min(SYNC_NOTIFY_WORKERS, len(changes))
+        workers = [asyncio.create_task(worker()) for _ in range(worker_count)]
+        
+        for change in changes:
+            await queue.put(change)
+        for _ in workers:
+            await queue.put(None)
+        
+        await asyncio.gather(*workers, return_exceptions=True)
+    
     async def _get_sync_config(self) -> Dict[str, Any]:
         """获取同步配置"""
-        async with AsyncSessionLocal() as db:
+        async with async_session_maker() as db:
             try:
                 config_keys = [
                     'auto_sync_enabled',
@@ -195,7 +499,10 @@ class ProjectSyncScheduler:
                     'cache_ttl',
                     'sync_types',
                     'notify_on_change',
-                    'notify_channels'
+                    'notify_channels',
+                    'sync_mode',
+                    'full_sync_interval_hours',
+                    'sync_cursor'
                 ]
                 
                 config = {}
@@ -218,7 +525,10 @@ class ProjectSyncScheduler:
                     'cache_ttl': config.get('cache_ttl', 30),
                     'sync_types': config.get('sync_types', ['presale', 'aftersales', 'sales']),
                     'notify_on_change': config.get('notify_on_change', True),
-                    'notify_channels': config.get('notify_channels', ['wechat', 'sms'])
+                    'notify_channels': config.get('notify_channels', ['wechat', 'sms']),
+                    'sync_mode': config.get('sync_mode', 'incremental'),
+                    'full_sync_interval_hours': config.get('full_sync_interval_hours', 24),
+                    'sync_cursor': config.get('sync_cursor')
                 }
             
             except Exception as e:
@@ -230,28 +540,16 @@ class ProjectSyncScheduler:
                     'cache_ttl': 30,
                     'sync_types': ['presale', 'aftersales', 'sales'],
                     'notify_on_change': True,
-                    'notify_channels': ['wechat', 'sms']
+                    'notify_channels': ['wechat', 'sms'],
+                    'sync_mode': 'incremental',
+                    'full_sync_interval_hours': 24,
+                    'sync_cursor': None
                 }
     
     async def _fetch_remote_projects(self, project_types: List[str]) -> List[Dict[str, Any]]:
         """从远程API批量获取所有项目"""
         try:
-            REMOTE_API_BASE = "https://remote-api.example.com"  # 需要配置实际地址
-            REMOTE_API_KEY = "your-api-key"  # 需要配置实际密钥
-            
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.get(
-                    f"{REMOTE_API_BASE}/projects",
-                    params={"types": ",".join(project_types)},
-                    headers={"Authorization": f"Bearer {REMOTE_API_KEY}"}
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    return data.get('projects', [])
-                else:
-                    logger.error(f"Remote API error: {response.status_code}")
-                    return []
+            return await RemoteProjectClient().fetch_all(project_types)
         
         except Exception as e:
             logger.error(f"Failed to fetch projects from remote API: {e}")
@@ -308,12 +606,14 @@ class ProjectSyncScheduler:
             raise
     
     async def _send_notifications(self, project_id: str, old_status: str, new_status: str,
-                                 project: Dict[str, Any], db):
+                                 project: Dict[str, Any], db,
+                                 notify_channels: Optional[List[str]] = None):
         """发送项目状态变更通知"""
         try:
-            # 获取配置
-            config = await self._get_sync_config()
-            notify_channels = config.get('notify_channels', [])
+            # 获取配置（批量同步时由调用方传入，避免每个项目查一次配置）
+            if notify_channels is None:
+                config = await self._get_sync_config()
+                notify_channels = config.get('notify_channels', [])
             
             # 生成通知内容
             project_type = project.get('type', 'unknown')
@@ -321,7 +621,7 @@ class ProjectSyncScheduler:
             message = f"您的{project_type}项目【{project_title}】状态已更新：{old_status} → {new_status}"
             
             # 获取需要通知的人员
-            stakeholders = await self._get_project_stakeholders(project_id)
+            stakeholders = await self._get_project_stakeholders(project_id, project)
             
             # 创建通知记录
             for stakeholder in stakeholders:
@@ -339,11 +639,16 @@ class ProjectSyncScheduler:
             
             await db.commit()
             logger.info(f"Notifications created for project {project_id}")
+            return True
         
         except Exception as e:
             logger.error(f"Failed to send notifications: {e}")
+            await db.rollback()
+            return False
     
-    async def _get_project_stakeholders(self, project_id: str) -> List[Dict[str, str]]:
+    async def _get_project_stakeholders(self, project_id: str,
+                                        project_data: Optional[Dict[str, Any]] = None
+                                        ) -> List[Dict[str, str]]:
         """
         获取项目相关人员
         包括：客户、工程师、销售
@@ -352,51 +657,54 @@ class ProjectSyncScheduler:
         try:
             # 这里需要根据实际业务逻辑实现
             # 从project_cache中获取相关人员ID，然后查询CRM系统
-            async with AsyncSessionLocal() as db:
-                stmt = select(ProjectCache).where(ProjectCache.project_id == project_id)
-                result = await db.execute(stmt)
-                cache = result.scalar_one_or_none()
-                
-                if not cache:
-                    return []
-                
-                project_data = json.loads(cache.data)
-                
-                stakeholders = []
-                
-                # 添加客户
-                if project_data.get('customer_id'):
-                    stakeholders.append({
-                        'user_id': project_data.get('customer_id'),
-                        'phone': project_data.get('phone'),
-                        'type': 'customer'
-                    })
-                
-                # 添加工程师（售后）
-                if project_data.get('engineer_id'):
-                    stakeholders.append({
-                        'user_id': project_data.get('engineer_id'),
-                        'phone': project_data.get('engineer_phone'),
-                        'type': 'engineer'
-                    })
-                
-                # 添加销售（售前和销售）
-                if project_data.get('salesman_id'):
-                    stakeholders.append({
-                        'user_id': project_data.get('salesman_id'),
-                        'phone': project_data.get('salesman_phone'),
-                        'type': 'salesman'
-                    })
-                
-                return stakeholders
-        
+            if project_data is None:
+                async with async_session_maker() as db:
+                    stmt = select(ProjectCache).where(ProjectCache.project_id == project_id)
+                    result = await db.execute(stmt)
+                    cache = result.scalar_one_or_none()
+                    
+                    if not cache:
+                        return []
+                    
+                    project_data = json.loads(cache.data)
+            
+            stakeholders = []
+            
+            # 添加客户
+            if project_data.get('customer_id'):
+                stakeholders.append({
+                    'user_id': project_data.get('customer_id'),
+                    'phone': project_data.get('phone'),
+                    'type': 'customer'
+                })
+            
+            # 添加工程师（售后）
+            if project_data.get('engineer_id'):
+                stakeholders.append({
+                    'user_id': project_data.get('engineer_id'),
+                    'phone': project_data.get('engineer_phone'),
+                    'type': 'engineer'
+                })
+            
+            # 添加销售（售前和销售）
+            if project_data.get('salesman_id'):
+                stakeholders.append({
+                    'user_id': project_data.get('salesman_id'),
+                    'phone': project_data.get('salesman_phone'),
+                    'type': 'salesman'
+                })
+            
+            return stakeholders
+    
         except Exception as e:
             logger.error(f"Failed to get project stakeholders: {e}")
             return []
     
     async def _record_sync_history(self, db, total: int, updated: int, unchanged: int,
                                   failed: int, duration: float, status: str,
-                                  changes: List[Dict[str, Any]]):
+                                  changes: List[Dict[str, Any]],
+                                  phase_timings: Optional[Dict[str, float]] = None,
+                                  mode: str = 'full'):
         """记录同步历史"""
         try:
             sync_record = ProjectSyncHistory(
@@ -408,8 +716,9 @@ class ProjectSyncScheduler:
                 failed_count=failed,
                 duration=duration,
                 status=status,
-                message=f"自动同步完成：更新{updated}个，未变更{unchanged}个，失败{failed}个",
+                message=f"自动{'增量' if mode == 'incremental' else '全量'}同步完成：更新{updated}个，未变更{unchanged}个，失败{failed}个",
                 changes=json.dumps(changes, default=str),
+                phase_timings=json.dumps(phase_timings or {}),
                 triggered_by='system'
             )
             db.add(sync_record)
@@ -1,52 +1,86 @@
 """企业微信API集成服务 - 完整实现"""
-import httpx
+import os
 import hashlib
-import time
-from typing import Optional
-from fastapi import HTTPException
+import logging
+from typing import Any, Dict, Optional, Tuple
+
+from app.services.http_client_service import get_http_client
+from app.services.wework_token_manager import wework_token_manager, INVALID_TOKEN_ERRCODES
+
+logger = logging.getLogger(__name__)
 
 
 class WeChatWorkAPI:
     """企业微信API客户端"""
     
-    def __init__(self, corp_id: str, secret: str, agent_id: int):
+    def __init__(self, corp_id: str, secret: str = None, agent_id: int = None, corp_secret: str = None):
         self.corp_id = corp_id
-        self.secret = secret
+        # 兼容以 corp_secret 传参的调用方
+        self.secret = secret or corp_secret
         self.agent_id = agent_id
         self.base_url = "https://qyapi.weixin.qq.com/cgi-bin"
-        self._access_token = None
-        self._token_expires_at = 0
     
     async def get_access_token(self) -> str:
-        """获取访问令牌（带缓存）"""
-        if self._access_token and time.time() < self._token_expires_at:
-            return self._access_token
+        """获取访问令牌（进程内共享缓存，见 wework_token_manager）"""
+        return await wework_token_manager.get_token(self.corp_id, self.secret, self.agent_id)
         
-        url = f"{self.base_url}/gettoken"
-        params = {
-            "corpid": self.corp_id,
-            "corpsecret": self.secret
-        }
+    def invalidate_access_token(self):
+        """企业微信返回令牌失效（40014/42001）时调用，下次请求重新获取"""
+        wework_token_manager.invalidate(self.corp_id, self.agent_id)
+    
+    async def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[Dict[str, Any]] = None,
+        json: Optional[Dict[str, Any]] = None
+    ) -> dict:
+        """
+        调用企业微信API（自动附带 access_token）
         
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            data = response.json()
+        令牌在过期前被其他进程刷新或被企业微信提前作废时，接口返回 40014/42001，
+        此时作废本地缓存的令牌并重新获取，重试一次。
+        
+        Args:
+            method: HTTP方法
+            path: 接口路径（相对 base_url，如 "message/send"）
+            params: 查询参数
+            json: 请求体
+        
+        Returns:
+            接口返回的JSON
+        """
+        client = get_http_client("wework")
+        url = f"{self.base_url}/{path}"
+        
+        for attempt in range(2):
+            access_token = await self.get_access_token()
+            response = await client.request(
+                method,
+                url,
+                params={**(params or {}), "access_token": access_token},
+                json=json
+            )
+            result = response.json()
             
-            if data.get("errcode") != 0:
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"获取access_token失败: {data.get('errmsg')}"
+            if attempt == 0 and result.get("errcode") in INVALID_TOKEN_ERRCODES:
+                logger.warning(
+                    f"[企业微信] access_token 失效 errcode={result.get('errcode')}，刷新后重试: {path}"
                 )
-            
-            self._access_token = data["access_token"]
-            self._token_expires_at = time.time() + 7000  # 提前200秒过期
-            return self._access_token
+                self.invalidate_access_token()
+                continue
+            return result
+    
+    async def get(self, path: str, params: Optional[Dict[str, Any]] = None) -> dict:
+        """GET 请求，见 request"""
+        return await self.request("GET", path, params=params)
+    
+    async def post(self, path: str, json: Optional[Dict[str, Any]] = None) -> dict:
+        """POST 请求，见 request"""
+        return await self.request("POST", path, json=json)
     
     async def send_text_message(self, user_id: str, content: str) -> dict:
         """发送文本消息"""
-        access_token = await self.get_access_token()
-        url = f"{self.base_url}/message/send?access_token={access_token}"
-        
         data = {
             "touser": user_id,
             "msgtype": "text",
@@ -56,9 +90,7 @@ class WeChatWorkAPI:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data)
-            return response.json()
+        return await self.post("message/send", json=data)
     
     async def send_card_message(
         self,
@@ -69,9 +101,6 @@ class WeChatWorkAPI:
         btn_text: str = "查看详情"
     ) -> dict:
         """发送卡片消息"""
-        access_token = await self.get_access_token()
-        api_url = f"{self.base_url}/message/send?access_token={access_token}"
-        
         data = {
             "touser": user_id,
             "msgtype": "textcard",
@@ -84,15 +113,10 @@ class WeChatWorkAPI:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(api_url, json=data)
-            return response.json()
+        return await self.post("message/send", json=data)
     
     async def send_markdown_message(self, user_id: str, content: str) -> dict:
         """发送Markdown消息"""
-        access_token = await self.get_access_token()
-        url = f"{self.base_url}/message/send?access_token={access_token}"
-        
         data = {
             "touser": user_id,
             "msgtype": "markdown",
@@ -102,35 +126,15 @@ class WeChatWorkAPI:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(url, json=data)
-            return response.json()
+        return await self.post("message/send", json=data)
     
     async def get_user_info(self, user_id: str) -> dict:
         """获取成员详情"""
-        access_token = await self.get_access_token()
-        url = f"{self.base_url}/user/get"
-        params = {
-            "access_token": access_token,
-            "userid": user_id
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            return response.json()
+        return await self.get("user/get", params={"userid": user_id})
     
     async def get_external_contact(self, external_userid: str) -> dict:
         """获取外部联系人详情"""
-        access_token = await self.get_access_token()
-        url = f"{self.base_url}/externalcontact/get"
-        params = {
-            "access_token": access_token,
-            "external_userid": external_userid
-        }
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, params=params)
-            return response.json()
+        return await self.get("externalcontact/get", params={"external_userid": external_userid})
 
 
 class GroupBotAPI:
@@ -149,9 +153,9 @@ class GroupBotAPI:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(self.webhook_url, json=data)
-            return response.json()
+        client = get_http_client("group_bot")
+        response = await client.post(self.webhook_url, json=data)
+        return response.json()
     
     async def send_markdown(self, content: str) -> dict:
         """发送Markdown消息"""
@@ -162,9 +166,9 @@ class GroupBotAPI:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(self.webhook_url, json=data)
-            return response.json()
+        client = get_http_client("group_bot")
+        response = await client.post(self.webhook_url, json=data)
+        return response.json()
     
     async def send_news(self, articles: list) -> dict:
         """发送图文消息"""
@@ -175,9 +179,40 @@ class GroupBotAPI:
             }
         }
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(self.webhook_url, json=data)
-            return response.json()
+        client = get_http_client("group_bot")
+        response = await client.post(self.webhook_url, json=data)
+        return response.json()
+
+
+_api_instances: Dict[Tuple[str, str], WeChatWorkAPI] = {}
+
+
+def get_wechat_work_api(
+    corp_id: Optional[str] = None,
+    secret: Optional[str] = None,
+    agent_id: Optional[int] = None
+) -> WeChatWorkAPI:
+    """
+    获取共享的企业微信API客户端（默认读取 CORP_ID / CORP_SECRET / AGENT_ID）
+    
+    Args:
+        corp_id: 企业ID
+        secret: 应用Secret
+        agent_id: 应用AgentId
+    
+    Returns:
+        WeChatWorkAPI实例（同一应用复用同一实例）
+    """
+    corp_id = corp_id or os.getenv("CORP_ID")
+    secret = secret or os.getenv("CORP_SECRET")
+    agent_id = agent_id or os.getenv("AGENT_ID")
+    
+    key = (str(corp_id), str(agent_id))
+    api = _api_instances.get(key)
+    if api is None or api.secret != secret:
+        api = WeChatWorkAPI(corp_id=corp_id, secret=secret, agent_id=agent_id)
+        _api_instances[key] = api
+    return api
 
 
 def verify_signature(token: str, timestamp: str, nonce: str, signature: str) -> bool:
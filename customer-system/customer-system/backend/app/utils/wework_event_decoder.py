@@ -0,0 +1,143 @@
+"""
+企业微信回调XML解码器
+
+企业微信回调是扁平的 XML（<xml><Field><![CDATA[...]]></Field>...</xml>），
+这里用一次预编译正则扫描提取已知字段，不构建 ElementTree：
+- 只保留关心的字段，每个字段只取第一次出现的值
+- CDATA 原样返回，普通文本做标准实体反转义
+- 超过大小上限的报文直接拒绝
+- 快速路径只处理标准报文形态（<xml> 根节点下的叶子字段），不校验内部结构；
+  其他写法（DOCTYPE、注释、自闭合标签、数字字符引用等）回退到 ElementTree 严格解析
+
+基准测试见 bench_wework_callback_parse.py
+"""
+import os
+import re
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, Optional
+
+# 回调报文大小上限（字节）
+WEWORK_CALLBACK_MAX_BODY = int(os.getenv("WEWORK_CALLBACK_MAX_BODY", "65536"))
+
+# 回调事件字段
+EVENT_FIELDS = (
+    'ToUserName', 'FromUserName', 'CreateTime', 'MsgType', 'Event',
+    'ChangeType', 'UserID', 'ExternalUserID', 'State', 'WelcomeCode',
+    'Content', 'MsgId', 'AgentID', 'Encrypt'
+)
+_FIELD_SET = frozenset(EVENT_FIELDS)
+
+_ENTITIES = (('&lt;', '<'), ('&gt;', '>'), ('&quot;', '"'), ('&apos;', "'"), ('&amp;', '&'))
+
+_CDATA_OPEN = '<![CDATA['
+
+
+class CallbackTooLarge(ValueError):
+    """回调报文超过大小上限"""
+
+
+class CallbackParseError(ValueError):
+    """回调报文不是合法的XML"""
+
+
+class WeWorkEvent:
+    """企业微信回调事件"""
+    
+    __slots__ = EVENT_FIELDS
+    
+    def __init__(self, **fields: Optional[str]):
+        for name in EVENT_FIELDS:
+            setattr(self, name, fields.get(name))
+    
+    def get(self, name: str, default: Any = None) -> Any:
+        """按字段名读取（兼容原 dict 写法）"""
+        value = getattr(self, name, None) if name in _FIELD_SET else None
+        return default if value is None else value
+    
+    def to_dict(self, fields=EVENT_FIELDS) -> Dict[str, Optional[str]]:
+        """
+        转为 dict
+        
+        Args:
+            fields: 需要输出的字段
+        """
+        return {name: getattr(self, name) for name in fields}
+    
+    def __repr__(self):
+        return f"WeWorkEvent(MsgType={self.MsgType!r}, Event={self.Event!r}, ChangeType={self.ChangeType!r})"
+
+
+# 叶子节点：<Field><![CDATA[...]]></Field> 或 <Field>text</Field>
+# CDATA 内容按「不含 ]]>」展开匹配，比非贪婪 .*? 少回溯
+_LEAF_PATTERN = re.compile(r'<(\w+)>(?:<!\[CDATA\[([^\]]*(?:\](?!\]>)[^\]]*)*)\]\]>|([^<]*))</\1>')
+# 扫描器不处理的写法（注释、DOCTYPE、自闭合标签、数字字符引用）
+_UNSUPPORTED_MARKERS = ('<!--', '<!DOCTYPE', '/>', '&#')
+
+
+def _is_flat_envelope(xml: str) -> bool:
+    """是否为企业微信标准报文：<xml>...</xml>，可带XML声明"""
+    head = xml.lstrip()
+    if head.startswith('<?'):
+        head = head[head.find('?>') + 2:].lstrip()
+    if not (head.startswith('<xml>') and xml.rstrip().endswith('</xml>')):
+        return False
+    return not any(marker in xml for marker in _UNSUPPORTED_MARKERS)
+
+
+def _unescape(text: str) -> str:
+    if '&' not in text:
+        return text
+    for entity, char in _ENTITIES:
+        text = text.replace(entity, char)
+    return text
+
+
+def _scan(xml: str) -> Dict[str, str]:
+    """单次正则扫描扁平报文，返回已知字段"""
+    values: Dict[str, str] = {}
+    for name, cdata, text in _LEAF_PATTERN.findall(xml):
+        if name in _FIELD_SET and name not in values:
+            values[name] = cdata or _unescape(text)
+    return values
+
+
+def _parse_with_etree(xml: str) -> Dict[str, str]:
+    """ElementTree 回退路径（只取根节点下的字段）"""
+    try:
+        root = ET.fromstring(xml)
+    except ET.ParseError as e:
+        raise CallbackParseError(str(e)) from e
+    
+    values: Dict[str, str] = {}
+    for child in root:
+        if child.tag in _FIELD_SET and child.tag not in values:
+            values[child.tag] = child.text or ''
+    return values
+
+
+def decode_event(body: bytes, max_size: int = WEWORK_CALLBACK_MAX_BODY) -> WeWorkEvent:
+    """
+    解码企业微信回调XML
+    
+    Args:
+        body: 请求体
+        max_size: 大小上限（字节）
+    
+    Returns:
+        WeWorkEvent，缺失的字段为 None
+    
+    Raises:
+        CallbackTooLarge: 超过大小上限
+        CallbackParseError: 不是合法的XML
+    """
+    if len(body) > max_size:
+        raise CallbackTooLarge(f"回调报文过大: {len(body)} > {max_size}")
+    
+    try:
+        xml = body.decode('utf-8') if isinstance(body, (bytes, bytearray)) else body
+    except UnicodeDecodeError as e:
+        raise CallbackParseError(f"编码错误: {e}") from e
+    
+    if _is_flat_envelope(xml):
+        return WeWorkEvent(**_scan(xml))
+    return WeWorkEvent(**_parse_with_etree(xml))
@@ -0,0 +1,106 @@
+"""
+限流放行延迟基准测试
+对比旧的 @rate_limit 路径（每次请求同步 EVAL 整段 Lua 脚本）与令牌桶租约限流器
+
+用法：
+    python bench_rate_limiter.py                      # 使用 REDIS_URL（默认 redis://localhost:6379/0）
+    python bench_rate_limiter.py --requests 20000 --max-qps 5000
+
+Redis 不可用时只测试纯本地令牌桶
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+import redis
+import redis.asyncio as aioredis
+
+from app.services.sentinel_service import QPS_WINDOW_SCRIPT, TokenBucketLimiter
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+def legacy_is_allowed(client: redis.Redis, resource: str, max_qps: int) -> bool:
+    """旧实现：每次请求 EVAL 完整脚本，每次放行写入一个 ZSET 成员"""
+    key = f"bench:rate_limit:qps:{resource}:global"
+    return client.eval(QPS_WINDOW_SCRIPT, 1, key, max_qps, int(time.time()), 1) == 1
+
+
+def summarize(name: str, samples: list, allowed: int, elapsed: float):
+    samples.sort()
+    p = lambda q: samples[min(len(samples) - 1, int(len(samples) * q))] * 1e6
+    print(
+        f"{name:<28} 放行 {allowed:>6}/{len(samples):<6} "
+        f"mean {statistics.mean(samples) * 1e6:8.1f}us  p50 {p(0.5):8.1f}us  "
+        f"p99 {p(0.99):8.1f}us  max {samples[-1] * 1e6:9.1f}us  总耗时 {elapsed:.2f}s"
+    )
+
+
+async def bench_legacy(client: redis.Redis, requests: int, max_qps: int):
+    samples, allowed = [], 0
+    start = time.perf_counter()
+    for _ in range(requests):
+        t = time.perf_counter()
+        # 与旧装饰器相同：在协程中直接做同步Redis调用
+        allowed += legacy_is_allowed(client, "bench", max_qps)
+        samples.append(time.perf_counter() - t)
+    summarize("旧实现 (同步 EVAL)", samples, allowed, time.perf_counter() - start)
+
+
+async def bench_bucket(name: str, limiter: TokenBucketLimiter, requests: int, concurrency: int):
+    samples, allowed = [], 0
+    
+    async def worker(count: int):
+        nonlocal allowed
+        for _ in range(count):
+            t = time.perf_counter()
+            allowed += await limiter.acquire("bench")
+            samples.append(time.perf_counter() - t)
+    
+    start = time.perf_counter()
+    per_worker = requests // concurrency
+    await asyncio.gather(*[worker(per_worker) for _ in range(concurrency)])
+    summarize(name, samples, allowed, time.perf_counter() - start)
+    stats = limiter.get_stats()
+    print(f"{'':<28} Redis租约 {stats['leases']} 次，本地判定 {stats['local_decisions']} 次")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="限流放行延迟基准测试")
+    parser.add_argument("--requests", type=int, default=20000, help="请求数")
+    parser.add_argument("--max-qps", type=int, default=1000000, help="限流阈值（默认足够大，只测放行路径）")
+    parser.add_argument("--concurrency", type=int, default=50, help="令牌桶测试的并发协程数")
+    args = parser.parse_args()
+    
+    sync_client = redis.from_url(REDIS_URL, socket_connect_timeout=1)
+    try:
+        sync_client.ping()
+        redis_ok = True
+    except Exception as e:
+        print(f"Redis 不可用（{REDIS_URL}）: {e}，只测试纯本地令牌桶\n")
+        redis_ok = False
+    
+    if redis_ok:
+        sync_client.delete("bench:rate_limit:qps:bench:global", "bench:rate_limit:bucket:bench")
+        await bench_legacy(sync_client, args.requests, args.max_qps)
+        
+        async_client = aioredis.from_url(REDIS_URL)
+        limiter = TokenBucketLimiter(args.max_qps, redis_client=async_client, key_prefix="bench:rate_limit:bucket")
+        await bench_bucket("令牌桶 (Redis 租约)", limiter, args.requests, args.concurrency)
+        await async_client.aclose()
+        sync_client.delete("bench:rate_limit:qps:bench:global", "bench:rate_limit:bucket:bench")
+    
+    local = TokenBucketLimiter(args.max_qps)
+    local._redis_resolved = True  # 不使用Redis
+    await bench_bucket("令牌桶 (纯本地)", local, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
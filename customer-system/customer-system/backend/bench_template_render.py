@@ -0,0 +1,83 @@
+"""
+模板渲染微基准测试
+对比旧的逐变量 str.replace 渲染与编译模板渲染
+
+用法：
+    python bench_template_render.py
+"""
+import sys
+import timeit
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.services.template_engine import CompiledTemplate, render_template, template_cache
+
+
+TEMPLATE = (
+    "【{company_name}】尊敬的{customer_name}，您好！\n"
+    "您的项目「${project_name}」（编号：{project_no}）当前状态：{status}，完成度{progress}%。\n"
+    "负责工程师：{engineer_name}（{engineer_phone}），预计完成时间：{{finish_date}}。\n"
+    "今日待处理工单{pending_count}个，处理中{processing_count}个，已完成{completed_count}个。\n"
+    "如有疑问请回复本消息或致电{service_phone}。{current_date} {current_time}"
+)
+
+VARIABLES = {
+    "company_name": "智能售前售后系统",
+    "customer_name": "张三",
+    "project_name": "空调安装",
+    "project_no": "P20240203001",
+    "status": "处理中",
+    "progress": 60,
+    "engineer_name": "李四",
+    "engineer_phone": "13800138000",
+    "finish_date": "2024-02-10",
+    "pending_count": 12,
+    "processing_count": 5,
+    "completed_count": 30,
+    "service_phone": "400-800-8888",
+    "current_date": "2024-02-03",
+    "current_time": "09:00:00",
+}
+
+
+def render_replace_loop(template_content: str, variables: dict) -> str:
+    """旧实现：每个变量做两次整串替换"""
+    result = template_content
+    for key, value in variables.items():
+        result = result.replace(f"{{{key}}}", str(value))
+        result = result.replace(f"${{{key}}}", str(value))
+    return result
+
+
+def main():
+    number = 100000
+    
+    compiled = CompiledTemplate(TEMPLATE)
+    template_cache.clear()
+    
+    cases = [
+        ("str.replace 循环（旧）", lambda: render_replace_loop(TEMPLATE, VARIABLES)),
+        ("编译模板 render（预编译）", lambda: compiled.render(VARIABLES)),
+        ("render_template（LRU缓存）", lambda: render_template(TEMPLATE, VARIABLES, 1, "v1")),
+    ]
+    
+    print("=" * 60)
+    print(f"模板长度: {len(TEMPLATE)} 字符, 变量数: {len(VARIABLES)}, 迭代: {number}")
+    print("=" * 60)
+    
+    baseline = None
+    for name, func in cases:
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        per_call_us = seconds / number * 1e6
+        if baseline is None:
+            baseline = per_call_us
+        print(f"{name:<28} {per_call_us:8.2f} µs/次   x{baseline / per_call_us:.2f}")
+    
+    print("\n渲染结果一致性检查：")
+    print(compiled.render(VARIABLES))
+
+
+if __name__ == "__main__":
+    main()
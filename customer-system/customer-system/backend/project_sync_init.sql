@@ -45,6 +45,7 @@ CREATE TABLE IF NOT EXISTS project_sync_history (
     changes LONGTEXT COMMENT '变更详情（JSON格式）',
     triggered_by VARCHAR(100) COMMENT '触发者（auto/user_id）',
     sync_config LONGTEXT COMMENT '同步时的配置（JSON格式）',
+    phase_timings TEXT COMMENT '各阶段耗时（JSON格式，秒）',
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
     KEY idx_sync_time (sync_time DESC),
@@ -190,6 +191,16 @@ INSERT INTO project_sync_config (config_key, config_value, description) VALUES
     'max_sync_duration',
     '{"value": 300}',
     '最大同步耗时（秒）'
+),
+(
+    'sync_mode',
+    '{"value": "incremental"}',
+    '同步模式: incremental(增量) | full(每次全量)'
+),
+(
+    'full_sync_interval_hours',
+    '{"value": 24}',
+    '增量模式下全量对账间隔（小时）'
 )
 ON DUPLICATE KEY UPDATE config_value = VALUES(config_value);
 
@@ -0,0 +1,96 @@
+"""
+AI模型本地桩服务（OpenAI 兼容的 /v1/chat/completions）
+用于离线测试 AI 网关（ai_gateway）的缓存、并发合并、并发上限与超时
+
+接口：
+    POST /v1/chat/completions    返回固定格式的回复（内容回显用户消息）
+    GET  /_stats                 已处理请求数、当前/峰值并发
+    POST /_reset                 清零统计
+
+用法：
+    python stub_ai_model_server.py --port 9200 --latency 0.5
+    python stub_ai_model_server.py --port 9200 --latency 0.2 --fail-rate 0.1
+    # 在模型配置中设置
+    api_endpoint = http://127.0.0.1:9200/v1/chat/completions
+    extra_config = {"timeout": 2, "max_concurrency": 4}
+"""
+import sys
+import time
+import random
+import asyncio
+import argparse
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI, HTTPException, Request
+import uvicorn
+
+app = FastAPI(title="AI模型桩服务")
+settings = {"latency": 0.5, "jitter": 0.0, "fail_rate": 0.0}
+stats = {"requests": 0, "in_flight": 0, "peak_in_flight": 0, "failures": 0}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """模拟模型推理：等待 latency（± jitter）秒后回显最后一条用户消息"""
+    payload = await request.json()
+    messages = payload.get("messages") or []
+    prompt = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    
+    stats["requests"] += 1
+    stats["in_flight"] += 1
+    stats["peak_in_flight"] = max(stats["peak_in_flight"], stats["in_flight"])
+    try:
+        await asyncio.sleep(max(0.0, settings["latency"] + random.uniform(-settings["jitter"], settings["jitter"])))
+        if random.random() < settings["fail_rate"]:
+            stats["failures"] += 1
+            raise HTTPException(status_code=500, detail="模拟模型错误")
+    finally:
+        stats["in_flight"] -= 1
+    
+    content = f"[{payload.get('model')}] 已收到：{prompt}"
+    return {
+        "id": f"chatcmpl-{stats['requests']}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": payload.get("model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": {"prompt_tokens": len(prompt), "completion_tokens": len(content), "total_tokens": len(prompt) + len(content)}
+    }
+
+
+@app.get("/_stats")
+async def get_stats():
+    """获取统计"""
+    return stats
+
+
+@app.post("/_reset")
+async def reset_stats():
+    """清零统计"""
+    for key in stats:
+        stats[key] = 0
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AI模型本地桩服务")
+    parser.add_argument("--port", type=int, default=9200, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.5, help="每次推理的耗时（秒）")
+    parser.add_argument("--jitter", type=float, default=0.0, help="耗时随机抖动（秒）")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 500 的比例")
+    args = parser.parse_args()
+    
+    settings.update(latency=args.latency, jitter=args.jitter, fail_rate=args.fail_rate)
+    print(f"AI模型桩服务监听 http://127.0.0.1:{args.port}/v1/chat/completions (latency={args.latency}s)")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+远程项目API本地桩服务
+用于离线测试项目增量同步（RemoteProjectClient / ProjectSyncScheduler）
+
+接口：
+    GET  /projects?types=&updated_since=&cursor=&limit=   分页列出项目（按更新时间+ID排序）
+    GET  /projects/{project_id}                          单个项目
+    POST /_touch?count=10                                 随机修改若干项目的状态（模拟远程变更）
+
+用法：
+    python stub_remote_project_api.py --projects 20000 --port 9100
+    # 后端配置
+    REMOTE_PROJECT_API_BASE=http://127.0.0.1:9100
+"""
+import sys
+import random
+import argparse
+import base64
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Optional
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from fastapi import FastAPI, HTTPException, Query
+import uvicorn
+
+TYPES = ["presale", "aftersales", "sales"]
+STATUSES = ["pending", "processing", "testing", "completed"]
+
+app = FastAPI(title="远程项目API桩服务")
+projects = {}
+
+
+def seed(count: int):
+    """生成测试项目（更新时间分布在过去30天内）"""
+    now = datetime.utcnow()
+    for i in range(1, count + 1):
+        project_id = f"P{i:06d}"
+        projects[project_id] = {
+            "id": project_id,
+            "type": TYPES[i % len(TYPES)],
+            "title": f"测试项目{i}",
+            "status": random.choice(STATUSES),
+            "progress": random.randint(0, 100),
+            "customer_id": f"C{i:06d}",
+            "customer_name": f"客户{i}",
+            "engineer_name": f"工程师{i % 50}",
+            "salesman_name": f"销售{i % 20}",
+            "updated_at": (now - timedelta(minutes=random.randint(0, 30 * 24 * 60))).isoformat()
+        }
+
+
+def encode_cursor(updated_at: str, project_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{updated_at}|{project_id}".encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    updated_at, project_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    return updated_at, project_id
+
+
+@app.get("/projects")
+async def list_projects(
+    types: str = "",
+    updated_since: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000)
+):
+    """分页列出项目（游标为 (updated_at, id) 键集）"""
+    server_time = datetime.utcnow().isoformat()
+    wanted = set(types.split(",")) if types else None
+    
+    rows = [
+        p for p in projects.values()
+        if (not wanted or p["type"] in wanted)
+        and (not updated_since or p["updated_at"] > updated_since)
+    ]
+    rows.sort(key=lambda p: (p["updated_at"], p["id"]))
+    
+    if cursor:
+        after = decode_cursor(cursor)
+        rows = [p for p in rows if (p["updated_at"], p["id"]) > after]
+    
+    page = rows[:limit]
+    next_cursor = encode_cursor(page[-1]["updated_at"], page[-1]["id"]) if len(rows) > limit else None
+    
+    return {"projects": page, "next_cursor": next_cursor, "server_time": server_time}
+
+
+@app.get("/projects/{project_id}")
+async def get_project(project_id: str):
+    """获取单个项目"""
+    project = projects.get(project_id)
+    if not project:
+        raise HTTPException(status_code=404, detail="项目不存在")
+    return project
+
+
+@app.post("/_touch")
+async def touch_projects(count: int = 10):
+    """随机修改若干项目，返回被修改的项目ID"""
+    now = datetime.utcnow().isoformat()
+    touched = random.sample(list(projects), min(count, len(projects)))
+    for project_id in touched:
+        projects[project_id]["status"] = random.choice(STATUSES)
+        projects[project_id]["progress"] = random.randint(0, 100)
+        projects[project_id]["updated_at"] = now
+    return {"touched": touched}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="远程项目API本地桩服务")
+    parser.add_argument("--projects", type=int, default=5000, help="生成的项目数量")
+    parser.add_argument("--port", type=int, default=9100, help="监听端口")
+    args = parser.parse_args()
+    
+    seed(args.projects)
+    print(f"已生成 {len(projects)} 个项目，监听 http://127.0.0.1:{args.port}")
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+回归检查：同一批量任务被重复执行（消息重投 / 并发执行）时，每条记录只发送一次，
+任务统计不重复累加
+
+需要可用的 PostgreSQL（DATABASE_URL），脚本只写入并清理自己创建的任务和记录
+
+用法：
+    python test_batch_task_executor.py
+"""
+import sys
+import uuid
+import asyncio
+from collections import Counter
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from sqlalchemy import delete, select
+
+from app.database import async_session_maker, engine
+from app.models_messaging import MessageRecord, MessageTask, MessageStatus
+from app.services.batch_task_executor import BatchTaskExecutor
+
+RECORD_COUNT = 120
+
+
+async def create_task() -> str:
+    task_id = f"test_batch_{uuid.uuid4().hex[:12]}"
+    async with async_session_maker() as db:
+        db.add(MessageTask(task_id=task_id, title="批量执行回归检查", status="pending", total_count=RECORD_COUNT))
+        await db.flush()
+        db.add_all([
+            MessageRecord(
+                record_id=f"{task_id}_{i}",
+                task_id=task_id,
+                receiver_userid=f"user-{i}",
+                channel="wework",
+                content="测试",
+                status=MessageStatus.PENDING.value
+            )
+            for i in range(RECORD_COUNT)
+        ])
+        await db.commit()
+    return task_id
+
+
+async def cleanup(task_id: str):
+    async with async_session_maker() as db:
+        await db.execute(delete(MessageRecord).where(MessageRecord.task_id == task_id))
+        await db.execute(delete(MessageTask).where(MessageTask.task_id == task_id))
+        await db.commit()
+
+
+async def main():
+    if engine.dialect.name != "postgresql":
+        # 执行器使用 = ANY(:ids) 和 UPDATE ... RETURNING 认领，只支持 PostgreSQL
+        sys.exit(f"需要 PostgreSQL，当前 DATABASE_URL 方言为 {engine.dialect.name}")
+    
+    task_id = await create_task()
+    sent = Counter()
+    
+    async def send(message):
+        sent[message["record_id"]] += 1
+        await asyncio.sleep(0.01)
+        # 每 7 条失败一条，检查失败计数同样不重复
+        return (message["record_id"] % 7 != 0), "模拟失败"
+    
+    try:
+        def executor():
+            return BatchTaskExecutor(send=send, page_size=25, concurrency=10)
+        
+        # 同一任务并发执行两次，完成后再被重投一次
+        await asyncio.gather(executor().run(task_id), executor().run(task_id))
+        await executor().run(task_id)
+        
+        duplicated = [record_id for record_id, count in sent.items() if count > 1]
+        assert not duplicated, f"记录被重复发送: {duplicated[:10]}"
+        assert len(sent) == RECORD_COUNT, f"发送 {len(sent)} 条，应为 {RECORD_COUNT}"
+        
+        async with async_session_maker() as db:
+            task = (await db.execute(select(MessageTask).where(MessageTask.task_id == task_id))).scalar_one()
+            statuses = Counter((await db.execute(
+                select(MessageRecord.status).where(MessageRecord.task_id == task_id)
+            )).scalars().all())
+        
+        expected_failed = sum(1 for record_id in sent if record_id % 7 == 0)
+        assert task.success_count == RECORD_COUNT - expected_failed, task.success_count
+        assert task.failed_count == expected_failed, task.failed_count
+        assert task.status == "completed", task.status
+        assert statuses[MessageStatus.SUCCESS.value] + statuses[MessageStatus.FAILED.value] == RECORD_COUNT, statuses
+        print(f"✅ {RECORD_COUNT} 条记录各发送一次，任务统计 成功 {task.success_count} / 失败 {task.failed_count}")
+    finally:
+        await cleanup(task_id)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,102 @@
+"""
+缓存 single-flight 检查：并发未命中只加载一次、发起加载的请求被取消不影响其他等待者、
+加载异常传给所有等待者且下次重新加载
+
+不需要 Redis（未配置或不可用时仅使用进程内缓存）
+
+用法：
+    python test_cache_single_flight.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.services.cache_service import CacheService, SOURCE_LOADER
+
+
+def new_cache() -> CacheService:
+    cache = CacheService()
+    # 本检查只验证进程内逻辑，不访问 Redis
+    cache._async_redis_down_until = float("inf")
+    return cache
+
+
+async def check_coalesce():
+    cache = new_cache()
+    calls = 0
+    
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return {"value": 1}
+    
+    results = await asyncio.gather(*(cache.get_or_load("test", 1, loader) for _ in range(10)))
+    assert calls == 1, f"loader 执行 {calls} 次，应为 1"
+    assert all(result == ({"value": 1}, SOURCE_LOADER) for result in results), results
+    assert not cache._inflight
+    
+    value, source = await cache.get_or_load("test", 1, loader)
+    assert value == {"value": 1} and source != SOURCE_LOADER, (value, source)
+    print("✅ 并发未命中：loader 执行 1 次，之后命中缓存")
+
+
+async def check_leader_cancelled():
+    cache = new_cache()
+    calls = 0
+    
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.05)
+        return "loaded"
+    
+    leader = asyncio.create_task(cache.get_or_load("test", 2, loader))
+    await asyncio.sleep(0)
+    followers = [asyncio.create_task(cache.get_or_load("test", 2, loader)) for _ in range(3)]
+    await asyncio.sleep(0.01)
+    leader.cancel()
+    
+    results = await asyncio.gather(*followers)
+    assert leader.cancelled()
+    assert results == [("loaded", SOURCE_LOADER)] * 3, results
+    assert calls == 1, f"loader 执行 {calls} 次，应为 1"
+    assert cache.local.get("test:2") == "loaded"
+    print("✅ 发起加载的请求被取消：其他等待者拿到结果，缓存照常回填")
+
+
+async def check_loader_error():
+    cache = new_cache()
+    calls = 0
+    
+    async def loader():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        if calls == 1:
+            raise RuntimeError("数据库不可用")
+        return "recovered"
+    
+    results = await asyncio.gather(
+        *(cache.get_or_load("test", 3, loader) for _ in range(3)),
+        return_exceptions=True
+    )
+    assert all(isinstance(result, RuntimeError) for result in results), results
+    assert not cache._inflight
+    
+    value, source = await cache.get_or_load("test", 3, loader)
+    assert (value, source) == ("recovered", SOURCE_LOADER) and calls == 2, (value, source, calls)
+    print("✅ 加载异常：所有等待者收到同一异常，下次调用重新加载")
+
+
+async def main():
+    await check_coalesce()
+    await check_leader_cancelled()
+    await check_loader_error()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+回归检查：批量发送分多批写入、且在同一秒内完成时，消息编号不能重复
+（messages.message_no 有 UNIQUE 约束，重复会导致整批 INSERT 失败）
+
+用法：
+    python test_message_no_bulk.py
+"""
+import sys
+import asyncio
+from datetime import datetime
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.services import unified_message_sender as sender_module
+from app.services.unified_message_sender import UnifiedMessageSender
+
+FIXED_NOW = datetime(2024, 2, 3, 10, 30, 0)
+
+
+class FrozenDatetime(datetime):
+    """所有批次都落在同一秒"""
+    
+    @classmethod
+    def now(cls, tz=None):
+        return FIXED_NOW
+
+
+class RecordingConnection:
+    def __init__(self, written):
+        self.written = written
+    
+    async def fetch(self, query, *args):
+        # 与 create_message_records_bulk 的参数顺序一致：$9 为消息编号数组
+        message_nos, recipient_values = args[8], args[9]
+        self.written.extend(message_nos)
+        return [{"message_no": no, "recipient_value": value} for no, value in zip(message_nos, recipient_values)]
+
+
+class RecordingPool:
+    def __init__(self):
+        self.written = []
+    
+    def acquire(self):
+        pool = self
+        
+        class _Acquire:
+            async def __aenter__(self):
+                return RecordingConnection(pool.written)
+            
+            async def __aexit__(self, *args):
+                return False
+        
+        return _Acquire()
+
+
+async def main():
+    sender_module.datetime = FrozenDatetime
+    pool = RecordingPool()
+    sender = UnifiedMessageSender(pool)
+    
+    # 没有客户ID的接收者（如群机器人、AI目标）最容易撞号
+    recipients = [{"identifier": f"bot-{i}", "customer_id": None} for i in range(25)]
+    chunk_size = 10
+    
+    # 同一发送任务的多个批次
+    for offset in range(0, len(recipients), chunk_size):
+        await sender.create_message_records_bulk(
+            template_id=1,
+            channel_type="GROUP_BOT",
+            recipients=recipients[offset:offset + chunk_size],
+            content="测试",
+            start_index=offset
+        )
+    
+    # 同一秒内另一个并发的批量发送
+    await asyncio.gather(*[
+        sender.create_message_records_bulk(
+            template_id=2,
+            channel_type="GROUP_BOT",
+            recipients=recipients[:chunk_size],
+            content="测试"
+        )
+        for _ in range(2)
+    ])
+    
+    total = len(pool.written)
+    unique = len(set(pool.written))
+    assert total == 45, total
+    assert unique == total, f"消息编号重复: {total - unique} 个"
+    assert max(len(no) for no in pool.written) <= 50, "超过 message_no VARCHAR(50)"
+    print(f"✅ {total} 条消息编号均不重复（同一秒、多批次、并发批量发送）")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+"""
+外发限流闸门检查：并发上限、排队超时、排队中被取消
+
+用法：
+    python test_outbound_limiter.py
+"""
+import sys
+import asyncio
+from pathlib import Path
+
+# 添加项目根目录到Python路径
+sys.path.insert(0, str(Path(__file__).parent))
+
+from app.services import outbound_limiter as limiter_module
+from app.services.outbound_limiter import OutboundLimiter, OutboundQueueTimeout, _Gate
+
+
+async def check_concurrency_cap():
+    gate = _Gate("test", quota=None, max_limit=3, adaptive=False)
+    running = 0
+    peak = 0
+    
+    async def send():
+        nonlocal running, peak
+        await gate.acquire()
+        try:
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+        finally:
+            running -= 1
+            gate.release()
+    
+    await asyncio.gather(*(send() for _ in range(20)))
+    assert peak == 3, f"并发峰值 {peak}，应为 3"
+    assert gate.in_flight == 0 and not gate._waiters, gate.snapshot()
+    print("✅ 并发上限：峰值 3，全部完成后槽位归零")
+
+
+async def check_queue_timeout():
+    limiter_module.OUTBOUND_MAX_WAIT = 0.05
+    limiter = OutboundLimiter()
+    release = asyncio.Event()
+    
+    async def slow():
+        await release.wait()
+        return "ok"
+    
+    # 占满默认并发上限
+    holders = [
+        asyncio.create_task(limiter.run("TEST", None, slow))
+        for _ in range(limiter_module.DEFAULT_CONCURRENCY)
+    ]
+    await asyncio.sleep(0)
+    
+    try:
+        await limiter.run("TEST", None, slow)
+        raise AssertionError("排队超时未触发")
+    except OutboundQueueTimeout:
+        pass
+    
+    release.set()
+    assert await asyncio.gather(*holders) == ["ok"] * limiter_module.DEFAULT_CONCURRENCY
+    stats = limiter.get_stats()["TEST"]
+    assert stats["queue_timeouts"] == 1 and stats["in_flight"] == 0 and stats["queued"] == 0, stats
+    print("✅ 排队超时：抛出 OutboundQueueTimeout，不占用槽位")
+
+
+async def check_cancelled_waiter():
+    gate = _Gate("test", quota=None, max_limit=1, adaptive=False)
+    await gate.acquire()
+    
+    # 取消后、等待者恢复执行前，release() 已把它的 future 从队列弹出
+    waiter = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0)
+    waiter.cancel()
+    gate.release()
+    try:
+        await waiter
+        raise AssertionError("等待者未被取消")
+    except asyncio.CancelledError:
+        pass
+    assert gate.in_flight == 0 and not gate._waiters, gate.snapshot()
+    
+    # 已分到槽位但在恢复执行前被取消：槽位让出
+    await gate.acquire()
+    waiter = asyncio.create_task(gate.acquire())
+    await asyncio.sleep(0)
+    gate.release()
+    waiter.cancel()
+    try:
+        await waiter
+    except asyncio.CancelledError:
+        pass
+    assert gate.in_flight == 0 and not gate._waiters, gate.snapshot()
+    print("✅ 排队中取消：抛出 CancelledError，槽位不泄漏")
+
+
+async def main():
+    await check_concurrency_cap()
+    await check_queue_timeout()
+    await check_cancelled_waiter()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())